@@ -0,0 +1,209 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from dataclasses import asdict, astuple, dataclass
+from typing import Awaitable, Callable
+
+from common import WordQuizz
+from core import ApiRejectedError, post_attempts
+from wordset import WordsetAttempt
+
+logger = logging.getLogger(__name__)
+
+# client errors that pass: an expired token or a timeout on the backend side
+RETRY_STATUSES = (401, 408, 429)
+
+
+@dataclass
+class AttemptStats:
+    recorded: int = 0
+    delivered: int = 0
+    failed_batches: int = 0
+    rejected: int = 0
+    dropped: int = 0
+
+
+class AttemptBuffer:
+    """Collect quiz attempts and send them to the API in batches.
+
+    Every attempt is appended to a journal file before it is acknowledged
+    and the journal is rewritten only after a batch was accepted, so
+    attempts are delivered at least once even across restarts. When the
+    buffer is full, ``record`` waits up to ``max_wait`` seconds for a batch
+    to be sent, then gives the attempt up. Batches the backend refuses for
+    good and given up attempts go to the dead-letter journal next to the
+    journal, ``<journal>.dead``.
+    """
+
+    def __init__(self, get_token: Callable[[], Awaitable[str | None]],
+                 journal_path: str | None = None, batch_size: int = 100,
+                 flush_interval: float = 5, max_buffer: int = 10000,
+                 max_backoff: float = 60, max_wait: float = 5):
+        self.get_token = get_token
+        self.journal_path = journal_path
+        self.dead_letter_path = f"{journal_path}.dead" if journal_path else None
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.max_backoff = max_backoff
+        self.max_wait = max_wait
+        self.stats = AttemptStats()
+        self._buffer: list[WordsetAttempt] = []
+        self._journal = None
+        self._batch_ready = asyncio.Event()
+        self._space = asyncio.Event()
+        self._space.set()
+        self._flushing = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self._load_journal()
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    def _load_journal(self) -> None:
+        if not self.journal_path:
+            return None
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self._buffer.append(WordsetAttempt(*json.loads(line)))
+                    except (ValueError, TypeError):
+                        logger.error("attempts journal :: bad line :: %r", line)
+            logger.info("attempts journal :: restored %s attempts", len(self._buffer))
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+
+    @staticmethod
+    def _lines(attempts: list[WordsetAttempt]) -> str:
+        return "".join(json.dumps(astuple(attempt), ensure_ascii=False) + "\n" for attempt in attempts)
+
+    def _write_journal(self, attempts: list[WordsetAttempt]) -> None:
+        if self._journal is None:
+            return None
+        self._journal.write(self._lines(attempts))
+        self._journal.flush()
+
+    def _dead_letter(self, attempts: list[WordsetAttempt]) -> None:
+        if not self.dead_letter_path:
+            return None
+        with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+            f.write(self._lines(attempts))
+
+    async def _compact_journal(self) -> None:
+        """Rewrite the journal with the buffered attempts in a thread"""
+        if self._journal is None:
+            return None
+        tmp_path = f"{self.journal_path}.tmp"
+        snapshot = list(self._buffer)
+
+        def write() -> None:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(self._lines(snapshot))
+
+        await asyncio.to_thread(write)
+        if self._journal is None:
+            return None
+        # attempts recorded while the snapshot was written, only flush removes any
+        recorded = self._buffer[len(snapshot):]
+        self._journal.close()
+        with open(tmp_path, "a", encoding="utf-8") as f:
+            f.write(self._lines(recorded))
+        os.replace(tmp_path, self.journal_path)
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+
+    async def record(self, attempt: WordsetAttempt) -> None:
+        if len(self._buffer) >= self.max_buffer:
+            self._space.clear()
+            self._batch_ready.set()
+            try:
+                await asyncio.wait_for(self._space.wait(), self.max_wait)
+            except asyncio.TimeoutError:
+                pass
+            if len(self._buffer) >= self.max_buffer:
+                # the backend is down for long, an answer must not wait for it
+                self.stats.dropped += 1
+                self._dead_letter([attempt])
+                return None
+        self._buffer.append(attempt)
+        self._write_journal([attempt])
+        self.stats.recorded += 1
+        if len(self._buffer) >= self.batch_size:
+            self._batch_ready.set()
+
+    async def flush(self) -> bool:
+        """Send the oldest batch, returning False if it should be retried later."""
+        async with self._flushing:
+            batch = self._buffer[:self.batch_size]
+            if not batch:
+                return True
+            bot_token = await self.get_token()
+            rejected = None
+            try:
+                delivered = bool(bot_token) and await post_attempts(
+                    bot_token, [asdict(attempt) for attempt in batch]
+                )
+            except ApiRejectedError as e:
+                # a success answer that could not be read was still accepted
+                delivered = e.status is not None and e.status < 400
+                if not delivered and e.status not in RETRY_STATUSES:
+                    rejected = e.status
+            if rejected is not None:
+                logger.error("attempts :: batch of %s rejected with %s, moved to the dead letters",
+                             len(batch), rejected)
+                self._dead_letter(batch)
+                self.stats.rejected += len(batch)
+            elif not delivered:
+                self.stats.failed_batches += 1
+                return False
+            else:
+                self.stats.delivered += len(batch)
+            del self._buffer[:len(batch)]
+            await self._compact_journal()
+            self._space.set()
+            return True
+
+    async def _flush_loop(self) -> None:
+        backoff = self.flush_interval
+        while True:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_ready.clear()
+            while self._buffer:
+                if await self.flush():
+                    backoff = self.flush_interval
+                    if len(self._buffer) < self.batch_size:
+                        break
+                    continue
+                logger.warning("attempts :: flush failed, retry in %.0fs", backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+
+def make_attempt(user_id: int, word: WordQuizz, attempt: str, is_correct: bool) -> WordsetAttempt:
+    return WordsetAttempt(
+        user_id=user_id,
+        word_id=word.id,
+        word=word.word,
+        correct=word.correct,
+        attempt=attempt,
+        is_correct=is_correct,
+        created_at=time.time(),
+    )
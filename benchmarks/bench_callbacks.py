@@ -0,0 +1,82 @@
+"""Measure callback decode plus route cost against the old regex handlers.
+
+Both sides get the same Update objects: the old layout checks them with
+one CallbackQueryHandler per kind and splits the payload, the new one
+with a CallbackRouter dispatch table.
+
+Usage: python benchmarks/bench_callbacks.py --count 200000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+from telegram import CallbackQuery, Update, User
+from telegram.ext import CallbackQueryHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from callbacks import CallbackRouter  # noqa: E402
+from common import QuizzTypeEnum, encode_callback  # noqa: E402
+
+
+async def noop(update, context):
+    return None
+
+
+ROUTER = CallbackRouter({kind: noop for kind in QuizzTypeEnum})
+LEGACY_HANDLERS = [CallbackQueryHandler(noop, pattern=kind.value) for kind in QuizzTypeEnum]
+USER = User(1, "user", False)
+
+
+def callback_update(data: str) -> Update:
+    return Update(1, callback_query=CallbackQuery("1", USER, "1", data=data))
+
+
+def payloads(count: int) -> tuple[list[Update], list[Update]]:
+    new, legacy = [], []
+    for _ in range(count):
+        choice = random.random()
+        if choice < 0.8:
+            new.append(encode_callback(QuizzTypeEnum.WORDSETS_WORD, random.randint(0, 30), random.randint(0, 3)))
+            legacy.append(f"wordset>quizz>{random.randint(1, 10 ** 6)}:{random.randint(0, 1)}")
+        elif choice < 0.95:
+            new.append(encode_callback(QuizzTypeEnum.WORDSETS, random.randint(1, 500)))
+            legacy.append(f"wordsets:{random.randint(1, 500)}")
+        else:
+            new.append(encode_callback(QuizzTypeEnum.MAIN_MENU, QuizzTypeEnum.WORDSETS.value))
+            legacy.append("main:wordsets")
+    return [callback_update(data) for data in new], [callback_update(data) for data in legacy]
+
+
+def bench_router(updates: list[Update]) -> float:
+    started = time.perf_counter()
+    for update in updates:
+        ROUTER.check_update(update)
+    return time.perf_counter() - started
+
+
+def bench_legacy(updates: list[Update]) -> float:
+    started = time.perf_counter()
+    for update in updates:
+        for handler in LEGACY_HANDLERS:
+            if handler.check_update(update):
+                update.callback_query.data.split(":")
+                break
+    return time.perf_counter() - started
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=200000)
+    args = parser.parse_args()
+
+    new, legacy = payloads(args.count)
+    for name, elapsed, updates in (("router", bench_router(new), new), ("legacy", bench_legacy(legacy), legacy)):
+        size = sum(len(update.callback_query.data.encode()) for update in updates) / len(updates)
+        print(f"{name}: {elapsed / len(updates) * 1e9:.0f} ns/callback, {size:.1f} bytes/payload")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Measure card selection and rescheduling throughput of the SRS store.
+
+Usage: python benchmarks/bench_srs.py --users 10000 --cards 100
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from srs import DAY, SrsStore  # noqa: E402
+
+
+def build(users: int, cards: int, words: int) -> SrsStore:
+    store = SrsStore()
+    now = time.time()
+    for user_id in range(1, users + 1):
+        for word in random.sample(range(words), cards):
+            store.add(user_id, str(word), f"word{word}", f"translate{word}", now - random.random() * DAY)
+    return store
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--cards", type=int, default=100, help="cards per user")
+    parser.add_argument("--words", type=int, default=5000, help="distinct words")
+    parser.add_argument("--ops", type=int, default=200000, help="select + review operations")
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    store = build(args.users, args.cards, args.words)
+    build_time = time.perf_counter() - started
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    user_ids = [random.randint(1, args.users) for _ in range(args.ops)]
+    now = time.time()
+    started = time.perf_counter()
+    for user_id in user_ids:
+        card = store.peek(user_id, now)
+        if card is not None:
+            store.review(card, random.random() < 0.7, now)
+    elapsed = time.perf_counter() - started
+
+    print(f"cards: {len(store)}")
+    print(f"build: {build_time:.2f}s, {len(store) / build_time:.0f} cards/s")
+    print(f"memory: {memory / 2 ** 20:.1f} MiB, {memory / len(store):.0f} bytes/card")
+    print(f"select + review: {args.ops / elapsed:.0f} ops/s, {elapsed / args.ops * 1e6:.2f} us/op")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Measure the time from process start until the first update is handled.
+
+Runs ``python main.py`` in polling mode against the stub backend and a fake
+Bot API and waits for the reply to /start. With --api-down the backend
+address refuses connections, the bot must still start and answer.
+
+Usage: python benchmarks/bench_startup.py --runs 5 --api-latency 0.5
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from loadtest.fake_telegram import FakeTelegramRequest, FakeTelegramServer  # noqa: E402
+from loadtest.run import command_update  # noqa: E402
+from loadtest.stub_api import StubApi  # noqa: E402
+
+TOKEN = "0:bench"
+
+
+async def import_time() -> float:
+    started = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(sys.executable, "-c", "import main", cwd=ROOT)
+    await process.wait()
+    return time.perf_counter() - started
+
+
+async def first_update_time(api_url: str, timeout: float) -> float | None:
+    telegram = FakeTelegramRequest()
+    telegram.updates.append(command_update(1, "/start"))
+    server = FakeTelegramServer(telegram, TOKEN)
+    env = dict(
+        os.environ, BOT_TOKEN=TOKEN, TELEGRAM_BASE_URL=await server.start(), API_URL=api_url,
+        SESSION_DB="", ATTEMPTS_JOURNAL="", SRS_FILE="", STATS_FILE="", BOT_MODE="polling",
+    )
+    started = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "main.py", cwd=ROOT, env=env,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+    )
+    elapsed = None
+    try:
+        while time.perf_counter() - started < timeout and process.returncode is None:
+            if telegram.calls["sendMessage"]:
+                elapsed = time.perf_counter() - started
+                break
+            await asyncio.sleep(0.005)
+    finally:
+        if process.returncode is None:
+            process.terminate()
+        await process.wait()
+        await server.stop()
+    return elapsed
+
+
+async def run(args: argparse.Namespace) -> None:
+    stub = StubApi(latency=args.api_latency, jitter=0)
+    api_url = await stub.start()
+    if args.api_down:
+        api_url = "http://127.0.0.1:9"
+    imports = [await import_time() for _ in range(args.runs)]
+    firsts = [await first_update_time(api_url, args.timeout) for _ in range(args.runs)]
+    await stub.stop()
+
+    print(f"import main: median {statistics.median(imports) * 1000:.0f}ms, min {min(imports) * 1000:.0f}ms")
+    handled = [value for value in firsts if value is not None]
+    if handled:
+        print(f"first update: median {statistics.median(handled) * 1000:.0f}ms, min {min(handled) * 1000:.0f}ms")
+    print(f"runs without an answer in {args.timeout}s: {len(firsts) - len(handled)}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--api-latency", type=float, default=0.02)
+    parser.add_argument("--api-down", action="store_true", help="point the bot at a closed port")
+    parser.add_argument("--timeout", type=float, default=30)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
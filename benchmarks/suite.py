@@ -0,0 +1,313 @@
+"""Offline micro-benchmarks of the common helpers and the quiz answer loop.
+
+Every case reports ns per operation, the best and the median of --repeat
+runs. --save writes the results as a JSON baseline, --compare checks them
+against one and exits with status 1 when a case got slower than
+--threshold; the best run is compared, it is the least noisy.
+
+Usage:
+    python benchmarks/suite.py --save benchmarks/baseline.json
+    python benchmarks/suite.py --compare benchmarks/baseline.json --threshold 0.1
+    python benchmarks/suite.py --filter quiz
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import warnings
+from typing import Callable
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# no files, no limits on the fake bot, set before main reads them
+for name, value in (("SESSION_DB", ""), ("ATTEMPTS_JOURNAL", ""), ("SRS_FILE", ""), ("STATS_FILE", ""),
+                    ("RATE_LIMIT_OVERALL", "1e9"), ("RATE_LIMIT_OVERALL_BURST", "1e9"),
+                    ("RATE_LIMIT_CHAT", "1e9"), ("RATE_LIMIT_CHAT_BURST", "1e9")):
+    os.environ.setdefault(name, value)
+
+from telegram import Update  # noqa: E402
+from telegram.ext import CallbackContext  # noqa: E402
+from telegram.warnings import PTBUserWarning  # noqa: E402
+
+import main  # noqa: E402
+from callbacks import CallbackRouter  # noqa: E402
+from common import (  # noqa: E402
+    BotInfo, QuizzTypeEnum, UserInfo, create_menu_markup, decode_callback, encode_callback,
+    get_context_data, keyboard_in_maker, main_bot_menu, markup_cache, set_context_data,
+)
+from core import QuizPage  # noqa: E402
+from loadtest.fake_telegram import FakeTelegramRequest  # noqa: E402
+from loadtest.run import callback_update  # noqa: E402
+from srs import SrsStore  # noqa: E402
+from stats import StatsStore  # noqa: E402
+
+# the application is not started, the background edits are awaited by the suite
+warnings.filterwarnings("ignore", "Tasks created via `Application.create_task`", PTBUserWarning)
+
+CASES: dict[str, Callable[[], Callable]] = {}
+QUIZ_WORDS = 20
+USER_ID = 1
+
+
+def case(name: str):
+    """Register a factory that prepares the data and returns the operation"""
+    def register(factory: Callable[[], Callable]) -> Callable[[], Callable]:
+        CASES[name] = factory
+        return factory
+    return register
+
+
+def wordset_buttons(count: int = 6) -> list[tuple[str, str]]:
+    return [(str(idx + 1), str(1000 + idx)) for idx in range(count)] + [("<<", "page_1"), (">>", "page_3")]
+
+
+@case("keyboard_in_maker")
+def bench_keyboard_in_maker():
+    buttons = wordset_buttons()
+    return lambda: keyboard_in_maker(buttons, QuizzTypeEnum.WORDSETS, 3)
+
+
+@case("create_menu_markup_pinned")
+def bench_create_menu_markup_pinned():
+    main.prerender_menus(main_bot_menu)
+    return lambda: create_menu_markup(main_bot_menu)
+
+
+@case("create_menu_markup_cached")
+def bench_create_menu_markup_cached():
+    menu = main.BotMenu(msg="", prefix=QuizzTypeEnum.WORDSETS, buttons=wordset_buttons(), number=3)
+    create_menu_markup(menu)
+    return lambda: create_menu_markup(menu)
+
+
+@case("create_menu_markup_miss")
+def bench_create_menu_markup_miss():
+    menu = main.BotMenu(msg="", prefix=QuizzTypeEnum.WORDSETS, buttons=wordset_buttons(), number=3)
+
+    def op():
+        markup_cache.invalidate()
+        create_menu_markup(menu)
+    return op
+
+
+@case("get_context_data")
+def bench_get_context_data():
+    user_data = {}
+    set_context_data(user_data, UserInfo(user_id=USER_ID, chat_id=USER_ID, user_token="token"))
+    set_context_data(user_data, BotInfo(active_bot_msg=1))
+    return lambda: get_context_data(user_data, BotInfo)
+
+
+@case("set_context_data")
+def bench_set_context_data():
+    user_data, bot_info = {}, BotInfo(active_bot_msg=1)
+    return lambda: set_context_data(user_data, bot_info)
+
+
+@case("encode_callback")
+def bench_encode_callback():
+    return lambda: encode_callback(QuizzTypeEnum.WORDSETS_WORD, 12, 3)
+
+
+@case("decode_callback")
+def bench_decode_callback():
+    data = encode_callback(QuizzTypeEnum.WORDSETS_WORD, 12, 3)
+    return lambda: decode_callback(data)
+
+
+async def noop(update, context):
+    return None
+
+
+@case("callback_route")
+def bench_callback_route():
+    router = CallbackRouter({kind: noop for kind in QuizzTypeEnum})
+    data = encode_callback(QuizzTypeEnum.WORDSETS_WORD, 12, 3)
+    return lambda: router.route(data)
+
+
+def stub_wordsets(size: int = main.WORDSETS_PAGE_SIZE, pages: int = 5):
+    async def get_wordsets(user_token: str, page: int = 1, size: int = size) -> dict:
+        items = [{"id": str(page * 100 + idx), "title": f"Wordset {page}-{idx}"} for idx in range(size)]
+        return {"items": items, "page": page, "size": size, "pages": pages}
+    main.get_wordsets = get_wordsets
+
+
+@case("create_wordsets_menu_cached")
+def bench_create_wordsets_menu_cached():
+    stub_wordsets()
+    main.wordsets_cache.invalidate()
+
+    async def op():
+        await main.create_wordsets_menu("token", 2)
+    return op
+
+
+@case("create_wordsets_menu_miss")
+def bench_create_wordsets_menu_miss():
+    stub_wordsets()
+
+    async def op():
+        main.wordsets_cache.invalidate()
+        await main.create_wordsets_menu("token", 2)
+    return op
+
+
+def quiz_page(size: int = QUIZ_WORDS) -> QuizPage:
+    words = [
+        {
+            "id": str(idx),
+            "word": f"word {idx}",
+            "translate": f"перевод {idx}",
+            "wrong_words": [{"translate": f"ошибка {idx}-{wrong}"} for wrong in range(3)],
+        }
+        for idx in range(size)
+    ]
+    return QuizPage(words, total=size)
+
+
+@case("quiz_answer")
+def bench_quiz_answer():
+    """One answer through handle_wordset_play, the quiz restart is spread over its words"""
+    application = main.build_application("0:bench", FakeTelegramRequest(), FakeTelegramRequest())
+    application.bot_data["srs"] = SrsStore()
+    application.bot_data["stats"] = StatsStore()
+    page = quiz_page()
+    state = {}
+
+    async def restart(context: CallbackContext) -> None:
+        bot_info = main.reset_quiz(context, QuizzTypeEnum.WORDSETS, "1")
+        bot_info.stat_data = {"words": page.total, "correct": 0, "incorrect": 0, "loaded": 0}
+        main.add_quiz_page(bot_info, page)
+        await main.wordset_quizz_play(context)
+
+    async def op():
+        if not state:
+            await application.initialize()
+            updates = [
+                Update.de_json(callback_update(USER_ID, {
+                    "message_id": 1, "date": 0, "chat": {"id": USER_ID, "type": "private"},
+                }, encode_callback(QuizzTypeEnum.WORDSETS_WORD, step, 0)), application.bot)
+                for step in range(QUIZ_WORDS)
+            ]
+            context = CallbackContext.from_update(updates[0], application)
+            set_context_data(context.user_data, UserInfo(user_id=USER_ID, chat_id=USER_ID, user_token="token"))
+            set_context_data(context.user_data, BotInfo(active_bot_msg=1))
+            state.update(updates=updates, context=context)
+        context = state["context"]
+        bot_info = get_context_data(context.user_data, BotInfo)
+        step = bot_info.stat_data.get("correct", 0) + bot_info.stat_data.get("incorrect", 0)
+        if not bot_info.quizz_active_data or step >= QUIZ_WORDS:
+            await restart(context)
+            step = 0
+        context.args = [str(step), str(random.randrange(len(bot_info.quizz_active_data.variants)))]
+        await main.handle_wordset_play(state["updates"][step], context)
+    return op
+
+
+def measure(op: Callable, repeat: int, min_time: float) -> list[float]:
+    """ns per operation of every run, a run takes at least ``min_time``"""
+    def run(number: int) -> float:
+        started = time.perf_counter()
+        for _ in range(number):
+            op()
+        return time.perf_counter() - started
+
+    number = 1
+    while (elapsed := run(number)) < min_time / 10:
+        number *= 10
+    number = max(1, int(number * min_time / max(elapsed, 1e-9)))
+    return [run(number) / number * 1e9 for _ in range(repeat)]
+
+
+async def measure_async(op: Callable, repeat: int, min_time: float) -> list[float]:
+    async def run(number: int) -> float:
+        running = asyncio.all_tasks()
+        started = time.perf_counter()
+        for _ in range(number):
+            await op()
+        # background edits of the statistics message belong to the operation
+        pending = asyncio.all_tasks() - running
+        if pending:
+            await asyncio.wait(pending)
+        return time.perf_counter() - started
+
+    # the warm-up starts long-lived tasks, such as the rate limiter of the bot
+    await op()
+    number = 1
+    while (elapsed := await run(number)) < min_time / 10:
+        number *= 10
+    number = max(1, int(number * min_time / max(elapsed, 1e-9)))
+    return [await run(number) / number * 1e9 for _ in range(repeat)]
+
+
+def run_cases(names: list[str], repeat: int, min_time: float) -> dict[str, dict]:
+    results = {}
+    for name in names:
+        op = CASES[name]()
+        if inspect.iscoroutinefunction(op):
+            timings = asyncio.run(measure_async(op, repeat, min_time))
+        else:
+            timings = measure(op, repeat, min_time)
+        results[name] = {"best_ns": round(min(timings), 1), "median_ns": round(statistics.median(timings), 1)}
+        print(f"{name:32} {results[name]['best_ns']:>12.1f} ns/op  (median {results[name]['median_ns']:.1f})")
+    return results
+
+
+def compare(results: dict[str, dict], baseline: dict, threshold: float) -> list[str]:
+    regressions = []
+    print(f"\n{'case':32} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, result in results.items():
+        before = baseline["results"].get(name)
+        if not before:
+            print(f"{name:32} {'-':>12} {result['best_ns']:>12.1f}      new")
+            continue
+        change = result["best_ns"] / before["best_ns"] - 1
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:32} {before['best_ns']:>12.1f} {result['best_ns']:>12.1f} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def main_cli() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--filter", default="", help="run the cases whose name contains this text")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per run")
+    parser.add_argument("--save", help="write the results to this baseline file")
+    parser.add_argument("--compare", help="baseline file to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed slowdown, 0.1 is 10%%")
+    args = parser.parse_args()
+
+    names = [name for name in CASES if args.filter in name]
+    results = run_cases(names, args.repeat, args.min_time)
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "repeat": args.repeat,
+        "results": results,
+    }
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) above {args.threshold:.0%}: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,50 @@
+from typing import Any, Awaitable, Callable
+
+from telegram import Update
+from telegram.ext import BaseHandler
+
+from common import CALLBACK_SEPARATOR, CALLBACK_VERSION, QuizzTypeEnum, callback_code
+
+
+class CallbackRouter(BaseHandler[Update, Any]):
+    """Route callback queries to handlers by the kind of the decoded payload.
+
+    One dictionary lookup replaces the regex scan of a CallbackQueryHandler
+    list. Payload arguments are passed to the handler in ``context.args``.
+    Queries that match no route, including undecodable payloads of old
+    keyboards, go to ``default`` when it is set.
+    """
+
+    def __init__(self, routes: dict[QuizzTypeEnum, Callable[..., Awaitable[Any]]],
+                 default: Callable[..., Awaitable[Any]] | None = None, block: bool = True):
+        super().__init__(self.dispatch, block=block)
+        self.routes = routes
+        self.default = default
+        # keyed by the payload head, so routing never decodes or hashes the enum
+        self._heads = {CALLBACK_VERSION + callback_code(kind): callback for kind, callback in routes.items()}
+
+    def route(self, data: str | None) -> tuple[Callable, list[str]] | None:
+        """Return the handler and the arguments of a callback payload"""
+        parts = data.split(CALLBACK_SEPARATOR) if data else [""]
+        callback = self._heads.get(parts[0])
+        if callback is None:
+            return (self.default, []) if self.default else None
+        return callback, parts[1:]
+
+    def check_update(self, update: object) -> tuple[Callable, list[str]] | None:
+        if not isinstance(update, Update) or not update.callback_query:
+            return None
+        return self.route(update.callback_query.data)
+
+    def collect_additional_context(self, context, update, application, check_result) -> None:
+        context.args = check_result[1]
+
+    async def handle_update(self, update, application, check_result, context):
+        self.collect_additional_context(context, update, application, check_result)
+        return await check_result[0](update, context)
+
+    async def dispatch(self, update: Update, context) -> Any:
+        check_result = self.check_update(update)
+        if not check_result:
+            return None
+        return await self.handle_update(update, context.application, check_result, context)
@@ -0,0 +1,57 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+
+from telegram import Bot
+from telegram.error import TelegramError
+
+from ratelimit import PriorityEnum
+
+logger = logging.getLogger(__name__)
+
+BULK_DELETE_LIMIT = 100
+
+
+@dataclass
+class CleanupStats:
+    """``deleted`` and ``failed`` count single deletions; deleteMessages skips
+    the messages it cannot delete without telling which, so a bulk call is
+    only counted as accepted in ``bulk_ok``"""
+    deleted: int = 0
+    failed: int = 0
+    bulk_calls: int = 0
+    bulk_ok: int = 0
+    single_calls: int = 0
+
+
+cleanup_stats = CleanupStats()
+
+
+async def _delete_one(bot: Bot, chat_id: int, msg_id: int, semaphore: asyncio.Semaphore) -> None:
+    async with semaphore:
+        cleanup_stats.single_calls += 1
+        try:
+            await bot.delete_message(chat_id, msg_id, rate_limit_args=PriorityEnum.LOW)
+            cleanup_stats.deleted += 1
+        except TelegramError as e:
+            cleanup_stats.failed += 1
+            logger.debug("delete message :: %s :: %s :: %s", chat_id, msg_id, e)
+
+
+async def delete_messages(bot: Bot, chat_id: int, message_ids: list[int], concurrency: int = 5) -> None:
+    """Delete messages with deleteMessages, one call per 100 ids.
+
+    A chunk that the bulk call rejects is retried message by message with
+    at most ``concurrency`` requests in flight.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    for start in range(0, len(message_ids), BULK_DELETE_LIMIT):
+        chunk = message_ids[start: start + BULK_DELETE_LIMIT]
+        cleanup_stats.bulk_calls += 1
+        try:
+            await bot.delete_messages(chat_id, chunk, rate_limit_args=PriorityEnum.LOW)
+            cleanup_stats.bulk_ok += 1
+            continue
+        except TelegramError as e:
+            logger.debug("delete messages :: %s :: bulk failed :: %s", chat_id, e)
+        await asyncio.gather(*(_delete_one(bot, chat_id, msg_id, semaphore) for msg_id in chunk))
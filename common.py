@@ -1,9 +1,11 @@
 from enum import Enum
 from dataclasses import dataclass, field
 import logging
+import math
+import os
 import random
 import string
-from typing import Any, Iterable, Mapping, Type, TypeVar
+from typing import Any, Iterable, Mapping, NamedTuple, Type, TypeVar
 
 from telegram import (
     InlineKeyboardButton,
@@ -13,12 +15,12 @@ from telegram import (
 
 from telegram.ext import ContextTypes
 
+from cache import TTLCache
 from data.messages import bot_messages
 
 logger = logging.getLogger(__name__)
 logger.setLevel("INFO")
 
-QUERY_SEPARATOR = ":"
 DEFAULT_CONTEXT = ContextTypes.DEFAULT_TYPE
 UserDataT = TypeVar("UserDataT")
 
@@ -27,9 +29,89 @@ class QuizzTypeEnum(Enum):
     MAIN_MENU = "main"
     WORDSETS = "wordsets"
     WORDSETS_WORD = "wordset>quizz>"
+    REVIEW = "review"
+    STATS = "stats"
 
 
-@dataclass
+CALLBACK_VERSION = "1"
+CALLBACK_SEPARATOR = ":"
+CALLBACK_MAX_BYTES = 64
+
+_KIND_CODES = {
+    QuizzTypeEnum.MAIN_MENU: "m",
+    QuizzTypeEnum.WORDSETS: "w",
+    QuizzTypeEnum.WORDSETS_WORD: "q",
+    QuizzTypeEnum.REVIEW: "r",
+    QuizzTypeEnum.STATS: "s",
+}
+_CODE_KINDS = {CALLBACK_VERSION + code: kind for kind, code in _KIND_CODES.items()}
+
+
+class CallbackData(NamedTuple):
+    kind: QuizzTypeEnum
+    args: tuple[str, ...]
+
+
+def callback_code(kind: QuizzTypeEnum) -> str:
+    return _KIND_CODES[kind]
+
+
+def encode_callback(kind: QuizzTypeEnum, *args: Any) -> str:
+    """Pack a callback as ``<version><kind code>:<arg>:<arg>``.
+
+    Raises ValueError if an argument holds the separator or the result
+    does not fit the 64 bytes Telegram allows for callback data.
+    """
+    values = [str(arg) for arg in args]
+    if any(CALLBACK_SEPARATOR in value for value in values):
+        raise ValueError(f"callback argument contains {CALLBACK_SEPARATOR!r}: {values}")
+    data = CALLBACK_SEPARATOR.join([CALLBACK_VERSION + _KIND_CODES[kind], *values])
+    if len(data.encode()) > CALLBACK_MAX_BYTES:
+        raise ValueError(f"callback data longer than {CALLBACK_MAX_BYTES} bytes: {data}")
+    return data
+
+
+def decode_callback(data: str | None) -> CallbackData | None:
+    """Unpack callback data, None for foreign or outdated payloads"""
+    if not data:
+        return None
+    parts = data.split(CALLBACK_SEPARATOR)
+    kind = _CODE_KINDS.get(parts[0])
+    if kind is None:
+        return None
+    return CallbackData(kind, tuple(parts[1:]))
+
+
+@dataclass(slots=True)
+class WordQuizz:
+    """Quiz word with its shuffled variants, ``step`` is its place in the quiz"""
+    id: str
+    word: str
+    correct: str
+    variants: tuple[str, ...]
+    answer: int
+    step: int = 0
+    card: int | None = None
+    markup: InlineKeyboardMarkup | None = field(default=None, metadata={"persist": False})
+
+    @classmethod
+    def from_api(cls, data: dict, step: int = 0) -> "WordQuizz":
+        variants = data.get("options")
+        if not variants:
+            variants = [data["translate"]] + [el["translate"] for el in data["wrong_words"]]
+            random.shuffle(variants)
+        return cls(
+            id=str(data["id"]),
+            word=data["word"],
+            correct=data["translate"],
+            variants=tuple(variants),
+            answer=variants.index(data["translate"]),
+            step=step,
+            card=data.get("card"),
+        )
+
+
+@dataclass(slots=True)
 class UserInfo:
     _field_name_ = "user_info"
     user_id: int
@@ -38,35 +120,84 @@ class UserInfo:
     msg_to_delete: list[int] = field(default_factory=list)
 
 
-@dataclass
+@dataclass(slots=True)
 class BotInfo:
     _field_name_ = "bot_info"
     active_bot_msg: int
     quizz_type: QuizzTypeEnum | None = None
     statistic_msg: int | None = None
-    quizz_data: list = field(default_factory=list)
-    quizz_active_data: dict = field(default_factory=dict)
+    # words of the loaded pages in reverse play order
+    quizz_data: list[WordQuizz] = field(default_factory=list)
+    quizz_active_data: WordQuizz | None = None
     stat_data: dict = field(default_factory=dict)
+    quizz_set: str | None = None
+    # next page of the wordset quiz to load, 0 when all pages are loaded
+    quizz_page: int = 0
 
 
 @dataclass
 class BotMenu:
     msg: str
-    prefix: str
+    prefix: QuizzTypeEnum
     buttons: list[tuple[str, str]] = field(default_factory=list)
     number: int = 2
 
 
+@dataclass
+class WordsetsPage:
+    wordsets: dict
+    menu: BotMenu
+    markup: InlineKeyboardMarkup
+
+
 main_bot_menu = BotMenu(
     msg=bot_messages["welcome"],
-    prefix=QuizzTypeEnum.MAIN_MENU.value,
+    prefix=QuizzTypeEnum.MAIN_MENU,
     buttons=[
         ("📚 Учить слова", QuizzTypeEnum.WORDSETS.value),
-        ("📝 Статистика", "stats"),
+        ("🔁 Повторение", QuizzTypeEnum.REVIEW.value),
+        ("📝 Статистика", QuizzTypeEnum.STATS.value),
         ("🔧 Настройки", "settings"),
     ],
 )
 
+quiz_end_menu = BotMenu(
+    msg="",
+    prefix=QuizzTypeEnum.MAIN_MENU,
+    buttons=[("Еще", QuizzTypeEnum.WORDSETS.value)],
+)
+
+stats_menu = BotMenu(
+    msg="",
+    prefix=QuizzTypeEnum.MAIN_MENU,
+    buttons=[
+        ("📚 Учить слова", QuizzTypeEnum.WORDSETS.value),
+        ("🔁 Повторение", QuizzTypeEnum.REVIEW.value),
+    ],
+)
+
+markup_cache: TTLCache[InlineKeyboardMarkup] = TTLCache(
+    maxsize=int(os.getenv("MARKUP_CACHE_SIZE", 256)), ttl=math.inf
+)
+_pinned_markups: dict[tuple, InlineKeyboardMarkup] = {}
+
+
+def env_flag(name: str, default: bool = False) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+def write_atomic(filepath: str, data: bytes) -> None:
+    """Replace a file with new contents, a crash leaves the old or the new one"""
+    tmp_path = f"{filepath}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, filepath)
+
 
 def random_lower_string(str_len: int = 32) -> str:
     return "".join(random.choices(string.ascii_lowercase, k=str_len))
@@ -85,10 +216,13 @@ def keyboard_maker(buttons, number):
 
 
 def keyboard_in_maker(
-    buttons: Iterable, prefix: str, number: int
+    buttons: Iterable, kind: QuizzTypeEnum, number: int
 ) -> InlineKeyboardMarkup:
+    """Build an inline keyboard, a tuple button value gives several callback arguments"""
     answer_keys = [
-        InlineKeyboardButton(ans[0], callback_data=f"{prefix}{QUERY_SEPARATOR}{ans[1]}")
+        InlineKeyboardButton(
+            ans[0], callback_data=encode_callback(kind, *(ans[1] if isinstance(ans[1], tuple) else (ans[1],)))
+        )
         for ans in buttons
     ]
     keyboard = [
@@ -106,7 +240,7 @@ def get_context_data(
         return None
     field_name = getattr(class_type, "_field_name_", None)
     if not field_name:
-        logger.error(f"{class_type} must have a '_field_name_' class attribute")
+        logger.error("%s must have a '_field_name_' class attribute", class_type)
         return None
     result_data = data_pack.get(field_name, None)
     return result_data if isinstance(result_data, class_type) else None
@@ -117,15 +251,35 @@ def set_context_data(
 ) -> Mapping:
     field_name = getattr(data, "_field_name_", None)
     if not field_name:
-        logger.error(f"{data} must have a '_field_name_' class attribute")
+        logger.error("%s must have a '_field_name_' class attribute", data)
         return data_pack
     data_pack[field_name] = data
     return data_pack
 
 
+def _menu_key(bot_menu: BotMenu) -> tuple:
+    return bot_menu.prefix, tuple(bot_menu.buttons), bot_menu.number
+
+
 def create_menu_markup(bot_menu: BotMenu) -> InlineKeyboardMarkup:
-    return keyboard_in_maker(bot_menu.buttons, bot_menu.prefix, bot_menu.number)
+    """Return the markup of the menu, built once per distinct menu content"""
+    key = _menu_key(bot_menu)
+    markup = _pinned_markups.get(key) or markup_cache.get(key)
+    if markup is None:
+        markup = keyboard_in_maker(bot_menu.buttons, bot_menu.prefix, bot_menu.number)
+        markup_cache.set(key, markup)
+    return markup
+
+
+def prerender_menus(*menus: BotMenu) -> None:
+    """Build static menus once, they are never evicted from the cache"""
+    for bot_menu in menus:
+        _pinned_markups[_menu_key(bot_menu)] = keyboard_in_maker(bot_menu.buttons, bot_menu.prefix, bot_menu.number)
 
 
-def split_query(query: str) -> list[str]:
-    return query.split(QUERY_SEPARATOR)
+def quiz_markup(play_word: WordQuizz) -> InlineKeyboardMarkup:
+    """Keyboard of a quiz word, built once and kept in the word"""
+    if play_word.markup is None:
+        buttons = [(variant.capitalize(), (play_word.step, idx)) for idx, variant in enumerate(play_word.variants)]
+        play_word.markup = keyboard_in_maker(buttons, QuizzTypeEnum.WORDSETS_WORD, 2)
+    return play_word.markup
@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+lock_wait = metrics.histogram(
+    "bot_update_lock_wait_seconds", "Time an update waited for the previous update of its user",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+lock_contended = metrics.counter("bot_update_lock_contended_total", "Updates that waited for their user")
+
+
+def update_key(update: object) -> int | None:
+    """Serialization key of an update: its user, or its chat without a user"""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user is not None:
+        return update.effective_user.id
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    return None
+
+
+class UserOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Process updates of different users concurrently, of one user in order.
+
+    An update first takes the lock of its user, then a slot of the
+    ``max_concurrent_updates`` semaphore, so the queued taps of one user
+    never hold slots other users could run in. ``asyncio.Lock`` wakes its
+    waiters first come first served, and PTB starts the processing tasks in
+    arrival order, so the updates of a user are handled in the order they
+    came. Locks live only while an update of their user is in flight.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        # key -> [lock, updates holding or waiting for it]
+        self._locks: dict[int, list] = {}
+        self.waiting = 0
+
+    @property
+    def active_keys(self) -> int:
+        return len(self._locks)
+
+    async def process_update(self, update: object, coroutine: Awaitable) -> None:
+        key = update_key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return None
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        lock: asyncio.Lock = entry[0]
+        try:
+            if lock.locked():
+                started = time.perf_counter()
+                self.waiting += 1
+                try:
+                    await lock.acquire()
+                finally:
+                    self.waiting -= 1
+                if metrics.enabled:
+                    lock_wait.observe(time.perf_counter() - started)
+                    lock_contended.inc()
+            else:
+                await lock.acquire()
+            try:
+                await super().process_update(update, coroutine)
+            finally:
+                lock.release()
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
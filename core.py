@@ -1,80 +1,230 @@
+import asyncio
 import os
 from dataclasses import dataclass
 import logging
-import requests
-import random
-from time import sleep
+import time
+from typing import Awaitable, Callable
 
-from dotenv import load_dotenv
+import httpx
 
 from common import random_email, random_lower_string
+from metrics import api_errors, api_latency, metrics
+from resilience import CircuitBreaker, backoff_delay, remaining_time
 
-load_dotenv()
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
-)
 logger = logging.getLogger(__name__)
-logger.setLevel("DEBUG")
 
 
 API_URL = os.getenv("API_URL", "")
+API_TIMEOUT = float(os.getenv("API_TIMEOUT", 10))
+API_MAX_CONNECTIONS = int(os.getenv("API_MAX_CONNECTIONS", 100))
+API_MAX_KEEPALIVE = int(os.getenv("API_MAX_KEEPALIVE", 20))
+API_CONCURRENCY = int(os.getenv("API_CONCURRENCY", 50))
+API_GET_RETRIES = int(os.getenv("API_GET_RETRIES", 2))
+API_BREAKER_THRESHOLD = int(os.getenv("API_BREAKER_THRESHOLD", 5))
+API_BREAKER_RESET = float(os.getenv("API_BREAKER_RESET", 30))
+API_LOGIN_ATTEMPTS = int(os.getenv("API_LOGIN_ATTEMPTS", 5))
+QUIZ_PAGE_SIZE = int(os.getenv("QUIZ_PAGE_SIZE", 20))
 
 
-@dataclass
-class WordQuizz:
-    word: str
-    variants: tuple[str, ...]
-    correct: str
-
-
-def get_query(url: str, api_token: str, params: dict = None) -> list | dict | None:
-    url = f"{API_URL}{url}"
-    headers = {"Authorization": f"Bearer {api_token}"}
-    logger.debug(f"get_query :: {url} :: {params}")
-    try:
-        response = requests.get(url, headers=headers, params=params)
-        response.raise_for_status()
-        return response.json()
-    except requests.RequestException as e:
-        logger.error(f"Error fetching post: {response.json()}")
-        logger.error(f"Error fetching get: {e}")
-
-
-def post_query(url: str, api_token: str | None,
-               data: dict | None = None, json_data: dict | None = None) -> list | dict | None:
-    url = f"{API_URL}{url}"
-    headers = {}
-    if api_token:
-        headers = {"Authorization": f"Bearer {api_token}"}
-    logger.debug(f"post_query :: {url} :: {data} :: {json_data}")
-    try:
-        response = requests.post(url, headers=headers, data=data, json=json_data)
-        response.raise_for_status()
-        return response.json()
-    except requests.RequestException as e:
-        logger.error(f"Error fetching post: {e}")
-
-
-def get_bot_token(bot_email, bot_pass):
+class ApiRejectedError(Exception):
+    """The backend refused the request for good, retrying it would not help"""
+
+    def __init__(self, endpoint: str, status: int | None):
+        super().__init__(f"{endpoint} rejected with {status}")
+        self.endpoint = endpoint
+        self.status = status
+
+
+@dataclass(slots=True)
+class QuizPage:
+    words: list[dict]
+    page: int = 1
+    pages: int = 1
+    total: int = 0
+
+
+class ApiClient:
+    """Shared async client for the backend API.
+
+    Keeps a keep-alive connection pool and caps the number of requests
+    in flight, so a slow backend does not block the event loop.
+    """
+
+    def __init__(self, base_url: str = API_URL, timeout: float = API_TIMEOUT,
+                 max_connections: int = API_MAX_CONNECTIONS,
+                 max_keepalive: int = API_MAX_KEEPALIVE,
+                 concurrency: int = API_CONCURRENCY):
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=httpx.Timeout(timeout),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive,
+            ),
+        )
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._breakers: dict[str, CircuitBreaker] = {}
+        # token refused with 401 -> a fresh token, or None
+        self.reauth: Callable[[str], Awaitable[str | None]] | None = None
+
+    def _breaker(self, endpoint: str) -> CircuitBreaker:
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            breaker = self._breakers[endpoint] = CircuitBreaker(
+                endpoint, API_BREAKER_THRESHOLD, API_BREAKER_RESET
+            )
+        return breaker
+
+    async def _send(self, method: str, url: str, headers: dict, timeout: float,
+                    **kwargs) -> tuple[list | dict | None, bool, int | None]:
+        """Send one request, returning the result, whether the backend failed and the status"""
+        status = None
+        try:
+            response = await self._client.request(method, url, headers=headers, timeout=timeout, **kwargs)
+            status = response.status_code
+            response.raise_for_status()
+            return response.json(), False, status
+        except httpx.HTTPStatusError as e:
+            logger.error("Error fetching %s: %s :: %s", method.lower(), e, e.response.text)
+            return None, status >= 500 or status == 429, status
+        except httpx.HTTPError as e:
+            logger.error("Error fetching %s: %s", method.lower(), e)
+            return None, True, status
+        except ValueError as e:
+            logger.error("Error fetching %s: %s", method.lower(), e)
+            return None, False, status
+
+    async def request(self, method: str, url: str, api_token: str | None = None,
+                      timeout: float | None = None, endpoint: str | None = None,
+                      raise_rejected: bool = False, **kwargs) -> list | dict | None:
+        """Call the backend and return the JSON answer, or None on failure.
+
+        Every endpoint has its own circuit breaker. GET requests are retried
+        with jittered backoff; no attempt outlives the current deadline.
+        A token refused with 401 is handed to ``reauth`` and the request is
+        sent once more with the new one. With ``raise_rejected`` a client
+        error or an unreadable answer raises ApiRejectedError instead of
+        returning None.
+        """
+        endpoint = endpoint or url
+        result, rejected = await self._request(method, url, api_token, timeout, endpoint, **kwargs)
+        if rejected == 401 and api_token and self.reauth is not None:
+            new_token = await self.reauth(api_token)
+            if new_token and new_token != api_token:
+                logger.info("api :: token refused by %s, retry with a new one", endpoint)
+                result, rejected = await self._request(method, url, new_token, timeout, endpoint, **kwargs)
+        if raise_rejected and result is None and rejected is not None:
+            raise ApiRejectedError(endpoint, rejected)
+        return result
+
+    async def _request(self, method: str, url: str, api_token: str | None, timeout: float | None,
+                       endpoint: str, **kwargs) -> tuple[list | dict | None, int | None]:
+        """Send the request with retries, returning the result and the status of a refusal"""
+        breaker = self._breaker(endpoint)
+        if not breaker.allow():
+            logger.warning("Circuit open, skip %s: %s", method.lower(), endpoint)
+            return None, None
+        trial = breaker.trial
+        headers = {}
+        if api_token:
+            headers = {"Authorization": f"Bearer {api_token}"}
+        attempts = 1 + (API_GET_RETRIES if method == "GET" else 0)
+        started = time.perf_counter() if metrics.enabled else 0
+        result, rejected = None, None
+        try:
+            for attempt in range(1, attempts + 1):
+                attempt_timeout = timeout or self.timeout
+                remaining = remaining_time()
+                if remaining is not None:
+                    if remaining <= 0:
+                        logger.warning("Deadline exceeded, skip %s: %s", method.lower(), endpoint)
+                        break
+                    attempt_timeout = min(attempt_timeout, remaining)
+                async with self._semaphore:
+                    result, failed, status = await self._send(method, url, headers, attempt_timeout, **kwargs)
+                if not failed:
+                    breaker.record_success()
+                    if result is None:
+                        rejected = status
+                    break
+                breaker.record_failure()
+                if attempt == attempts or not breaker.allow():
+                    break
+                delay = backoff_delay(attempt)
+                remaining = remaining_time()
+                if remaining is not None and delay >= remaining:
+                    break
+                await asyncio.sleep(delay)
+        finally:
+            if trial and breaker.trial:
+                # the trial was cancelled or skipped by the deadline
+                breaker.record_failure()
+        if metrics.enabled:
+            api_latency.observe(time.perf_counter() - started, method=method, endpoint=endpoint)
+            if result is None:
+                api_errors.inc(method=method, endpoint=endpoint)
+        return result, rejected
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+_api_client: ApiClient | None = None
+
+
+def get_api_client() -> ApiClient:
+    global _api_client
+    if _api_client is None:
+        _api_client = ApiClient()
+    return _api_client
+
+
+async def close_api_client() -> None:
+    global _api_client
+    if _api_client is not None:
+        await _api_client.close()
+        _api_client = None
+
+
+async def get_query(url: str, api_token: str, params: dict = None,
+                    timeout: float | None = None, endpoint: str | None = None) -> list | dict | None:
+    logger.debug("get_query :: %s :: %s", url, params)
+    return await get_api_client().request(
+        "GET", url, api_token, timeout=timeout, endpoint=endpoint, params=params
+    )
+
+
+async def post_query(url: str, api_token: str | None,
+                     data: dict | None = None, json_data: dict | None = None,
+                     timeout: float | None = None, raise_rejected: bool = False) -> list | dict | None:
+    # the form data holds credentials, only its keys are logged
+    logger.debug("post_query :: %s :: %s", url, sorted(data or json_data or ()))
+    return await get_api_client().request(
+        "POST", url, api_token, timeout=timeout, raise_rejected=raise_rejected, data=data, json=json_data
+    )
+
+
+async def get_bot_token(bot_email, bot_pass, attempts: int = API_LOGIN_ATTEMPTS) -> str | None:
     """Get bot token for the api"""
     logger.debug("bot api token :: start")
-    api_token = ""
-    while not api_token:
-        url = "/login/access-token"
-        data = {"username": bot_email, "password": bot_pass}
-        result = post_query(url, None, data)
-        if not result:
-            sleep(2)
-            continue
-        bot_token = result.get("access_token")
-        return bot_token
+    url = "/login/access-token"
+    data = {"username": bot_email, "password": bot_pass}
+    for attempt in range(1, attempts + 1):
+        result = await post_query(url, None, data)
+        if result:
+            return result.get("access_token")
+        if attempt < attempts:
+            await asyncio.sleep(backoff_delay(attempt, base=1, cap=30))
+    logger.error("bot api token :: login failed")
+    return None
 
 
 async def get_user_token(user_id: int, bot_token: str) -> str | None:
     logger.debug("user api token :: start")
     url = f"/login/access-token-bot"
     data = {"tg_id": user_id}
-    result = post_query(url, bot_token, json_data=data)
+    result = await post_query(url, bot_token, json_data=data)
 
     logger.debug("user api token :: finish")
     if result:
@@ -92,29 +242,32 @@ async def reg_user(user_id: int, bot_token: str) -> str | None:
         "password": random_lower_string(),
     }
 
-    result = post_query(url, bot_token, json_data=data)
+    result = await post_query(url, bot_token, json_data=data)
     if result:
         user_token = result.get("access_token")
         return user_token
 
 
-def get_wordsets(api_token: str, page: int = 1, size: int = 6) -> dict:
+async def get_wordsets(api_token: str, page: int = 1, size: int = 6) -> dict:
     """Fetch word sets from the API."""
     logger.debug("get_wordsets :: start")
     params = {"page": page, "size": size}
     url = f"/words/sets/"
-    wordsets = get_query(url, api_token, params)
+    wordsets = await get_query(url, api_token, params)
 
-    logger.debug(f"get_wordsets :: {wordsets}")
+    logger.debug("get_wordsets :: %s", wordsets)
     logger.debug("get_wordsets :: finish")
     return wordsets
 
 
-def get_wordset_quiz(api_token: str, set_id: str) -> list | None:
-    logger.debug("get wordset quizz :: start")
+async def get_wordset_quiz(api_token: str, set_id: str, page: int = 1,
+                           size: int = QUIZ_PAGE_SIZE) -> QuizPage | None:
+    """Fetch one page of the wordset quiz, a backend without paging sends it whole"""
+    logger.debug("get wordset quizz :: start :: page=%s", page)
 
     url = f"/words/sets/{set_id}/quizz/"
-    quiz_set = get_query(url, api_token)
+    params = {"page": page, "size": size}
+    quiz_set = await get_query(url, api_token, params, endpoint="/words/sets/{id}/quizz/")
 
     if not quiz_set:
         return None
@@ -123,6 +276,35 @@ def get_wordset_quiz(api_token: str, set_id: str) -> list | None:
     if not quizz_words:
         return None
 
-    logger.debug(f"get wordsets quizz :: {quizz_words}")
+    logger.debug("get wordsets quizz :: %s words", len(quizz_words))
     logger.debug("get wordset quizz :: finish")
-    return quizz_words
+    return QuizPage(
+        words=quizz_words,
+        page=page,
+        pages=quiz_set.get("pages", page),
+        total=quiz_set.get("total", len(quizz_words)),
+    )
+
+
+async def get_wordset_words(api_token: str, set_id: str) -> list[dict] | None:
+    """Fetch all pages of the wordset quiz"""
+    words, page, pages = [], 1, 1
+    while page <= pages:
+        quiz_page = await get_wordset_quiz(api_token, set_id, page)
+        if not quiz_page:
+            return None
+        words.extend(quiz_page.words)
+        pages = quiz_page.pages
+        page += 1
+    return words
+
+
+async def post_attempts(bot_token: str, attempts: list[dict]) -> bool:
+    """Send a batch of attempts, False when it should be retried later.
+
+    Raises ApiRejectedError when the backend refused the batch for good.
+    """
+    logger.debug("post attempts :: %s", len(attempts))
+    url = "/words/attempts/"
+    result = await post_query(url, bot_token, json_data={"attempts": attempts}, raise_rejected=True)
+    return result is not None
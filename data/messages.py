@@ -1,5 +1,9 @@
 bot_messages = {
     "welcome": "Привет! Добро пожаловать в тренажер английского! Готов к новым знаниям? Начинаем!",
     "wordsets": "Выбери набор слов для тренировки:\n",
+    "review_empty": "Сейчас нечего повторять 👌 Пройди пару наборов слов и возвращайся позже",
+    "stats_empty": "Пока нет ответов 🙂 Пройди первый набор слов, и здесь появится статистика",
+    "quiz_expired": "Набор слов закрыт после долгого перерыва, начнем заново?",
+    "unavailable": "Сервис временно недоступен, попробуй чуть позже 🙏",
 }
 
@@ -0,0 +1,95 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from telegram import Bot, InlineKeyboardMarkup
+from telegram.error import BadRequest
+
+from ratelimit import PriorityEnum
+
+logger = logging.getLogger(__name__)
+
+MessageKey = tuple[int, int]
+Rendered = tuple[str, InlineKeyboardMarkup | None]
+
+
+@dataclass
+class EditStats:
+    sent: int = 0
+    skipped: int = 0
+    merged: int = 0
+
+
+class MessageEditor:
+    """Edit messages through one queue per (chat_id, message_id).
+
+    The last rendered text and markup of every message is kept, so edits
+    that change nothing are skipped. Edits that arrive while another edit of
+    the same message is being sent are merged: only the newest is sent.
+    """
+
+    def __init__(self, max_messages: int = 10000):
+        self.max_messages = max_messages
+        self.stats = EditStats()
+        self._rendered: OrderedDict[MessageKey, Rendered] = OrderedDict()
+        self._pending: dict[MessageKey, tuple[Rendered, int]] = {}
+        self._workers: dict[MessageKey, asyncio.Task] = {}
+
+    def remember(self, chat_id: int, message_id: int, text: str,
+                 reply_markup: InlineKeyboardMarkup | None = None) -> None:
+        key = (chat_id, message_id)
+        self._rendered[key] = (text, reply_markup)
+        self._rendered.move_to_end(key)
+        while len(self._rendered) > self.max_messages:
+            self._rendered.popitem(last=False)
+
+    def forget(self, chat_id: int, message_id: int) -> None:
+        self._rendered.pop((chat_id, message_id), None)
+
+    async def edit(self, bot: Bot, chat_id: int, message_id: int, text: str,
+                   reply_markup: InlineKeyboardMarkup | None = None,
+                   priority: PriorityEnum = PriorityEnum.NORMAL) -> None:
+        key = (chat_id, message_id)
+        rendered = (text, reply_markup)
+        worker = self._workers.get(key)
+        if worker is None and self._rendered.get(key) == rendered:
+            self.stats.skipped += 1
+            return None
+
+        if key in self._pending:
+            self.stats.merged += 1
+        self._pending[key] = (rendered, priority)
+        if worker is None:
+            worker = asyncio.create_task(self._flush(bot, key))
+            self._workers[key] = worker
+        await asyncio.shield(worker)
+
+    async def _flush(self, bot: Bot, key: MessageKey) -> None:
+        chat_id, message_id = key
+        try:
+            while key in self._pending:
+                rendered, priority = self._pending.pop(key)
+                if self._rendered.get(key) == rendered:
+                    self.stats.skipped += 1
+                    continue
+                text, reply_markup = rendered
+                try:
+                    await bot.edit_message_text(
+                        text=text, chat_id=chat_id, message_id=message_id,
+                        reply_markup=reply_markup, rate_limit_args=priority,
+                    )
+                except BadRequest as e:
+                    if "not modified" not in str(e).lower():
+                        raise
+                self.stats.sent += 1
+                self.remember(chat_id, message_id, text, reply_markup)
+        except Exception:
+            self._pending.pop(key, None)
+            self.forget(chat_id, message_id)
+            raise
+        finally:
+            self._workers.pop(key, None)
+
+
+message_editor = MessageEditor()
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import os
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from typing import Awaitable, Callable
+from urllib.parse import parse_qsl, urlsplit
+
+logger = logging.getLogger(__name__)
+
+MAX_HEADER_LINES = 100
+# an idle keep-alive connection or a slow request is closed after this
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 30))
+
+
+@dataclass
+class HttpRequest:
+    method: str
+    path: str
+    query: dict[str, str] = field(default_factory=dict)
+    headers: dict[str, str] = field(default_factory=dict)
+    body: bytes = b""
+
+
+@dataclass
+class HttpResponse:
+    status: int = HTTPStatus.OK
+    body: bytes = b""
+    content_type: str = "text/plain; charset=utf-8"
+
+
+RouteHandler = Callable[[HttpRequest], Awaitable[HttpResponse]]
+
+
+class HttpServer:
+    """Small asyncio HTTP/1.1 server with keep-alive and exact path routing.
+
+    A request has ``read_timeout`` seconds to arrive whole, counted from
+    the end of the previous one on the connection.
+    """
+
+    def __init__(self, routes: dict[tuple[str, str], RouteHandler], max_body: int = 1024 * 1024,
+                 read_timeout: float = HTTP_READ_TIMEOUT):
+        self.routes = routes
+        self.max_body = max_body
+        self.read_timeout = read_timeout
+        self._server: asyncio.Server | None = None
+
+    async def start(self, host: str, port: int) -> None:
+        self._server = await asyncio.start_server(self._handle, host, port)
+        logger.info("http server :: listening on %s:%s", host, port)
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    @property
+    def port(self) -> int | None:
+        if self._server is None or not self._server.sockets:
+            return None
+        return self._server.sockets[0].getsockname()[1]
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> HttpRequest | None:
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, target, _ = request_line.decode("latin-1").split(" ", 2)
+        headers = {}
+        for _ in range(MAX_HEADER_LINES):
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0))
+        if length > self.max_body:
+            raise ValueError("request body too large")
+        body = await reader.readexactly(length) if length else b""
+        url = urlsplit(target)
+        return HttpRequest(method.upper(), url.path, dict(parse_qsl(url.query)), headers, body)
+
+    @staticmethod
+    def _write_response(writer: asyncio.StreamWriter, response: HttpResponse, keep_alive: bool) -> None:
+        status = HTTPStatus(response.status)
+        head = (
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            f"Content-Type: {response.content_type}\r\n"
+            f"Content-Length: {len(response.body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + response.body)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), self.read_timeout)
+                except asyncio.TimeoutError:
+                    break
+                except (ValueError, asyncio.IncompleteReadError):
+                    self._write_response(writer, HttpResponse(HTTPStatus.BAD_REQUEST), False)
+                    break
+                if request is None:
+                    break
+                handler = self.routes.get((request.method, request.path))
+                if handler is None:
+                    response = HttpResponse(HTTPStatus.NOT_FOUND)
+                else:
+                    try:
+                        response = await handler(request)
+                    except Exception as e:
+                        logger.error("http server :: %s :: %s", request.path, e)
+                        response = HttpResponse(HTTPStatus.INTERNAL_SERVER_ERROR)
+                keep_alive = request.headers.get("connection", "").lower() != "close"
+                self._write_response(writer, response, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
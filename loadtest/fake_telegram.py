@@ -0,0 +1,108 @@
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter
+from urllib.parse import parse_qsl
+
+from telegram.request import BaseRequest, RequestData
+
+from httpserver import HttpRequest, HttpResponse, HttpServer
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Trainer", "username": "trainer_bot"}
+
+
+class FakeTelegramRequest(BaseRequest):
+    """In-process Bot API: answers every call without leaving the process.
+
+    The last message with an inline keyboard of every chat is kept, so a
+    driver can press its buttons. Updates put in ``updates`` are returned
+    by the next getUpdates call.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Counter[str] = Counter()
+        self.chats: dict[int, dict] = {}
+        self.updates: list[dict] = []
+        self._message_ids = itertools.count(1000)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _message(self, params: dict, message_id: int | None = None) -> dict:
+        chat_id = int(params["chat_id"])
+        message = {
+            "message_id": message_id or next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": params.get("text", ""),
+        }
+        markup = params.get("reply_markup")
+        if isinstance(markup, str):
+            markup = json.loads(markup)
+        if markup and "inline_keyboard" in markup:
+            message["reply_markup"] = markup
+            self.chats[chat_id] = message
+        return message
+
+    def _result(self, endpoint: str, params: dict) -> object:
+        if endpoint == "getMe":
+            return BOT_USER
+        if endpoint == "sendMessage":
+            return self._message(params)
+        if endpoint == "editMessageText":
+            return self._message(params, int(params["message_id"]))
+        if endpoint == "getUpdates":
+            updates, self.updates = self.updates, []
+            return updates
+        return True
+
+    async def do_request(self, url: str, method: str, request_data: RequestData | None = None,
+                         read_timeout=None, write_timeout=None, connect_timeout=None,
+                         pool_timeout=None) -> tuple[int, bytes]:
+        params = request_data.parameters if request_data else {}
+        return 200, await self.call(url.rsplit("/", 1)[-1], params)
+
+    async def call(self, endpoint: str, params: dict) -> bytes:
+        self.calls[endpoint] += 1
+        if endpoint == "getUpdates" and not self.updates:
+            # a short stand-in for long polling
+            await asyncio.sleep(0.05)
+        if self.latency:
+            await asyncio.sleep(random.uniform(0, 2 * self.latency))
+        return json.dumps({"ok": True, "result": self._result(endpoint, params)}).encode()
+
+
+class FakeTelegramServer:
+    """Serve a FakeTelegramRequest over HTTP for bots running in other processes."""
+
+    METHODS = (
+        "getMe", "getUpdates", "sendMessage", "editMessageText", "deleteMessage", "deleteMessages",
+        "answerCallbackQuery", "setWebhook", "deleteWebhook",
+    )
+
+    def __init__(self, telegram: FakeTelegramRequest, token: str):
+        self.telegram = telegram
+        self.server = HttpServer({("POST", f"/bot{token}/{method}"): self.handle for method in self.METHODS})
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Start the server and return the base URL for the bot"""
+        await self.server.start(host, port)
+        return f"http://{host}:{self.server.port}/bot"
+
+    async def stop(self) -> None:
+        await self.server.stop()
+
+    async def handle(self, request: HttpRequest) -> HttpResponse:
+        if request.headers.get("content-type", "").startswith("application/json"):
+            params = json.loads(request.body or b"{}")
+        else:
+            params = dict(parse_qsl(request.body.decode()))
+        body = await self.telegram.call(request.path.rsplit("/", 1)[-1], params)
+        return HttpResponse(body=body, content_type="application/json")
@@ -0,0 +1,230 @@
+"""Play the /start -> wordsets -> quiz -> result flow for many users at once.
+
+Usage: python -m loadtest.run --users 200 --api-latency 0.05 --json result.json
+
+With --shards N the updates go through a ShardFront to N worker processes,
+which call a fake Bot API over HTTP. --churn removes and adds a worker in
+the middle of the run to exercise the handover of users.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import statistics
+import tempfile
+import time
+from typing import Awaitable, Callable
+
+from telegram import Update
+
+from loadtest.fake_telegram import FakeTelegramRequest, FakeTelegramServer
+from loadtest.stub_api import StubApi
+
+_update_ids = itertools.count(1)
+
+
+def command_update(user_id: int, text: str) -> dict:
+    user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+    return {
+        "update_id": next(_update_ids),
+        "message": {
+            "message_id": next(_update_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": user,
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text)}],
+        },
+    }
+
+
+def callback_update(user_id: int, message: dict, data: str) -> dict:
+    user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+    return {
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(next(_update_ids)),
+            "from": user,
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": message,
+        },
+    }
+
+
+class LoadDriver:
+    def __init__(self, deliver: Callable[[dict], Awaitable], telegram: FakeTelegramRequest):
+        self.deliver = deliver
+        self.telegram = telegram
+        self.latencies: list[float] = []
+        self.completed = 0
+        self.failed = 0
+
+    async def send(self, data: dict) -> None:
+        started = time.perf_counter()
+        await self.deliver(data)
+        self.latencies.append(time.perf_counter() - started)
+
+    def choose(self, message: dict, wordsets_msg: str) -> str | None:
+        buttons = [button for row in message["reply_markup"]["inline_keyboard"] for button in row]
+        texts = [button["text"] for button in buttons]
+        if "Еще" in texts:
+            return None
+        if message["text"].startswith(wordsets_msg):
+            numbered = [button for button in buttons if button["text"].isdigit()]
+            return random.choice(numbered)["callback_data"]
+        if "📚 Учить слова" in texts:
+            return buttons[texts.index("📚 Учить слова")]["callback_data"]
+        return random.choice(buttons)["callback_data"]
+
+    async def play_user(self, user_id: int, max_steps: int = 200) -> None:
+        from data.messages import bot_messages
+
+        await self.send(command_update(user_id, "/start"))
+        for _ in range(max_steps):
+            message = self.telegram.chats.get(user_id)
+            data = self.choose(message, bot_messages["wordsets"]) if message else None
+            if data is None:
+                break
+            await self.send(callback_update(user_id, message, data))
+        message = self.telegram.chats.get(user_id)
+        if message and "Еще" in json.dumps(message.get("reply_markup"), ensure_ascii=False):
+            self.completed += 1
+        else:
+            self.failed += 1
+
+
+def percentile(values: list[float], pct: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100)[pct - 1]
+
+
+async def play(args: argparse.Namespace, driver: LoadDriver, stub: StubApi,
+               during: Awaitable | None = None) -> tuple[int, float]:
+    backend_before = stub.total_calls
+    started = time.perf_counter()
+    users = asyncio.gather(*(driver.play_user(user_id) for user_id in range(1, args.users + 1)))
+    if during is not None:
+        await asyncio.gather(users, during)
+    else:
+        await users
+    return stub.total_calls - backend_before, time.perf_counter() - started
+
+
+async def run_single(args: argparse.Namespace, telegram: FakeTelegramRequest, stub: StubApi):
+    import main
+
+    application = main.build_application("0:load-test", telegram, FakeTelegramRequest())
+
+    async def deliver(data: dict) -> None:
+        update = Update.de_json(data, application.bot)
+        await application.update_processor.process_update(update, application.process_update(update))
+
+    driver = LoadDriver(deliver, telegram)
+    async with application:
+        await application.post_init(application)
+        await application.start()
+        backend_calls, elapsed = await play(args, driver, stub)
+        await application.stop()
+    await application.post_shutdown(application)
+    return backend_calls, elapsed, driver
+
+
+async def churn(front, delay: float) -> None:
+    await asyncio.sleep(delay)
+    await front.remove_worker(front.worker_names[0])
+    await front.add_worker()
+
+
+async def run_sharded(args: argparse.Namespace, telegram: FakeTelegramRequest, stub: StubApi):
+    from sharding import ShardFront
+
+    token = "0:load-test"
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    fake_server = FakeTelegramServer(telegram, token)
+    os.environ["TELEGRAM_BASE_URL"] = await fake_server.start()
+    os.environ["BOT_TOKEN"] = token
+    if not os.environ.get("SESSION_DB"):
+        os.environ["SESSION_DB"] = os.path.join(workdir, "sessions.db")
+    front = ShardFront(args.shards, socket_dir=workdir)
+    await front.start()
+    driver = LoadDriver(front.dispatch, telegram)
+    try:
+        backend_calls, elapsed = await play(args, driver, stub, churn(front, args.churn) if args.churn else None)
+    finally:
+        await front.stop()
+        await fake_server.stop()
+    return backend_calls, elapsed, driver
+
+
+async def run(args: argparse.Namespace) -> dict:
+    stub = StubApi(wordsets=args.wordsets, words=args.words, latency=args.api_latency)
+    os.environ["API_URL"] = await stub.start()
+    os.environ.setdefault("SESSION_DB", "")
+    os.environ.setdefault("ATTEMPTS_ENABLED", "1")
+    os.environ.setdefault("ATTEMPTS_JOURNAL", "")
+    os.environ.setdefault("SRS_FILE", "")
+    os.environ.setdefault("STATS_FILE", "")
+    os.environ.setdefault("RATE_LIMIT_OVERALL", "100000")
+    os.environ.setdefault("RATE_LIMIT_OVERALL_BURST", "100000")
+    os.environ.setdefault("RATE_LIMIT_CHAT", "1000")
+    os.environ.setdefault("RATE_LIMIT_CHAT_BURST", "1000")
+    if args.verbose:
+        from main import setup_logging
+
+        setup_logging()
+
+    telegram = FakeTelegramRequest(latency=args.telegram_latency)
+    if args.shards:
+        backend_calls, elapsed, driver = await run_sharded(args, telegram, stub)
+    else:
+        backend_calls, elapsed, driver = await run_single(args, telegram, stub)
+    await stub.stop()
+
+    latencies = sorted(driver.latencies)
+    quizzes = max(driver.completed, 1)
+    return {
+        "users": args.users,
+        "completed_quizzes": driver.completed,
+        "failed_users": driver.failed,
+        "updates": len(latencies),
+        "elapsed_s": round(elapsed, 3),
+        "updates_per_s": round(len(latencies) / elapsed, 1),
+        "latency_p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "latency_p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "latency_p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "backend_calls_per_quiz": round(backend_calls / quizzes, 2),
+        "backend_calls": dict(stub.calls),
+        "bot_api_calls_per_quiz": round(sum(telegram.calls.values()) / quizzes, 2),
+        "bot_api_calls": dict(telegram.calls),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--wordsets", type=int, default=30)
+    parser.add_argument("--words", type=int, default=10)
+    parser.add_argument("--api-latency", type=float, default=0.02)
+    parser.add_argument("--telegram-latency", type=float, default=0.0)
+    parser.add_argument("--shards", type=int, default=0, help="worker processes, 0 runs in process")
+    parser.add_argument("--churn", type=float, default=0, help="replace a worker after this many seconds")
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--verbose", action="store_true", help="keep the bot logs")
+    args = parser.parse_args()
+    if not args.verbose:
+        logging.disable(logging.ERROR)
+
+    report = asyncio.run(run(args))
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import asyncio
+import base64
+import json
+import random
+import time
+from collections import Counter
+from http import HTTPStatus
+from urllib.parse import parse_qsl
+
+from httpserver import HttpRequest, HttpResponse, HttpServer
+
+
+def fake_jwt(subject: str, ttl: float = 3600) -> str:
+    def encode(data: dict) -> str:
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=").decode()
+
+    return f"{encode({'alg': 'none'})}.{encode({'sub': subject, 'exp': int(time.time() + ttl)})}.sig"
+
+
+class StubApi:
+    """Local stand-in for the backend endpoints used by core.py."""
+
+    def __init__(self, wordsets: int = 30, words: int = 10, latency: float = 0.02,
+                 jitter: float = 0.01, known_users: bool = False):
+        self.latency = latency
+        self.jitter = jitter
+        self.known_users = known_users
+        self.calls: Counter[str] = Counter()
+        self.attempts = 0
+        self._users: set[int] = set()
+        self._wordsets = [{"id": str(set_id), "title": f"Wordset {set_id}"} for set_id in range(1, wordsets + 1)]
+        self._quizzes = {
+            ws["id"]: self._make_quiz(ws["id"], words) for ws in self._wordsets
+        }
+        routes = {
+            ("POST", "/login/access-token"): self.login_bot,
+            ("POST", "/login/access-token-bot"): self.login_user,
+            ("POST", "/users/"): self.register_user,
+            ("GET", "/words/sets/"): self.wordsets,
+            ("POST", "/words/attempts/"): self.save_attempts,
+        }
+        for set_id in self._quizzes:
+            routes[("GET", f"/words/sets/{set_id}/quizz/")] = self.quiz
+        self.server = HttpServer(routes)
+
+    @staticmethod
+    def _make_quiz(set_id: str, words: int) -> list[dict]:
+        return [
+            {
+                "id": f"{set_id}-{idx}",
+                "word": f"word {set_id}-{idx}",
+                "translate": f"перевод {set_id}-{idx}",
+                "wrong_words": [{"translate": f"ошибка {set_id}-{idx}-{wrong}"} for wrong in range(3)],
+            }
+            for idx in range(words)
+        ]
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        await self.server.start(host, port)
+        return f"http://{host}:{self.server.port}"
+
+    async def stop(self) -> None:
+        await self.server.stop()
+
+    async def _delay(self, request: HttpRequest) -> None:
+        self.calls[request.path] += 1
+        await asyncio.sleep(max(self.latency + random.uniform(-self.jitter, self.jitter), 0))
+
+    @staticmethod
+    def _json(data: dict | list, status: int = HTTPStatus.OK) -> HttpResponse:
+        return HttpResponse(status, json.dumps(data).encode(), "application/json")
+
+    async def login_bot(self, request: HttpRequest) -> HttpResponse:
+        await self._delay(request)
+        form = dict(parse_qsl(request.body.decode()))
+        return self._json({"access_token": fake_jwt(form.get("username", "bot"))})
+
+    async def login_user(self, request: HttpRequest) -> HttpResponse:
+        await self._delay(request)
+        tg_id = json.loads(request.body)["tg_id"]
+        if not self.known_users and tg_id not in self._users:
+            return self._json({"detail": "not found"}, HTTPStatus.NOT_FOUND)
+        return self._json({"access_token": fake_jwt(str(tg_id))})
+
+    async def register_user(self, request: HttpRequest) -> HttpResponse:
+        await self._delay(request)
+        tg_id = json.loads(request.body)["tg_id"]
+        self._users.add(tg_id)
+        return self._json({"access_token": fake_jwt(str(tg_id))})
+
+    async def wordsets(self, request: HttpRequest) -> HttpResponse:
+        await self._delay(request)
+        page, size = int(request.query.get("page", 1)), int(request.query.get("size", 6))
+        items = self._wordsets[(page - 1) * size: page * size]
+        pages = -(-len(self._wordsets) // size)
+        return self._json({"items": items, "page": page, "size": size, "pages": pages})
+
+    async def quiz(self, request: HttpRequest) -> HttpResponse:
+        await self._delay(request)
+        set_id = request.path.split("/")[3]
+        words = self._quizzes[set_id]
+        page, size = int(request.query.get("page", 1)), int(request.query.get("size", len(words) or 1))
+        return self._json({
+            "words": [dict(word) for word in words[(page - 1) * size: page * size]],
+            "page": page,
+            "pages": -(-len(words) // size),
+            "total": len(words),
+        })
+
+    async def save_attempts(self, request: HttpRequest) -> HttpResponse:
+        await self._delay(request)
+        self.attempts += len(json.loads(request.body)["attempts"])
+        return self._json({"saved": True})
@@ -0,0 +1,186 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import reprlib
+import sys
+import time
+from dataclasses import dataclass
+
+from common import env_flag
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+# attributes of every LogRecord, the rest came in ``extra`` and goes to JSON
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+_PRIMITIVES = (str, int, float, bool, type(None))
+
+
+@dataclass
+class LogStats:
+    sampled_out: int = 0
+    truncated: int = 0
+
+
+log_stats = LogStats()
+
+
+def parse_levels(spec: str) -> dict[str, str]:
+    """``"core=0.1,telegram=WARNING"`` to a mapping of logger name to value"""
+    result = {}
+    for item in spec.split(","):
+        name, _, value = item.partition("=")
+        if name.strip() and value.strip():
+            result[name.strip()] = value.strip()
+    return result
+
+
+class PrefixMap:
+    """Value of the most specific logger prefix, cached per logger name"""
+
+    def __init__(self, values: dict[str, float], default: float):
+        self.values = values
+        self.default = default
+        self._cache: dict[str, float] = {}
+
+    def get(self, name: str) -> float:
+        value = self._cache.get(name)
+        if value is None:
+            value = self.default
+            parts = name.split(".")
+            for idx in range(len(parts), 0, -1):
+                prefix = ".".join(parts[:idx])
+                if prefix in self.values:
+                    value = self.values[prefix]
+                    break
+            self._cache[name] = value
+        return value
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a share of the records below WARNING per logger, never drops warnings"""
+
+    def __init__(self, rates: dict[str, float]):
+        super().__init__()
+        self.rates = PrefixMap(rates, 1.0)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(record.name)
+        if rate >= 1 or random.random() < rate:
+            return True
+        log_stats.sampled_out += 1
+        return False
+
+
+class PayloadCap(logging.Filter):
+    """Bound the message of a record to ``max_payload`` characters.
+
+    Containers among the arguments are rendered with ``reprlib``, which
+    stops after a few items, so a large payload costs the same as a small
+    one and the record holds no reference to objects the handlers mutate.
+    """
+
+    def __init__(self, max_payload: int = 1000):
+        super().__init__()
+        self.max_payload = max_payload
+        self._repr = reprlib.Repr()
+        self._repr.maxstring = max_payload
+        self._repr.maxother = max_payload
+        self._repr.maxlevel = 3
+
+    def _bound(self, arg: object) -> object:
+        return arg if isinstance(arg, _PRIMITIVES) else self._repr.repr(arg)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if isinstance(record.args, tuple):
+            record.args = tuple(self._bound(arg) for arg in record.args)
+        elif isinstance(record.args, dict):
+            # a single mapping argument, logging keeps it for "%(key)s" formats
+            record.args = {key: self._bound(value) for key, value in record.args.items()}
+        message = record.getMessage()
+        if len(message) > self.max_payload:
+            message = f"{message[:self.max_payload]}... ({len(message)} chars)"
+            log_stats.truncated += 1
+        record.msg, record.args = message, None
+        return True
+
+
+class DetachedQueueHandler(logging.handlers.QueueHandler):
+    """Queue records for the writer thread, JSON encoding and writing happen there"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRS:
+                data[name] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+_listener: logging.handlers.QueueListener | None = None
+
+
+def setup_logging() -> None:
+    """Configure the root logger from the environment.
+
+    LOG_LEVEL and LOG_LEVELS ("core=DEBUG,httpx=WARNING") set the levels,
+    LOG_FORMAT=json switches to one JSON object per line, LOG_SAMPLE
+    ("core=0.1") keeps a share of the debug and info records per logger and
+    LOG_MAX_PAYLOAD caps a message. With LOG_ASYNC, the default, records go
+    through a queue to a writer thread, so the event loop never waits on
+    the output stream.
+    """
+    global _listener
+    root = logging.getLogger()
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    for name, level in parse_levels(os.getenv("LOG_LEVELS", "")).items():
+        logging.getLogger(name).setLevel(level.upper())
+
+    output = logging.StreamHandler(sys.stderr)
+    formatter = JsonFormatter() if os.getenv("LOG_FORMAT", "text") == "json" else logging.Formatter(TEXT_FORMAT)
+    output.setFormatter(formatter)
+    handler: logging.Handler = output
+    if env_flag("LOG_ASYNC", True):
+        if _listener is not None:
+            _listener.stop()
+        handler = DetachedQueueHandler(queue.SimpleQueue())
+        _listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+    sample = {name: float(rate) for name, rate in parse_levels(os.getenv("LOG_SAMPLE", "")).items()}
+    if sample:
+        handler.addFilter(SamplingFilter(sample))
+    # after the sampling, a dropped record is never rendered
+    handler.addFilter(PayloadCap(int(os.getenv("LOG_MAX_PAYLOAD", 1000))))
+
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+
+
+def stop_logging() -> None:
+    """Write out the queued records"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
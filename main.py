@@ -1,7 +1,15 @@
+if __name__ == "__main__":
+    # .env has to be loaded before the modules below read their settings
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+import asyncio
 import logging
 import os
-import random
+import time
 from enum import IntEnum, auto
+from typing import TYPE_CHECKING
 
 from telegram import (
     ReplyKeyboardRemove,
@@ -9,28 +17,69 @@ from telegram import (
 )
 from telegram.ext import (
     Application,
-    CallbackQueryHandler,
     CommandHandler,
     ContextTypes,
     ConversationHandler,
 )
-from dotenv import load_dotenv
-
-from common import keyboard_in_maker, UserInfo, set_context_data, get_context_data, \
-    create_menu_markup, BotInfo, split_query, QuizzTypeEnum, main_bot_menu, BotMenu
-from core import get_wordsets, get_wordset_quiz, get_bot_token, get_user_token, reg_user
+from telegram.request import BaseRequest
+
+from common import UserInfo, set_context_data, get_context_data, \
+    create_menu_markup, BotInfo, QuizzTypeEnum, main_bot_menu, BotMenu, WordsetsPage, env_flag, \
+    quiz_end_menu, stats_menu, prerender_menus, quiz_markup, WordQuizz, write_atomic
+from cache import TTLCache
+from callbacks import CallbackRouter
+from prefetch import QuizPrefetcher
+from tokens import TokenManager
+from persistence import SqlitePersistence
+from srs import SrsStore
+from stats import SharedTotals, StatsStore
+from sessions import SessionManager, cancel_quiz_load, quiz_loads
+from ratelimit import PriorityEnum, PriorityRateLimiter
+from edits import message_editor
+from attempts import AttemptBuffer, make_attempt
+from cleanup import cleanup_stats, delete_messages
+from concurrency import UserOrderedUpdateProcessor
+from httpserver import HttpServer
+from logs import log_stats, setup_logging
+from metrics import metrics, timed_handler, METRICS_ROUTES
+from resilience import with_deadline
+from core import QuizPage, get_wordsets, get_wordset_quiz, close_api_client, get_api_client
 from data.messages import bot_messages
 
-load_dotenv()
+if TYPE_CHECKING:
+    from quiz_engine import QuizEngine
 
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
-)
 logger = logging.getLogger(__name__)
-logger.setLevel("DEBUG")
 
 
 PAGE_PREFIX = "page_"
+WORDSETS_PAGE_SIZE = int(os.getenv("WORDSETS_PAGE_SIZE", 6))
+CLEANUP_DEFERRED = env_flag("CLEANUP_DEFERRED", True)
+CLEANUP_CONCURRENCY = int(os.getenv("CLEANUP_CONCURRENCY", 5))
+QUIZ_LAYOUT_SINGLE = os.getenv("QUIZ_LAYOUT", "split") == "single"
+HANDLER_DEADLINE = float(os.getenv("HANDLER_DEADLINE", 15))
+BOT_LOGIN_DEADLINE = float(os.getenv("BOT_LOGIN_DEADLINE", 5))
+SHARD_ID = os.getenv("SHARD_ID")
+REVIEW_SIZE = int(os.getenv("REVIEW_SIZE", 10))
+REVIEW_DISTRACTORS = int(os.getenv("REVIEW_DISTRACTORS", 3))
+QUIZ_PREFETCH_LOW = int(os.getenv("QUIZ_PREFETCH_LOW", 3))
+STATS_WINDOW = int(os.getenv("STATS_WINDOW_DAYS", 7))
+STATS_TOP_WORDS = int(os.getenv("STATS_TOP_WORDS", 5))
+STATS_TZ_OFFSET = float(os.getenv("STATS_TZ_OFFSET_HOURS", 0)) * 3600
+SPARKLINE = "▁▂▃▄▅▆▇█"
+STORE_SAVE_INTERVAL = float(os.getenv("STORE_SAVE_INTERVAL", 60))
+
+wordsets_cache: TTLCache[WordsetsPage] = TTLCache(
+    maxsize=int(os.getenv("WORDSETS_CACHE_SIZE", 64)),
+    ttl=float(os.getenv("WORDSETS_CACHE_TTL", 300)),
+)
+
+
+def shard_file(path: str) -> str | None:
+    """Give every shard worker its own copy of a process-local file"""
+    if not path:
+        return None
+    return f"{path}.{SHARD_ID}" if SHARD_ID else path
 
 
 class StateEnum(IntEnum):
@@ -47,12 +96,12 @@ async def clear_messages(context: ContextTypes.DEFAULT_TYPE):
     messages = user_info.msg_to_delete
     if not chat_id or not messages:
         return None
-    for msg_id in messages:
-        try:
-            await context.bot.delete_message(chat_id, msg_id)
-        except Exception:
-            pass
     user_info.msg_to_delete = []
+    cleanup = delete_messages(context.bot, chat_id, messages, CLEANUP_CONCURRENCY)
+    if CLEANUP_DEFERRED:
+        context.application.create_task(cleanup)
+    else:
+        await cleanup
 
 
 def is_context_correct(update: Update | None, context: ContextTypes.DEFAULT_TYPE | None,
@@ -91,6 +140,8 @@ async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     return await set_state(context, StateEnum.CHOOSING_ACT)
 
 
+@timed_handler
+@with_deadline(HANDLER_DEADLINE)
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Start the conversation and ask user for input."""
     if not is_context_correct(update, context, need_user_data=False):
@@ -98,25 +149,48 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
     user_id = update.message.from_user.id
 
-    bot_token = context.bot_data.get("bot_token")
-    user_token = await get_user_token(user_id, bot_token)
+    token_manager: TokenManager = context.bot_data["token_manager"]
+    user_token = await token_manager.get_user_token(user_id)
     if not user_token:
-        user_token = await reg_user(user_id, bot_token)
+        await update.message.reply_text(bot_messages["unavailable"])
+        return ConversationHandler.END
 
     user_info = UserInfo(user_id=user_id, chat_id=update.message.chat_id, user_token=user_token,
                          msg_to_delete=[update.message.message_id,])
-    logger.debug(f"{user_info=}")
+    logger.debug("start :: user %s", user_id)
     set_context_data(context.user_data, user_info)
     return await show_main_menu(update, context)
 
 
-def create_wordsets_menu(user_token: str, page: int = 1) -> BotMenu | None:
-    wordsets = get_wordsets(user_token, page)
+async def show_unavailable(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Tell the user the backend is down and keep the conversation state"""
+    user_info = get_context_data(context.user_data, UserInfo)
+    message = await context.bot.send_message(user_info.chat_id, bot_messages["unavailable"])
+    user_info.msg_to_delete.append(message.message_id)
+    return None
+
+
+async def get_api_token(context: ContextTypes.DEFAULT_TYPE) -> str | None:
+    """Return a valid API token of the user, refreshing it if it expired"""
+    user_info = get_context_data(context.user_data, UserInfo)
+    token_manager: TokenManager = context.bot_data["token_manager"]
+    user_info.user_token = await token_manager.get_user_token(user_info.user_id)
+    return user_info.user_token
+
+
+async def create_wordsets_menu(user_token: str, page: int = 1,
+                               size: int = WORDSETS_PAGE_SIZE) -> WordsetsPage | None:
+    cache_key = (page, size)
+    wordsets_page = wordsets_cache.get(cache_key)
+    if wordsets_page:
+        return wordsets_page
+
+    wordsets = await get_wordsets(user_token, page, size)
     if not wordsets:
         return None
 
     wordsets_pack = [(str(idx + 1), ws["title"], ws["id"]) for idx, ws in enumerate(wordsets["items"])]
-    logger.debug(f"{wordsets_pack=}")
+    logger.debug("wordsets menu :: page %s :: %s wordsets", page, len(wordsets_pack))
     menu_text = bot_messages.get("wordsets")
     menu_text += "\n".join([f"{idx}. {title}" for idx, title, _ in wordsets_pack])
 
@@ -126,53 +200,225 @@ def create_wordsets_menu(user_token: str, page: int = 1) -> BotMenu | None:
         buttons.append(("<<", f"{PAGE_PREFIX}{page - 1}"))
     if next_page:
         buttons.append((">>", f"{PAGE_PREFIX}{page + 1}"))
-    logger.debug(f"{buttons=}")
-    return BotMenu(msg=menu_text, prefix="wordsets", buttons=buttons, number=3)
+    menu = BotMenu(msg=menu_text, prefix=QuizzTypeEnum.WORDSETS, buttons=buttons, number=3)
+    wordsets_page = WordsetsPage(wordsets=wordsets, menu=menu, markup=create_menu_markup(menu))
+    wordsets_cache.set(cache_key, wordsets_page)
+    return wordsets_page
 
 
-async def show_wordsets_menu(context: ContextTypes.DEFAULT_TYPE, page: int = 1) -> int:
+async def show_wordsets_menu(context: ContextTypes.DEFAULT_TYPE, page: int = 1) -> int | None:
     if not is_context_correct(context=context, update=None, need_query=False, need_message=False):
         return ConversationHandler.END
 
     user_info = get_context_data(context.user_data, UserInfo)
     bot_info = get_context_data(context.user_data, BotInfo)
 
-    wordsets_menu = create_wordsets_menu(user_info.user_token, page)
-    markup = create_menu_markup(wordsets_menu)
-    await context.bot.edit_message_text(
-        text=wordsets_menu.msg, chat_id=user_info.chat_id, message_id=bot_info.active_bot_msg, reply_markup=markup
+    user_token = await get_api_token(context)
+    wordsets_page = await create_wordsets_menu(user_token, page)
+    if not wordsets_page:
+        return await show_unavailable(context)
+    await message_editor.edit(
+        context.bot, user_info.chat_id, bot_info.active_bot_msg, wordsets_page.menu.msg, wordsets_page.markup
     )
+
+    prefetcher: QuizPrefetcher | None = context.bot_data.get("quiz_prefetcher")
+    if prefetcher and user_token:
+        set_ids = [str(ws["id"]) for ws in wordsets_page.wordsets["items"]]
+        prefetcher.schedule(user_info.user_id, user_token, set_ids)
     return StateEnum.CHOOSING_WORDSET
 
 
-async def handle_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+@timed_handler
+@with_deadline(HANDLER_DEADLINE)
+async def handle_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int | None:
     if not is_context_correct(update, context, need_message=False, need_query=True):
         return ConversationHandler.END
 
     query = update.callback_query
     await query.answer()
     bot_info = get_context_data(context.user_data, BotInfo)
-    prefix, choice = split_query(query.data)
-    logger.debug(f"handle main menu :: {prefix=} : {choice=}")
+    choice = context.args[0] if context.args else None
+    logger.debug("handle main menu :: choice=%s", choice)
 
     if choice == QuizzTypeEnum.WORDSETS.value:
         bot_info.quizz_type = QuizzTypeEnum.WORDSETS
         return await show_wordsets_menu(context)
+    if choice == QuizzTypeEnum.REVIEW.value:
+        return await start_review(context)
+    if choice == QuizzTypeEnum.STATS.value:
+        return await show_user_stats(context)
 
     return ConversationHandler.END
 
 
-async def show_statistics(context: ContextTypes.DEFAULT_TYPE):
+async def start_review(context: ContextTypes.DEFAULT_TYPE) -> int | None:
+    """Play the cards that are due for the user, most overdue first"""
+    user_info = get_context_data(context.user_data, UserInfo)
+    srs: SrsStore | None = context.bot_data.get("srs")
+    due_cnt = srs.due_count(user_info.user_id, limit=REVIEW_SIZE) if srs else 0
+    if not due_cnt:
+        message = await context.bot.send_message(user_info.chat_id, bot_messages["review_empty"])
+        user_info.msg_to_delete.append(message.message_id)
+        return None
+
+    bot_info = reset_quiz(context, QuizzTypeEnum.REVIEW)
+    bot_info.stat_data = {"words": due_cnt, "correct": 0, "incorrect": 0}
+    return await wordset_quizz_play(context)
+
+
+def next_review_word(context: ContextTypes.DEFAULT_TYPE) -> WordQuizz | None:
+    user_info = get_context_data(context.user_data, UserInfo)
+    bot_info = get_context_data(context.user_data, BotInfo)
+    srs: SrsStore | None = context.bot_data.get("srs")
+    stats = bot_info.stat_data
+    step = stats["correct"] + stats["incorrect"]
+    if not srs or step >= stats["words"]:
+        return None
+    card = srs.peek(user_info.user_id)
+    if card is None:
+        return None
+    return WordQuizz.from_api(srs.quiz_word(card, REVIEW_DISTRACTORS), step)
+
+
+def reset_quiz(context: ContextTypes.DEFAULT_TYPE, quizz_type: QuizzTypeEnum,
+               quizz_set: str | None = None) -> BotInfo:
+    user_info = get_context_data(context.user_data, UserInfo)
+    bot_info = get_context_data(context.user_data, BotInfo)
+    cancel_quiz_load(context.bot_data, user_info.user_id)
+    bot_info.quizz_type = quizz_type
+    bot_info.quizz_set = quizz_set
+    bot_info.quizz_page = 1 if quizz_set else 0
+    bot_info.quizz_data = []
+    return bot_info
+
+
+def add_quiz_page(bot_info: BotInfo, quiz_page: QuizPage) -> None:
+    """Queue the words of a page after the loaded ones, with their keyboards"""
+    first_step = bot_info.stat_data["loaded"]
+    words = [WordQuizz.from_api(word, first_step + idx) for idx, word in enumerate(quiz_page.words)]
+    for play_word in words:
+        quiz_markup(play_word)
+    words.reverse()
+    bot_info.quizz_data[:0] = words
+    bot_info.stat_data["loaded"] = first_step + len(words)
+    bot_info.quizz_page = quiz_page.page + 1 if quiz_page.page < quiz_page.pages else 0
+
+
+async def fetch_quiz_page(context: ContextTypes.DEFAULT_TYPE, wordset_id: str, page: int) -> QuizPage | None:
+    user_info = get_context_data(context.user_data, UserInfo)
+    user_token = await get_api_token(context)
+    quiz_page = None
+    quiz_engine: QuizEngine | None = context.bot_data.get("quiz_engine")
+    if quiz_engine:
+        quiz_page, stale = await quiz_engine.get_quiz(wordset_id, page)
+        if quiz_page and stale and page == 1 and user_token:
+            quiz_engine.refresh(user_token, wordset_id)
+    if quiz_page:
+        return quiz_page
+    prefetcher: QuizPrefetcher | None = context.bot_data.get("quiz_prefetcher")
+    if prefetcher and page == 1:
+        quiz_page = await prefetcher.take(user_info.user_id, wordset_id)
+    if not quiz_page and user_token:
+        quiz_page = await get_wordset_quiz(user_token, wordset_id, page)
+    if quiz_page and quiz_engine and page == 1 and user_token:
+        quiz_engine.refresh(user_token, wordset_id)
+    return quiz_page
+
+
+async def load_quiz_page(context: ContextTypes.DEFAULT_TYPE, user_id: int) -> None:
     bot_info = get_context_data(context.user_data, BotInfo)
+    wordset_id, page = bot_info.quizz_set, bot_info.quizz_page
+    loads = quiz_loads(context.bot_data)
+    try:
+        quiz_page = await fetch_quiz_page(context, wordset_id, page)
+    finally:
+        if loads.get(user_id) is asyncio.current_task():
+            del loads[user_id]
+    # the quiz may have been restarted or trimmed meanwhile
+    if quiz_page and (bot_info.quizz_set, bot_info.quizz_page) == (wordset_id, page):
+        add_quiz_page(bot_info, quiz_page)
+        logger.debug("quiz page :: %s :: %s/%s", wordset_id, page, quiz_page.pages)
+
+
+def prefetch_quiz_page(context: ContextTypes.DEFAULT_TYPE) -> asyncio.Task | None:
     user_info = get_context_data(context.user_data, UserInfo)
+    bot_info = get_context_data(context.user_data, BotInfo)
+    loads = quiz_loads(context.bot_data)
+    task = loads.get(user_info.user_id)
+    if bot_info.quizz_page and task is None:
+        task = loads[user_info.user_id] = context.application.create_task(
+            load_quiz_page(context, user_info.user_id)
+        )
+    return task
 
-    stat_data = bot_info.stat_data
+
+async def next_quiz_word(context: ContextTypes.DEFAULT_TYPE) -> WordQuizz | None:
+    """Pop the next word, the following page is loaded while the current one runs low"""
+    bot_info = get_context_data(context.user_data, BotInfo)
+    if not bot_info.quizz_data and bot_info.quizz_page:
+        await prefetch_quiz_page(context)
+    play_word = bot_info.quizz_data.pop() if bot_info.quizz_data else None
+    if len(bot_info.quizz_data) <= QUIZ_PREFETCH_LOW:
+        prefetch_quiz_page(context)
+    return play_word
+
+
+def statistics_text(stat_data: dict, title: str) -> str:
     ready_cnt = stat_data.get('correct') + stat_data.get('incorrect')
-    msg = "Промежуточный результат:\n"
+    msg = title
     msg += f"Слов: {ready_cnt} / {stat_data.get('words')}\n"
     msg += f"Верно {stat_data.get('correct')}\n"
     msg += f"Ошибки: {stat_data.get('incorrect')}"
-    await context.bot.edit_message_text(msg, user_info.chat_id, bot_info.statistic_msg)
+    return msg
+
+
+def user_stats_text(stats_store: StatsStore, user_id: int) -> str:
+    """Stats screen built from the aggregates, its cost does not grow with the history"""
+    user = stats_store.user(user_id)
+    if not user or not user.answers:
+        return bot_messages["stats_empty"]
+    daily = user.daily(stats_store.today())
+    peak = max(answers for answers, _ in daily) or 1
+    window_answers = sum(answers for answers, _ in daily)
+    window_correct = sum(correct for _, correct in daily)
+    msg = "Твоя статистика:\n"
+    msg += f"Ответов: {user.answers}, верно {user.accuracy:.0%}\n"
+    msg += f"Пройдено наборов: {user.quizzes}\n"
+    msg += f"За {stats_store.window} дн.: {window_answers} ответов"
+    if window_answers:
+        msg += f", верно {window_correct / window_answers:.0%}"
+    msg += "\n" + "".join(SPARKLINE[answers * (len(SPARKLINE) - 1) // peak] for answers, _ in daily)
+    if user.hardest:
+        msg += "\n\nСложные слова:\n"
+        msg += "\n".join(f"{word.capitalize()} — ошибок: {errors}" for errors, _, word in user.hardest)
+    msg += f"\n\nСредняя точность всех учеников: {stats_store.global_accuracy:.0%}"
+    return msg
+
+
+async def show_user_stats(context: ContextTypes.DEFAULT_TYPE) -> int:
+    user_info = get_context_data(context.user_data, UserInfo)
+    bot_info = get_context_data(context.user_data, BotInfo)
+    stats_store: StatsStore = context.bot_data["stats"]
+    msg = user_stats_text(stats_store, user_info.user_id)
+    await message_editor.edit(
+        context.bot, user_info.chat_id, bot_info.active_bot_msg, msg, create_menu_markup(stats_menu)
+    )
+    return StateEnum.CHOOSING_ACT
+
+
+async def show_statistics(context: ContextTypes.DEFAULT_TYPE):
+    """Refresh the statistics message in the background.
+
+    A refresh that is still queued when the next answer comes is replaced by
+    the newer one, so fast answers cost a single edit.
+    """
+    bot_info = get_context_data(context.user_data, BotInfo)
+    user_info = get_context_data(context.user_data, UserInfo)
+
+    msg = statistics_text(bot_info.stat_data, "Промежуточный результат:\n")
+    context.application.create_task(message_editor.edit(
+        context.bot, user_info.chat_id, bot_info.statistic_msg, msg, priority=PriorityEnum.LOW
+    ))
 
 
 async def show_wordset_word(context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -180,21 +426,20 @@ async def show_wordset_word(context: ContextTypes.DEFAULT_TYPE) -> int:
     user_info = get_context_data(context.user_data, UserInfo)
 
     play_word = bot_info.quizz_active_data
-    buttons = [
-        (play_word["translate"].capitalize(), 1),
-    ] + [(el["translate"].capitalize(), 0) for el in play_word["wrong_words"]]
-    random.shuffle(buttons)
-    markup = keyboard_in_maker(buttons, f"wordset>quizz>{play_word['id']}", 2)
-    msg = f"{play_word['word'].capitalize()}"
+    markup = quiz_markup(play_word)
+    msg = f"{play_word.word.capitalize()}"
+    if QUIZ_LAYOUT_SINGLE:
+        msg = f"{statistics_text(bot_info.stat_data, '')}\n\n{msg}"
 
     if not bot_info.active_bot_msg:
         quizz_msg = await context.bot.send_message(
-            user_info.chat_id, text=msg, reply_markup=markup
+            user_info.chat_id, text=msg, reply_markup=markup, rate_limit_args=PriorityEnum.HIGH
         )
         bot_info.active_bot_msg = quizz_msg.message_id
+        message_editor.remember(user_info.chat_id, quizz_msg.message_id, msg, markup)
     else:
-        await context.bot.edit_message_text(
-            text=msg, chat_id=user_info.chat_id, message_id=bot_info.active_bot_msg, reply_markup=markup
+        await message_editor.edit(
+            context.bot, user_info.chat_id, bot_info.active_bot_msg, msg, markup, priority=PriorityEnum.HIGH
         )
     return StateEnum.WORD_PLAY
 
@@ -203,46 +448,60 @@ async def show_result(context: ContextTypes.DEFAULT_TYPE) -> int:
     bot_info = get_context_data(context.user_data, BotInfo)
     user_info = get_context_data(context.user_data, UserInfo)
 
-    stat_data = bot_info.stat_data
-    ready_cnt = stat_data.get('correct') + stat_data.get('incorrect')
-    msg = "Итог игры: \n"
-    msg += f"Слов: {ready_cnt} / {stat_data.get('words')}\n"
-    msg += f"Верно {stat_data.get('correct')}\n"
-    msg += f"Ошибки: {stat_data.get('incorrect')}"
+    msg = statistics_text(bot_info.stat_data, "Итог игры: \n")
+    stats_store: StatsStore | None = context.bot_data.get("stats")
+    if stats_store is not None:
+        stats_store.finish_quiz(user_info.user_id)
 
-    end_menu = BotMenu(msg, QuizzTypeEnum.WORDSETS_WORD.value, [("Еще", QuizzTypeEnum.WORDSETS.value)])
-    markup = create_menu_markup(end_menu)
-    user_info.msg_to_delete.append(bot_info.active_bot_msg)
-    bot_info.active_bot_msg = None
-    bot_info.active_bot_msg = bot_info.statistic_msg
-    bot_info.statistic_msg = None
-    await context.bot.edit_message_text(
-        text=msg, chat_id=user_info.chat_id, message_id=bot_info.active_bot_msg, reply_markup=markup
-    )
+    markup = create_menu_markup(quiz_end_menu)
+    if bot_info.statistic_msg:
+        user_info.msg_to_delete.append(bot_info.active_bot_msg)
+        bot_info.active_bot_msg = bot_info.statistic_msg
+        bot_info.statistic_msg = None
+    await message_editor.edit(context.bot, user_info.chat_id, bot_info.active_bot_msg, msg, markup)
 
     return await set_state(context, StateEnum.WORD_PLAY)
 
 
+async def show_quiz_expired(context: ContextTypes.DEFAULT_TYPE) -> int:
+    bot_info = get_context_data(context.user_data, BotInfo)
+    user_info = get_context_data(context.user_data, UserInfo)
+    if bot_info.statistic_msg:
+        user_info.msg_to_delete.append(bot_info.active_bot_msg)
+        bot_info.active_bot_msg = bot_info.statistic_msg
+        bot_info.statistic_msg = None
+    msg = f"{bot_messages['quiz_expired']}\n\n{main_bot_menu.msg}"
+    await message_editor.edit(
+        context.bot, user_info.chat_id, bot_info.active_bot_msg, msg, create_menu_markup(main_bot_menu)
+    )
+    return await set_state(context, StateEnum.CHOOSING_ACT)
+
+
 async def wordset_quizz_play(context: ContextTypes.DEFAULT_TYPE) -> int:
     bot_info = get_context_data(context.user_data, BotInfo)
-    quizz_data = bot_info.quizz_data
 
-    if not quizz_data:
+    if bot_info.quizz_type is QuizzTypeEnum.REVIEW:
+        play_word = next_review_word(context)
+    else:
+        play_word = await next_quiz_word(context)
+    if not play_word:
         return await show_result(context)
-    play_word = quizz_data.pop()
 
-    if not bot_info.statistic_msg:
+    if not QUIZ_LAYOUT_SINGLE and not bot_info.statistic_msg:
         bot_info.statistic_msg = bot_info.active_bot_msg
         bot_info.active_bot_msg = None
     bot_info.quizz_active_data = play_word
 
-    await show_statistics(context)
+    if not QUIZ_LAYOUT_SINGLE:
+        await show_statistics(context)
     return await show_wordset_word(context)
 
 
+@timed_handler
+@with_deadline(HANDLER_DEADLINE)
 async def handle_wordset_menu(
     update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> int:
+) -> int | None:
     logger.debug("handle wordset :: start")
     if not is_context_correct(update, context, need_message=False, need_query=True):
         return ConversationHandler.END
@@ -250,25 +509,30 @@ async def handle_wordset_menu(
     query = update.callback_query
     await query.answer()
 
-    prefix, wordset_id = split_query(query.data)
-    logger.debug(f"handle wordset menu :: {prefix=} : {wordset_id=}")
+    if not context.args:
+        return None
+    wordset_id = context.args[0]
+    logger.debug("handle wordset menu :: wordset_id=%s", wordset_id)
 
     if wordset_id.startswith(PAGE_PREFIX):
         page = int(wordset_id.split("_")[1])
-        logger.debug(f"handle wordset menu :: {page=}")
+        logger.debug("handle wordset menu :: page=%s", page)
         return await show_wordsets_menu(context, page)
 
-    user_info = get_context_data(context.user_data, UserInfo)
-    bot_info = get_context_data(context.user_data, BotInfo)
-    wordset_quizz = get_wordset_quiz(user_info.user_token, wordset_id)
+    quiz_page = await fetch_quiz_page(context, wordset_id, 1)
+    if not quiz_page:
+        return await show_unavailable(context)
 
-    bot_info.quizz_data = wordset_quizz
-    bot_info.stat_data = {"words": len(wordset_quizz), "correct": 0, "incorrect": 0}
+    bot_info = reset_quiz(context, QuizzTypeEnum.WORDSETS, wordset_id)
+    bot_info.stat_data = {"words": quiz_page.total, "correct": 0, "incorrect": 0, "loaded": 0}
+    add_quiz_page(bot_info, quiz_page)
 
     logger.debug("handle wordset :: finish")
     return await wordset_quizz_play(context)
 
 
+@timed_handler
+@with_deadline(HANDLER_DEADLINE)
 async def handle_wordset_play(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.debug("handle wordset play :: start")
     if not is_context_correct(update, context, need_message=False, need_query=True):
@@ -277,22 +541,50 @@ async def handle_wordset_play(update: Update, context: ContextTypes.DEFAULT_TYPE
     query = update.callback_query
     await query.answer()
 
-    prefix, is_correct = split_query(query.data)
-    if is_correct == QuizzTypeEnum.WORDSETS.value:
-        return await handle_main_menu(update, context)
-
-    logger.debug(f"handle wordset play :: {prefix=} : {is_correct=}")
     user_info = get_context_data(context.user_data, UserInfo)
     bot_info = get_context_data(context.user_data, BotInfo)
-
     stats = bot_info.stat_data
-    if int(is_correct):
+    play_word = bot_info.quizz_active_data
+    try:
+        step, option = (int(arg) for arg in context.args)
+    except ValueError:
+        return None
+    if not play_word:
+        # the quiz was trimmed after a long pause, its keyboard leads back to the menu
+        return await show_quiz_expired(context)
+    if not 0 <= option < len(play_word.variants) or step != stats["correct"] + stats["incorrect"]:
+        logger.debug("handle wordset play :: stale answer :: step=%s", step)
+        return None
+
+    is_correct = option == play_word.answer
+    logger.debug("handle wordset play :: option=%s : is_correct=%s", option, is_correct)
+    if is_correct:
         stats["correct"] += 1
     else:
         stats["incorrect"] += 1
+
+    attempt_buffer: AttemptBuffer | None = context.bot_data.get("attempt_buffer")
+    if attempt_buffer:
+        attempt = play_word.variants[option]
+        await attempt_buffer.record(make_attempt(user_info.user_id, play_word, attempt, is_correct))
+    srs: SrsStore | None = context.bot_data.get("srs")
+    if srs is not None:
+        # looked up by word, card indices change when users are handed over
+        card = srs.add(user_info.user_id, play_word.id, play_word.word, play_word.correct)
+        srs.review(card, is_correct)
+    stats_store: StatsStore | None = context.bot_data.get("stats")
+    if stats_store is not None:
+        stats_store.record(user_info.user_id, play_word.id, play_word.word, is_correct)
     return await wordset_quizz_play(context)
 
 
+async def answer_stale(update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
+    """Stop the spinner of a button from an old or foreign keyboard"""
+    await update.callback_query.answer()
+    return None
+
+
+@timed_handler
 async def cancel(update: Update, _: ContextTypes.DEFAULT_TYPE) -> int:
     """Cancel and end the conversation."""
     if not update.message or not update.message.from_user:
@@ -305,39 +597,297 @@ async def cancel(update: Update, _: ContextTypes.DEFAULT_TYPE) -> int:
     return ConversationHandler.END
 
 
-def main() -> None:
-    """Run the bot."""
-    logger.info("bot :: start")
-    bot_token = os.getenv("BOT_TOKEN")
-    if not bot_token:
-        return None
-    application = Application.builder().token(bot_token).build()
+def register_metrics(application: Application) -> None:
+    def in_flight_quizzes() -> int:
+        return sum(
+            1 for user_data in application.user_data.values()
+            if (bot_info := get_context_data(user_data, BotInfo)) and bot_info.quizz_data
+        )
 
-    bot_email = os.getenv("BOT_EMAIL")
-    bot_pass = os.getenv("BOT_PASS")
-    api_token = get_bot_token(bot_email, bot_pass)
-    if not api_token:
-        logger.info("bot api token :: empty")
-        return None
+    rate_limiter: PriorityRateLimiter = application.bot.rate_limiter
+    metrics.gauge("bot_active_sessions", "Users with session data", lambda: len(application.user_data))
+    metrics.gauge("bot_in_flight_quizzes", "Quizzes in progress", in_flight_quizzes)
+    update_processor = application.update_processor
+    if isinstance(update_processor, UserOrderedUpdateProcessor):
+        metrics.gauge("bot_updates_users_in_flight", "Users with an update in progress",
+                      lambda: update_processor.active_keys)
+        metrics.gauge("bot_updates_waiting_for_user", "Updates queued behind their user",
+                      lambda: update_processor.waiting)
+    metrics.gauge("bot_rate_limiter_queue_depth", "Bot API calls waiting", lambda: rate_limiter.queue_depth)
+    metrics.gauge("bot_rate_limiter_wait_seconds", "Total time spent waiting", lambda: rate_limiter.stats.total_wait)
+    metrics.gauge("wordsets_cache_hits", "Wordsets cache hits", lambda: wordsets_cache.stats.hits)
+    metrics.gauge("wordsets_cache_misses", "Wordsets cache misses", lambda: wordsets_cache.stats.misses)
+    metrics.gauge("wordsets_cache_evictions", "Wordsets cache evictions", lambda: wordsets_cache.stats.evictions)
+    session_manager: SessionManager = application.bot_data["session_manager"]
+    metrics.gauge("bot_sessions_resident", "Sessions kept in memory", lambda: session_manager.resident)
+    metrics.gauge("bot_sessions_spilled", "Sessions moved to the session database", lambda: session_manager.spilled)
+    metrics.gauge("bot_sessions_bytes", "Estimated memory of resident sessions", lambda: session_manager.total_bytes)
+    metrics.gauge("bot_sessions_trimmed", "Abandoned quizzes trimmed", lambda: session_manager.stats.trimmed)
+    metrics.gauge("srs_cards", "Spaced repetition cards", lambda: len(application.bot_data.get("srs") or ()))
+    metrics.gauge("stats_answers", "Answers counted in the statistics", lambda: application.bot_data["stats"].total.answers)
+    metrics.gauge("log_records_sampled_out", "Log records dropped by sampling", lambda: log_stats.sampled_out)
+    metrics.gauge("log_records_truncated", "Log records cut to the payload cap", lambda: log_stats.truncated)
+    metrics.gauge("cleanup_failed_deletes", "Messages that could not be deleted", lambda: cleanup_stats.failed)
+    metrics.gauge("cleanup_bulk_deletes", "deleteMessages calls accepted", lambda: cleanup_stats.bulk_ok)
+    metrics.gauge(
+        "attempts_buffered", "Attempts waiting for delivery",
+        lambda: len(application.bot_data.get("attempt_buffer") or ()),
+    )
+    attempt_buffer: AttemptBuffer | None = application.bot_data.get("attempt_buffer")
+    if attempt_buffer:
+        metrics.gauge("attempts_rejected", "Attempts refused by the backend", lambda: attempt_buffer.stats.rejected)
+        metrics.gauge("attempts_dropped", "Attempts given up on a full buffer", lambda: attempt_buffer.stats.dropped)
+
+
+async def save_stores(application: Application) -> None:
+    """Write the SRS cards and the statistics to their files if they changed
+    since the last save, exchange the answer totals with the other workers"""
+    saved = application.bot_data.setdefault("saved_changes", {})
+    stores = (
+        ("srs", shard_file(os.getenv("SRS_FILE", "srs.pickle"))),
+        ("stats", shard_file(os.getenv("STATS_FILE", "stats.pickle"))),
+    )
+    for name, filepath in stores:
+        store: SrsStore | StatsStore | None = application.bot_data.get(name)
+        if store is not None and filepath and saved.get(name) != store.changes:
+            saved[name] = store.changes
+            # the snapshot is taken on the event loop, only the write is threaded
+            await asyncio.to_thread(write_atomic, filepath, store.dumps())
+    stats_store: StatsStore | None = application.bot_data.get("stats")
+    shared_totals: SharedTotals | None = application.bot_data.get("shared_totals")
+    if stats_store is not None and shared_totals:
+        stats_store.others = await asyncio.to_thread(
+            shared_totals.exchange, stats_store.total.answers, stats_store.total.correct
+        )
 
-    application.bot_data["bot_token"] = api_token
+
+async def save_stores_loop(application: Application) -> None:
+    while True:
+        await asyncio.sleep(STORE_SAVE_INTERVAL)
+        try:
+            await save_stores(application)
+        except Exception:
+            logger.exception("stores :: save failed")
+
+
+async def post_init(application: Application) -> None:
+    prerender_menus(main_bot_menu, quiz_end_menu, stats_menu)
+    token_manager = TokenManager(
+        os.getenv("BOT_EMAIL"),
+        os.getenv("BOT_PASS"),
+        default_ttl=float(os.getenv("API_TOKEN_TTL", 3600)),
+        refresh_margin=float(os.getenv("API_TOKEN_REFRESH_MARGIN", 60)),
+    )
+    token_manager.start()
+    application.bot_data["token_manager"] = token_manager
+    get_api_client().reauth = token_manager.reauth
+    # the refresh loop keeps trying in the background when the deadline passes
+    started = time.monotonic()
+    try:
+        if await asyncio.wait_for(asyncio.shield(token_manager.get_bot_token()), BOT_LOGIN_DEADLINE):
+            logger.info("bot api token :: ready in %.2fs", time.monotonic() - started)
+        else:
+            logger.warning("bot api token :: login failed, starting without it")
+    except asyncio.TimeoutError:
+        logger.warning("bot api token :: not ready after %ss, starting without it", BOT_LOGIN_DEADLINE)
+
+    quiz_engine_db = os.getenv("QUIZ_ENGINE_DB")
+    if quiz_engine_db:
+        from quiz_engine import QuizEngine
+
+        application.bot_data["quiz_engine"] = QuizEngine(
+            quiz_engine_db,
+            distractors=int(os.getenv("QUIZ_ENGINE_DISTRACTORS", 3)),
+            ttl=float(os.getenv("QUIZ_ENGINE_TTL", 24 * 3600)),
+        )
+
+    srs_file = shard_file(os.getenv("SRS_FILE", "srs.pickle"))
+    if srs_file and os.path.exists(srs_file):
+        application.bot_data["srs"] = await asyncio.to_thread(SrsStore.load, srs_file)
+    else:
+        application.bot_data["srs"] = SrsStore()
+    application.bot_data["saved_changes"] = {"srs": application.bot_data["srs"].changes}
+
+    stats_file = shard_file(os.getenv("STATS_FILE", "stats.pickle"))
+    if stats_file and os.path.exists(stats_file):
+        application.bot_data["stats"] = await asyncio.to_thread(
+            StatsStore.load, stats_file, STATS_WINDOW, STATS_TOP_WORDS, STATS_TZ_OFFSET
+        )
+    else:
+        application.bot_data["stats"] = StatsStore(STATS_WINDOW, STATS_TOP_WORDS, STATS_TZ_OFFSET)
+    application.bot_data["saved_changes"]["stats"] = application.bot_data["stats"].changes
+    session_db = os.getenv("SESSION_DB", "sessions.db")
+    if SHARD_ID and session_db:
+        # shard workers share the session database, the totals go there too
+        application.bot_data["shared_totals"] = await asyncio.to_thread(SharedTotals, session_db, SHARD_ID)
+
+    # the attempts endpoint is not part of every backend
+    if env_flag("ATTEMPTS_ENABLED"):
+        attempt_buffer = AttemptBuffer(
+            token_manager.get_bot_token,
+            journal_path=shard_file(os.getenv("ATTEMPTS_JOURNAL", "attempts.journal")),
+            batch_size=int(os.getenv("ATTEMPTS_BATCH_SIZE", 100)),
+            flush_interval=float(os.getenv("ATTEMPTS_FLUSH_INTERVAL", 5)),
+            max_buffer=int(os.getenv("ATTEMPTS_MAX_BUFFER", 10000)),
+            max_wait=float(os.getenv("ATTEMPTS_MAX_WAIT", 5)),
+        )
+        attempt_buffer.start()
+        application.bot_data["attempt_buffer"] = attempt_buffer
+
+    metrics_port = int(os.getenv("METRICS_PORT", 0))
+    if metrics.enabled and metrics_port:
+        register_metrics(application)
+        metrics_server = HttpServer({
+            **METRICS_ROUTES, ("GET", "/debug/sessions"): application.bot_data["session_manager"].endpoint,
+        })
+        await metrics_server.start(os.getenv("METRICS_LISTEN", "127.0.0.1"), metrics_port)
+        application.bot_data["metrics_server"] = metrics_server
+
+    application.bot_data["session_manager"].start()
+    application.bot_data["store_saver"] = asyncio.create_task(save_stores_loop(application))
+
+    if env_flag("QUIZ_PREFETCH"):
+        application.bot_data["quiz_prefetcher"] = QuizPrefetcher(
+            max_in_flight=int(os.getenv("QUIZ_PREFETCH_MAX_IN_FLIGHT", 20)),
+            max_per_user=WORDSETS_PAGE_SIZE,
+        )
+
+
+async def post_shutdown(application: Application) -> None:
+    quiz_engine: QuizEngine | None = application.bot_data.get("quiz_engine")
+    if quiz_engine:
+        quiz_engine.close()
+    metrics_server: HttpServer | None = application.bot_data.get("metrics_server")
+    if metrics_server:
+        await metrics_server.stop()
+    session_manager: SessionManager | None = application.bot_data.get("session_manager")
+    if session_manager:
+        await session_manager.stop()
+    store_saver: asyncio.Task | None = application.bot_data.pop("store_saver", None)
+    if store_saver:
+        store_saver.cancel()
+    await save_stores(application)
+    shared_totals: SharedTotals | None = application.bot_data.get("shared_totals")
+    if shared_totals:
+        shared_totals.close()
+    attempt_buffer: AttemptBuffer | None = application.bot_data.get("attempt_buffer")
+    if attempt_buffer:
+        await attempt_buffer.stop()
+    token_manager: TokenManager | None = application.bot_data.get("token_manager")
+    if token_manager:
+        await token_manager.stop()
+    await close_api_client()
+
+
+def build_application(bot_token: str, request: BaseRequest | None = None,
+                      get_updates_request: BaseRequest | None = None) -> Application:
+    builder = (
+        Application.builder()
+        .token(bot_token)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .rate_limiter(PriorityRateLimiter(
+            overall_rate=float(os.getenv("RATE_LIMIT_OVERALL", 30)),
+            overall_burst=float(os.getenv("RATE_LIMIT_OVERALL_BURST", 30)),
+            chat_rate=float(os.getenv("RATE_LIMIT_CHAT", 1)),
+            chat_burst=float(os.getenv("RATE_LIMIT_CHAT_BURST", 3)),
+            max_retries=int(os.getenv("RATE_LIMIT_MAX_RETRIES", 2)),
+        ))
+    )
+    base_url = os.getenv("TELEGRAM_BASE_URL")
+    if base_url:
+        builder.base_url(base_url)
+    if request:
+        builder.request(request)
+    if get_updates_request:
+        builder.get_updates_request(get_updates_request)
+    update_concurrency = int(os.getenv("UPDATE_CONCURRENCY", 32))
+    if update_concurrency > 1:
+        builder.concurrent_updates(UserOrderedUpdateProcessor(update_concurrency))
+    update_queue_size = int(os.getenv("UPDATE_QUEUE_SIZE", 0))
+    if update_queue_size:
+        builder.update_queue(asyncio.Queue(maxsize=update_queue_size))
+    session_db = os.getenv("SESSION_DB", "sessions.db")
+    if session_db:
+        builder.persistence(
+            SqlitePersistence(session_db, update_interval=float(os.getenv("SESSION_FLUSH_INTERVAL", 10)),
+                              lazy=bool(SHARD_ID))
+        )
+    application = builder.build()
+    metrics.enabled = env_flag("METRICS_ENABLED")
 
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler("start", start)],
         states={
             StateEnum.CHOOSING_ACT: [
-                CallbackQueryHandler(handle_main_menu, pattern=main_bot_menu.prefix)
+                CallbackRouter({QuizzTypeEnum.MAIN_MENU: handle_main_menu})
             ],
             StateEnum.CHOOSING_WORDSET: [
-                CallbackQueryHandler(handle_wordset_menu, pattern=QuizzTypeEnum.WORDSETS.value)
+                CallbackRouter({QuizzTypeEnum.WORDSETS: handle_wordset_menu})
             ],
             StateEnum.WORD_PLAY: [
-                CallbackQueryHandler(handle_wordset_play, pattern=QuizzTypeEnum.WORDSETS_WORD.value)
+                CallbackRouter({
+                    QuizzTypeEnum.WORDSETS_WORD: handle_wordset_play,
+                    QuizzTypeEnum.MAIN_MENU: handle_main_menu,
+                })
             ],
         },
-        fallbacks=[CommandHandler("cancel", cancel)],
+        fallbacks=[CommandHandler("cancel", cancel), CallbackRouter({}, default=answer_stale)],
+        name="main_conversation",
+        persistent=bool(session_db),
+        # /start recovers a conversation whose quiz was trimmed
+        allow_reentry=True,
     )
+    session_manager = SessionManager(
+        application,
+        memory_budget=int(os.getenv("SESSION_MEMORY_BUDGET", 64 * 1024 * 1024)),
+        idle_timeout=float(os.getenv("SESSION_IDLE_TIMEOUT", 1800)),
+        quiz_timeout=float(os.getenv("QUIZ_ABANDON_TIMEOUT", 900)),
+        max_messages=int(os.getenv("SESSION_MAX_MESSAGES", 50)),
+        sweep_interval=float(os.getenv("SESSION_SWEEP_INTERVAL", 30)),
+        lazy=bool(SHARD_ID),
+    )
+    application.bot_data["session_manager"] = session_manager
+    application.add_handler(session_manager.handler(), group=-1)
     application.add_handler(conv_handler)
+    return application
+
+
+def main() -> None:
+    """Run the bot."""
+    setup_logging()
+    logger.info("bot :: start")
+    bot_token = os.getenv("BOT_TOKEN")
+    if not bot_token:
+        return None
+
+    bot_mode = os.getenv("BOT_MODE", "polling")
+    if bot_mode == "sharded":
+        from sharding import serve_sharded
+
+        asyncio.run(serve_sharded(
+            bot_token,
+            workers=int(os.getenv("SHARD_WORKERS", os.cpu_count() or 1)),
+            listen=os.getenv("WEBHOOK_LISTEN", "0.0.0.0"),
+            port=int(os.getenv("WEBHOOK_PORT", 8443)),
+            path=os.getenv("WEBHOOK_PATH", "/telegram"),
+            secret_token=os.getenv("WEBHOOK_SECRET") or None,
+            webhook_url=os.getenv("WEBHOOK_URL") or None,
+        ))
+        return None
+    application = build_application(bot_token)
+    if bot_mode == "webhook":
+        from webhook import serve_webhook
+
+        asyncio.run(serve_webhook(
+            application,
+            listen=os.getenv("WEBHOOK_LISTEN", "0.0.0.0"),
+            port=int(os.getenv("WEBHOOK_PORT", 8443)),
+            path=os.getenv("WEBHOOK_PATH", "/telegram"),
+            secret_token=os.getenv("WEBHOOK_SECRET") or None,
+            webhook_url=os.getenv("WEBHOOK_URL") or None,
+        ))
+        return None
     application.run_polling()
 
 
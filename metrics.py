@@ -0,0 +1,234 @@
+import bisect
+import functools
+import math
+import sys
+import threading
+import time
+import traceback
+from collections import Counter as StackCounter
+from http import HTTPStatus
+from typing import Callable
+
+from httpserver import HttpRequest, HttpResponse
+
+LabelsKey = tuple[tuple[str, str], ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _labels_key(labels: dict[str, str]) -> LabelsKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key: LabelsKey, extra: LabelsKey = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self.values: dict[LabelsKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = _labels_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> list[str]:
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in self.values.items()]
+
+
+class Gauge(Counter):
+    """Gauge that is set directly or read from a callback at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str,
+                 callback: Callable[[], float | dict[LabelsKey, float]] | None = None):
+        super().__init__(name, help_text)
+        self.callback = callback
+
+    def set(self, value: float, **labels: str) -> None:
+        self.values[_labels_key(labels)] = value
+
+    def samples(self) -> list[str]:
+        if self.callback is not None:
+            value = self.callback()
+            self.values = value if isinstance(value, dict) else {(): value}
+        return super().samples()
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets) + (math.inf,)
+        self.values: dict[LabelsKey, list] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = _labels_key(labels)
+        series = self.values.get(key)
+        if series is None:
+            series = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def samples(self) -> list[str]:
+        lines = []
+        for key, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = (("le", _format_value(bound)),)
+                lines.append(f"{self.name}_bucket{_format_labels(key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._metrics: dict[str, Counter | Histogram] = {}
+
+    def _register(self, metric):
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self._register(Counter(name, help_text))
+
+    def gauge(self, name: str, help_text: str,
+              callback: Callable[[], float | dict[LabelsKey, float]] | None = None) -> Gauge:
+        return self._register(Gauge(name, help_text, callback))
+
+    def histogram(self, name: str, help_text: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+handler_latency = metrics.histogram("bot_handler_seconds", "Handler latency")
+handler_errors = metrics.counter("bot_handler_errors_total", "Handler exceptions")
+api_latency = metrics.histogram("api_request_seconds", "Backend API request latency")
+api_errors = metrics.counter("api_request_errors_total", "Failed backend API requests")
+bot_api_calls = metrics.counter("bot_api_calls_total", "Bot API calls")
+bot_api_errors = metrics.counter("bot_api_errors_total", "Failed Bot API calls")
+
+
+def timed_handler(func):
+    """Record latency and errors of a handler while metrics are enabled."""
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        if not metrics.enabled:
+            return await func(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            handler_errors.inc(handler=name)
+            raise
+        finally:
+            handler_latency.observe(time.perf_counter() - started, handler=name)
+
+    return wrapper
+
+
+class SamplingProfiler:
+    """Sample the stack of one thread from a background thread.
+
+    Nothing runs while the profiler is stopped. ``dump`` returns the
+    samples in collapsed-stack format, one ``frame;frame;frame count`` per line.
+    """
+
+    def __init__(self, interval: float = 0.005, thread_id: int | None = None):
+        self.interval = interval
+        self.thread_id = thread_id or threading.main_thread().ident
+        self.samples: StackCounter[str] = StackCounter()
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return None
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return None
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame)
+            self.samples[";".join(f"{entry.name} ({entry.filename}:{entry.lineno})" for entry in stack)] += 1
+
+    def dump(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common()) + "\n"
+
+
+profiler = SamplingProfiler()
+
+
+async def metrics_endpoint(_: HttpRequest) -> HttpResponse:
+    return HttpResponse(body=metrics.render().encode(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+async def profile_endpoint(request: HttpRequest) -> HttpResponse:
+    """Control the profiler with ?action=start|stop|dump|reset."""
+    action = request.query.get("action", "dump")
+    if action == "start":
+        profiler.start()
+    elif action == "stop":
+        profiler.stop()
+    elif action == "reset":
+        profiler.samples.clear()
+    elif action != "dump":
+        return HttpResponse(HTTPStatus.BAD_REQUEST, b"unknown action")
+    if action == "dump":
+        return HttpResponse(body=profiler.dump().encode())
+    return HttpResponse(body=f"profiler running: {profiler.running}\n".encode())
+
+
+METRICS_ROUTES = {
+    ("GET", "/metrics"): metrics_endpoint,
+    ("GET", "/debug/profile"): profile_endpoint,
+}
@@ -0,0 +1,211 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+from dataclasses import fields
+from enum import Enum
+from typing import Any
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from common import BotInfo, QuizzTypeEnum, UserInfo, WordQuizz
+
+logger = logging.getLogger(__name__)
+
+SESSION_RECORDS = {record._field_name_: record for record in (UserInfo, BotInfo)}
+
+
+def _pack(record: Any) -> list:
+    return [getattr(record, f.name) if f.metadata.get("persist", True) else f.default for f in fields(record)]
+
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, WordQuizz):
+        return _pack(value)
+    raise TypeError(f"{type(value)} is not serializable")
+
+
+def _decode_word(value: list | dict) -> WordQuizz:
+    # sessions saved before words were packed keep the API dict
+    if isinstance(value, dict):
+        return WordQuizz.from_api(value)
+    word = WordQuizz(*value)
+    word.variants = tuple(word.variants)
+    return word
+
+
+def encode_user_data(data: dict) -> str:
+    """Pack session records into a compact JSON array per record"""
+    packed = {name: _pack(record) for name, record in data.items() if name in SESSION_RECORDS}
+    return json.dumps(packed, separators=(",", ":"), default=_encode_value, ensure_ascii=False)
+
+
+def decode_user_data(raw: str) -> dict:
+    data = {}
+    for name, values in json.loads(raw).items():
+        record_type = SESSION_RECORDS.get(name)
+        if not record_type:
+            continue
+        # fields that were dropped from the end of a record are ignored
+        record = record_type(*values[:len(fields(record_type))])
+        if isinstance(record, BotInfo):
+            if record.quizz_type is not None:
+                record.quizz_type = QuizzTypeEnum(record.quizz_type)
+            record.quizz_data = [_decode_word(word) for word in record.quizz_data]
+            record.quizz_active_data = _decode_word(record.quizz_active_data) if record.quizz_active_data else None
+        data[name] = record
+    return data
+
+
+class SqlitePersistence(BasePersistence[dict, dict, dict]):
+    """Keep user sessions and conversation states in a local SQLite file.
+
+    Only users marked dirty by the application are written on each flush,
+    one row per user. A ``lazy`` persistence loads nothing at startup, the
+    sessions are read per user with ``get_users`` and
+    ``get_user_conversations``; shard workers share one database and each
+    reads only the users it owns.
+    """
+
+    def __init__(self, filepath: str, update_interval: float = 60, lazy: bool = False):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.filepath = filepath
+        self.lazy = lazy
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(filepath, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS user_data (user_id INTEGER PRIMARY KEY, data TEXT NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS conversations ("
+                "name TEXT NOT NULL, key TEXT NOT NULL, state INTEGER, PRIMARY KEY (name, key))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS user_state ("
+                "user_id INTEGER NOT NULL, kind TEXT NOT NULL, data BLOB NOT NULL, PRIMARY KEY (user_id, kind))"
+            )
+
+    def _execute(self, sql: str, params: tuple = ()) -> list:
+        with self._lock, self._conn:
+            return self._conn.execute(sql, params).fetchall()
+
+    async def _run(self, sql: str, params: tuple = ()) -> list:
+        return await asyncio.to_thread(self._execute, sql, params)
+
+    async def get_user_data(self) -> dict[int, dict]:
+        if self.lazy:
+            return {}
+        rows = await self._run("SELECT user_id, data FROM user_data")
+        return {user_id: decode_user_data(raw) for user_id, raw in rows}
+
+    async def get_users(self, user_ids: list[int]) -> dict[int, dict]:
+        """Load the sessions of some users, for a worker taking them over"""
+        placeholders = ",".join("?" * len(user_ids))
+        rows = await self._run(
+            f"SELECT user_id, data FROM user_data WHERE user_id IN ({placeholders})", tuple(user_ids)
+        )
+        return {user_id: decode_user_data(raw) for user_id, raw in rows}
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        await self._run(
+            "INSERT OR REPLACE INTO user_data (user_id, data) VALUES (?, ?)",
+            (user_id, encode_user_data(data)),
+        )
+
+    async def drop_user_data(self, user_id: int) -> None:
+        await self._run("DELETE FROM user_data WHERE user_id = ?", (user_id,))
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass
+
+    async def get_conversations(self, name: str) -> dict[tuple[int, ...], object]:
+        if self.lazy:
+            return {}
+        rows = await self._run("SELECT key, state FROM conversations WHERE name = ?", (name,))
+        return {tuple(json.loads(key)): state for key, state in rows}
+
+    async def get_user_conversations(self, name: str, user_ids: list[int]) -> dict[tuple[int, ...], object]:
+        """Conversation states of some users, the user id is the last part of a key"""
+        placeholders = ",".join("?" * len(user_ids))
+        rows = await self._run(
+            f"SELECT key, state FROM conversations WHERE name = ? AND json_extract(key, '$[#-1]') IN ({placeholders})",
+            (name, *user_ids),
+        )
+        return {tuple(json.loads(key)): state for key, state in rows}
+
+    async def put_user_state(self, rows: list[tuple[int, str, bytes]]) -> None:
+        """Store (user id, kind, data) rows of process-local state handed to another worker"""
+        await asyncio.to_thread(self._put_user_state, rows)
+
+    def _put_user_state(self, rows: list[tuple[int, str, bytes]]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO user_state (user_id, kind, data) VALUES (?, ?, ?)", rows)
+
+    async def user_state_ids(self) -> list[int]:
+        """Users whose handed over state waits for its new owner"""
+        rows = await self._run("SELECT DISTINCT user_id FROM user_state")
+        return [user_id for (user_id,) in rows]
+
+    async def take_user_state(self, user_ids: list[int]) -> list[tuple[int, str, bytes]]:
+        """Read and delete the handed over state of some users"""
+        return await asyncio.to_thread(self._take_user_state, user_ids)
+
+    def _take_user_state(self, user_ids: list[int]) -> list[tuple[int, str, bytes]]:
+        placeholders = ",".join("?" * len(user_ids))
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                f"SELECT user_id, kind, data FROM user_state WHERE user_id IN ({placeholders})", tuple(user_ids)
+            ).fetchall()
+            self._conn.execute(f"DELETE FROM user_state WHERE user_id IN ({placeholders})", tuple(user_ids))
+        return rows
+
+    async def update_conversation(
+        self, name: str, key: tuple[int, ...], new_state: object | None
+    ) -> None:
+        if new_state is None:
+            await self._run(
+                "DELETE FROM conversations WHERE name = ? AND key = ?", (name, json.dumps(key))
+            )
+            return None
+        await self._run(
+            "INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)",
+            (name, json.dumps(key), int(new_state)),
+        )
+
+    async def get_chat_data(self) -> dict[int, dict]:
+        return {}
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def update_callback_data(self, data: Any) -> None:
+        pass
+
+    async def flush(self) -> None:
+        await asyncio.to_thread(self._conn.close)
@@ -0,0 +1,72 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Iterable
+
+from core import QuizPage, get_wordset_quiz
+
+logger = logging.getLogger(__name__)
+
+
+class QuizPrefetcher:
+    """Fetch quizzes for the wordsets a user currently sees.
+
+    Every user has one slot with at most ``max_per_user`` quizzes. A new
+    schedule for the same user cancels the previous one, so paging away
+    drops the quizzes of the old page.
+    """
+
+    def __init__(self, max_in_flight: int = 20, max_per_user: int = 6, max_users: int = 1000):
+        self.max_in_flight = max_in_flight
+        self.max_per_user = max_per_user
+        self.max_users = max_users
+        self._in_flight: set[asyncio.Task] = set()
+        self._slots: OrderedDict[int, dict[str, asyncio.Task]] = OrderedDict()
+
+    def _on_done(self, task: asyncio.Task) -> None:
+        self._in_flight.discard(task)
+
+    def schedule(self, user_id: int, api_token: str, set_ids: Iterable[str]) -> None:
+        self.cancel(user_id)
+        slot = {}
+        for set_id in set_ids:
+            if len(slot) >= self.max_per_user or len(self._in_flight) >= self.max_in_flight:
+                break
+            task = asyncio.create_task(get_wordset_quiz(api_token, set_id))
+            task.add_done_callback(self._on_done)
+            self._in_flight.add(task)
+            slot[set_id] = task
+        if not slot:
+            return None
+        logger.debug("quiz prefetch :: %s :: %s", user_id, slot.keys())
+        self._slots[user_id] = slot
+        while len(self._slots) > self.max_users:
+            _, old_slot = self._slots.popitem(last=False)
+            self._cancel_slot(old_slot)
+
+    async def take(self, user_id: int, set_id: str) -> QuizPage | None:
+        """Return the prefetched first page and drop the rest of the user's slot."""
+        slot = self._slots.pop(user_id, None)
+        if not slot:
+            return None
+        task = slot.pop(set_id, None)
+        self._cancel_slot(slot)
+        if task is None:
+            return None
+        if task.cancelled():
+            return None
+        try:
+            return await task
+        except asyncio.CancelledError:
+            # a prefetch cancelled meanwhile is a miss, a cancelled caller is not
+            if task.cancelled() and not asyncio.current_task().cancelling():
+                return None
+            raise
+
+    def cancel(self, user_id: int) -> None:
+        self._cancel_slot(self._slots.pop(user_id, {}))
+
+    def _cancel_slot(self, slot: dict[str, asyncio.Task]) -> None:
+        for task in slot.values():
+            task.cancel()
+            self._in_flight.discard(task)
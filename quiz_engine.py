@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import random
+import sqlite3
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from core import QUIZ_PAGE_SIZE, QuizPage, get_wordset_words
+from resilience import no_deadline
+
+logger = logging.getLogger(__name__)
+
+
+def sample_distractors(correct: list[int], pool_size: int, k: int, seed: int | None = None) -> list[list[int]]:
+    """Pick ``k`` distinct pool indices per row, never the row's correct one.
+
+    With NumPy all rows are sampled in one vectorized pass: random keys
+    for the ``pool_size - 1`` candidates of every row are partitioned and
+    the indices at or above the correct one are shifted by one.
+    """
+    k = min(k, pool_size - 1)
+    if k <= 0:
+        return [[] for _ in correct]
+    if np is not None:
+        rng = np.random.default_rng(seed)
+        keys = rng.random((len(correct), pool_size - 1))
+        picked = np.argpartition(keys, k - 1, axis=1)[:, :k]
+        picked += picked >= np.asarray(correct)[:, None]
+        return picked.tolist()
+    rng = random.Random(seed)
+    rows = []
+    for own in correct:
+        picked = rng.sample(range(pool_size - 1), k)
+        rows.append([idx + (idx >= own) for idx in picked])
+    return rows
+
+
+class QuizEngine:
+    """Build quizzes in process from wordsets synced into a SQLite file.
+
+    Quizzes come in pages of the same structure as the
+    ``/words/sets/{id}/quizz/`` payload, so they can replace it. Words of a
+    page are shuffled, distractors come from the whole set. A stale set is
+    refreshed by one background task, however many users notice it.
+    """
+
+    def __init__(self, filepath: str, distractors: int = 3, ttl: float = 24 * 3600):
+        self.filepath = filepath
+        self.distractors = distractors
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._refreshing: dict[str, asyncio.Task] = {}
+        self._conn = sqlite3.connect(filepath, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS wordsets (set_id TEXT PRIMARY KEY, synced_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS words ("
+                "set_id TEXT NOT NULL, word_id TEXT NOT NULL, word TEXT NOT NULL, translate TEXT NOT NULL, "
+                "PRIMARY KEY (set_id, word_id))"
+            )
+
+    def _store(self, set_id: str, words: list[dict]) -> None:
+        rows = [(set_id, str(word["id"]), word["word"], word["translate"]) for word in words]
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM words WHERE set_id = ?", (set_id,))
+            self._conn.executemany("INSERT OR REPLACE INTO words VALUES (?, ?, ?, ?)", rows)
+            self._conn.execute("INSERT OR REPLACE INTO wordsets VALUES (?, ?)", (set_id, time.time()))
+
+    def _load(self, set_id: str, page: int, size: int) -> tuple[float | None, int, list[str], list[tuple[str, str, str]]]:
+        with self._lock:
+            synced = self._conn.execute(
+                "SELECT synced_at FROM wordsets WHERE set_id = ?", (set_id,)
+            ).fetchone()
+            if not synced:
+                return None, 0, [], []
+            translations = [row[0] for row in self._conn.execute(
+                "SELECT DISTINCT translate FROM words WHERE set_id = ?", (set_id,)
+            )]
+            total = self._conn.execute("SELECT COUNT(*) FROM words WHERE set_id = ?", (set_id,)).fetchone()[0]
+            words = self._conn.execute(
+                "SELECT word_id, word, translate FROM words WHERE set_id = ? ORDER BY rowid LIMIT ? OFFSET ?",
+                (set_id, size, (page - 1) * size),
+            ).fetchall()
+        return synced[0], total, translations, words
+
+    async def sync(self, set_id: str, words: list[dict]) -> None:
+        await asyncio.to_thread(self._store, str(set_id), words)
+
+    def build_quiz(self, words: list[tuple[str, str, str]], translations: list[str] | None = None,
+                   seed: int | None = None) -> list[dict]:
+        if translations is None:
+            translations = list(dict.fromkeys(translate for _, _, translate in words))
+        translate_idx = {translate: idx for idx, translate in enumerate(translations)}
+        correct = [translate_idx[translate] for _, _, translate in words]
+        distractors = sample_distractors(correct, len(translations), self.distractors, seed)
+        quiz = [
+            {
+                "id": word_id,
+                "word": word,
+                "translate": translate,
+                "wrong_words": [{"translate": translations[idx]} for idx in wrong],
+            }
+            for (word_id, word, translate), wrong in zip(words, distractors)
+        ]
+        random.shuffle(quiz)
+        return quiz
+
+    async def get_quiz(self, set_id: str, page: int = 1,
+                       size: int = QUIZ_PAGE_SIZE) -> tuple[QuizPage | None, bool]:
+        """Return a fresh quiz page for the set and whether the stored copy is stale"""
+        synced_at, total, translations, words = await asyncio.to_thread(self._load, str(set_id), page, size)
+        if synced_at is None or not words:
+            return None, True
+        quiz_page = QuizPage(self.build_quiz(words, translations), page=page, pages=-(-total // size), total=total)
+        return quiz_page, time.time() - synced_at > self.ttl
+
+    def refresh(self, api_token: str, set_id: str) -> asyncio.Task:
+        """Sync a set from the API in the background, joining a sync already running"""
+        set_id = str(set_id)
+        task = self._refreshing.get(set_id)
+        if task is None:
+            task = self._refreshing[set_id] = asyncio.create_task(self._refresh(api_token, set_id))
+            task.add_done_callback(lambda _: self._refreshing.pop(set_id, None))
+        return task
+
+    async def _refresh(self, api_token: str, set_id: str) -> None:
+        # not bound by the deadline of the handler that noticed the stale set
+        with no_deadline():
+            words = await get_wordset_words(api_token, set_id)
+        if words:
+            await self.sync(set_id, words)
+            logger.debug("quiz engine :: synced %s :: %s words", set_id, len(words))
+
+    def close(self) -> None:
+        for task in self._refreshing.values():
+            task.cancel()
+        with self._lock:
+            self._conn.close()
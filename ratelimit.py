@@ -0,0 +1,191 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from dataclasses import dataclass
+from enum import IntEnum
+from typing import Any, Callable, Coroutine
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from metrics import bot_api_calls, bot_api_errors, metrics
+
+logger = logging.getLogger(__name__)
+
+
+class PriorityEnum(IntEnum):
+    # PTB drops falsy rate_limit_args, so priorities start at 1
+    HIGH = 1
+    NORMAL = 2
+    LOW = 3
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available, refilling the bucket first."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+
+@dataclass
+class RateLimiterStats:
+    processed: int = 0
+    retries: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+
+
+class PriorityRateLimiter(BaseRateLimiter[int]):
+    """Pace Bot API calls with a global and a per-chat token bucket.
+
+    Waiting requests are released in priority order (``rate_limit_args``
+    takes a PriorityEnum value). A RetryAfter answer blocks the chat, or
+    the whole bot for calls without a chat, and the request is repeated.
+    """
+
+    def __init__(self, overall_rate: float = 30, overall_burst: float = 30,
+                 chat_rate: float = 1, chat_burst: float = 3, max_retries: int = 2):
+        self.overall_rate = overall_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.stats = RateLimiterStats()
+        self._overall = TokenBucket(overall_rate, overall_burst)
+        self._chats: dict[int | str, TokenBucket] = {}
+        self._queue: list[tuple[int, int, int | str | None, asyncio.Future]] = []
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._dispatcher: asyncio.Task | None = None
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    async def initialize(self) -> None:
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self) -> None:
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+
+    def _chat_bucket(self, chat_id: int | str) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                self._purge_chats()
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _purge_chats(self) -> None:
+        now = time.monotonic()
+        waiting = {chat_id for _, _, chat_id, _ in self._queue}
+        for chat_id, bucket in list(self._chats.items()):
+            if chat_id not in waiting and bucket.delay(now) == 0 and bucket.tokens >= bucket.capacity:
+                del self._chats[chat_id]
+
+    async def _dispatch(self) -> None:
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            now = time.monotonic()
+            overall_delay = self._overall.delay(now)
+            if overall_delay:
+                await asyncio.sleep(overall_delay)
+                continue
+
+            deferred = []
+            next_delay = None
+            while self._queue:
+                entry = heapq.heappop(self._queue)
+                future, chat_id = entry[3], entry[2]
+                if future.done():
+                    continue
+                chat_delay = self._chat_bucket(chat_id).delay(now) if chat_id is not None else 0
+                if chat_delay:
+                    deferred.append(entry)
+                    next_delay = chat_delay if next_delay is None else min(next_delay, chat_delay)
+                    continue
+                self._overall.take()
+                if chat_id is not None:
+                    self._chats[chat_id].take()
+                future.set_result(None)
+                next_delay = None
+                break
+            for entry in deferred:
+                heapq.heappush(self._queue, entry)
+            if next_delay:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), next_delay)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _acquire(self, chat_id: int | str | None, priority: int) -> None:
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._counter), chat_id, future))
+        self._wakeup.set()
+        started = time.monotonic()
+        await future
+        waited = time.monotonic() - started
+        self.stats.total_wait += waited
+        self.stats.max_wait = max(self.stats.max_wait, waited)
+
+    def _block(self, chat_id: int | str | None, retry_after: float) -> None:
+        bucket = self._overall if chat_id is None else self._chat_bucket(chat_id)
+        bucket.blocked_until = time.monotonic() + retry_after
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, bool | dict[str, Any] | list[dict[str, Any]]]],
+        args: Any,
+        kwargs: dict[str, Any],
+        endpoint: str,
+        data: dict[str, Any],
+        rate_limit_args: int | None,
+    ) -> bool | dict[str, Any] | list[dict[str, Any]]:
+        priority = rate_limit_args or PriorityEnum.NORMAL
+        chat_id = data.get("chat_id")
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(chat_id, priority)
+            self.stats.processed += 1
+            if metrics.enabled:
+                bot_api_calls.inc(endpoint=endpoint)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if metrics.enabled:
+                    bot_api_errors.inc(endpoint=endpoint)
+                retry_after = e.retry_after
+                if not isinstance(retry_after, (int, float)):
+                    retry_after = retry_after.total_seconds()
+                logger.warning("rate limiter :: %s :: retry after %s", endpoint, retry_after)
+                self._block(chat_id, retry_after)
+                if attempt == self.max_retries:
+                    raise
+                self.stats.retries += 1
+            except Exception:
+                if metrics.enabled:
+                    bot_api_errors.inc(endpoint=endpoint)
+                raise
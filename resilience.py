@@ -0,0 +1,115 @@
+import contextlib
+import contextvars
+import functools
+import logging
+import random
+import time
+from enum import Enum
+
+logger = logging.getLogger(__name__)
+
+_deadline: contextvars.ContextVar[float | None] = contextvars.ContextVar("api_deadline", default=None)
+
+
+class CircuitStateEnum(Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Stop calling an endpoint after repeated failures.
+
+    After ``failure_threshold`` failures in a row the circuit opens and
+    calls are rejected for ``reset_timeout`` seconds. Then one trial call
+    is let through: success closes the circuit, failure opens it again.
+    A trial that ends without a result, cancelled or skipped, counts as a
+    failure; one that is lost anyway is replaced after ``reset_timeout``.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CircuitStateEnum.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def allow(self) -> bool:
+        if self.state is CircuitStateEnum.CLOSED:
+            return True
+        now = time.monotonic()
+        if now - self.opened_at >= self.reset_timeout:
+            # opened_at of a half open circuit is the start of its trial
+            self.state = CircuitStateEnum.HALF_OPEN
+            self.opened_at = now
+            return True
+        return False
+
+    @property
+    def trial(self) -> bool:
+        return self.state is CircuitStateEnum.HALF_OPEN
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.state = CircuitStateEnum.CLOSED
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state is CircuitStateEnum.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state is not CircuitStateEnum.OPEN:
+                logger.warning("circuit breaker :: %s :: open", self.name)
+            self.state = CircuitStateEnum.OPEN
+            self.opened_at = time.monotonic()
+
+
+def backoff_delay(attempt: int, base: float = 0.2, cap: float = 5) -> float:
+    """Capped exponential backoff with full jitter, attempt counts from 1."""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+def remaining_time() -> float | None:
+    """Seconds left until the current deadline, None when there is none."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+@contextlib.contextmanager
+def deadline(seconds: float):
+    """Limit the time of all API calls made inside the block.
+
+    A nested deadline can only shorten the outer one.
+    """
+    new_deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    if current is not None:
+        new_deadline = min(current, new_deadline)
+    token = _deadline.set(new_deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+@contextlib.contextmanager
+def no_deadline():
+    """Lift the current deadline for work that outlives the caller, like a background sync"""
+    token = _deadline.set(None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def with_deadline(seconds: float):
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with deadline(seconds):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
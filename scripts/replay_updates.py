@@ -0,0 +1,63 @@
+"""Replay recorded Telegram updates against the webhook server.
+
+Usage: python scripts/replay_updates.py updates.jsonl http://127.0.0.1:8443/telegram
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+
+import httpx
+
+
+def load_updates(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        text = f.read().strip()
+    if text.startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+async def replay(updates: list[dict], url: str, secret: str | None, concurrency: int) -> None:
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    queue: asyncio.Queue[dict] = asyncio.Queue()
+    for update in updates:
+        queue.put_nowait(update)
+    latencies = []
+    statuses: dict[int, int] = {}
+
+    async def worker(client: httpx.AsyncClient) -> None:
+        while not queue.empty():
+            update = queue.get_nowait()
+            started = time.perf_counter()
+            response = await client.post(url, json=update, headers=headers)
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    started = time.perf_counter()
+    async with httpx.AsyncClient() as client:
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(f"updates: {len(latencies)} in {elapsed:.3f}s ({len(latencies) / elapsed:.1f}/s)")
+    print(f"statuses: {statuses}")
+    if len(latencies) > 1:
+        quantiles = statistics.quantiles(latencies, n=100)
+        print(f"ttfb p50: {quantiles[49] * 1000:.2f}ms p95: {quantiles[94] * 1000:.2f}ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("updates", help="JSON array or JSON lines file with recorded updates")
+    parser.add_argument("url", help="webhook url")
+    parser.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET"))
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(replay(load_updates(args.updates), args.url, args.secret, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+import asyncio
+import json
+import logging
+import sys
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+import telegram
+from telegram import Update
+from telegram.ext import Application, ContextTypes, ConversationHandler, TypeHandler
+
+from common import BotInfo, UserInfo, get_context_data
+from httpserver import HttpRequest, HttpResponse
+from persistence import SqlitePersistence
+
+if TYPE_CHECKING:
+    from telegram.ext._utils.trackingdict import TrackingDict
+
+logger = logging.getLogger(__name__)
+
+SESSION_TOP = 20
+# PTB has no public way to drop a user from memory or to set a conversation
+# state, the helpers below touch its private state of these versions only
+PTB_PRIVATE_VERSIONS = ((20, 8),)
+
+
+def check_ptb_private() -> None:
+    if telegram.__version_info__[:2] not in PTB_PRIVATE_VERSIONS:
+        raise RuntimeError(
+            f"sessions :: python-telegram-bot {telegram.__version__} is not supported, "
+            "check drop_user_data and conversation_states"
+        )
+
+
+def drop_user_data(application: Application, user_id: int) -> None:
+    """Remove a user's data from memory, the persisted copy is kept"""
+    application._user_data.pop(user_id, None)
+
+
+def conversation_states(handler: ConversationHandler) -> "TrackingDict":
+    """States of a conversation, changes through ``data`` are not persisted"""
+    return handler._conversations
+
+
+def deep_sizeof(obj: object, seen: set[int] | None = None) -> int:
+    """Approximate memory of an object graph, shared objects are counted once"""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(key, seen) + deep_sizeof(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    else:
+        # slotted records and telegram objects, the bot reference is shared
+        for cls in type(obj).__mro__:
+            for name in getattr(cls, "__slots__", ()):
+                if name != "_bot" and hasattr(obj, name):
+                    size += deep_sizeof(getattr(obj, name), seen)
+    return size
+
+
+def quiz_loads(bot_data: dict) -> dict[int, asyncio.Task]:
+    """Quiz page loads in flight per user.
+
+    They live in ``bot_data``: PTB deep-copies ``user_data`` on every
+    persistence flush and a task cannot be copied.
+    """
+    return bot_data.setdefault("quiz_loads", {})
+
+
+def cancel_quiz_load(bot_data: dict, user_id: int) -> None:
+    task = quiz_loads(bot_data).pop(user_id, None)
+    if task is not None:
+        task.cancel()
+
+
+def trim_quiz(bot_info: BotInfo) -> bool:
+    """Drop the words of an unfinished quiz, its keyboard answers go stale"""
+    if not (bot_info.quizz_data or bot_info.quizz_active_data or bot_info.quizz_page):
+        return False
+    bot_info.quizz_data = []
+    bot_info.quizz_active_data = None
+    bot_info.quizz_page = 0
+    return True
+
+
+@dataclass
+class SessionStats:
+    trimmed: int = 0
+    spilled: int = 0
+    restored: int = 0
+    evicted: int = 0
+
+
+class SessionManager:
+    """Keep resident sessions within a memory budget.
+
+    Every update touches its user in an LRU list. A periodic sweep trims
+    quizzes idle longer than ``quiz_timeout``, caps ``msg_to_delete`` and
+    moves sessions idle longer than ``idle_timeout``, or the least recently
+    used ones while the total is over ``memory_budget``, out of memory.
+    With SqlitePersistence a session is spilled and reloaded on the next
+    update of its user, without it the session is dropped. Session sizes are
+    measured with ``deep_sizeof`` when a session was touched since the last
+    sweep. A ``lazy`` manager loads every user from the persistence on
+    their first update, for shard workers that own only some users.
+    """
+
+    def __init__(self, application: Application, memory_budget: int = 0, idle_timeout: float = 1800,
+                 quiz_timeout: float = 900, max_messages: int = 50, sweep_interval: float = 30,
+                 min_idle: float = 60, lazy: bool = False):
+        check_ptb_private()
+        self.application = application
+        self.lazy = lazy
+        self.memory_budget = memory_budget
+        self.idle_timeout = idle_timeout
+        self.quiz_timeout = quiz_timeout
+        self.max_messages = max_messages
+        self.sweep_interval = sweep_interval
+        # a session with an update in progress is never moved out
+        self.min_idle = min_idle
+        self.stats = SessionStats()
+        self._seen: OrderedDict[int, float] = OrderedDict()
+        self._sizes: dict[int, int] = {}
+        self._dirty: set[int] = set()
+        self._spilled: set[int] = set()
+        self._restoring: dict[int, asyncio.Task] = {}
+        self._task: asyncio.Task | None = None
+
+    @property
+    def persistence(self) -> SqlitePersistence | None:
+        persistence = self.application.persistence
+        return persistence if isinstance(persistence, SqlitePersistence) else None
+
+    @property
+    def resident(self) -> int:
+        return len(self._seen)
+
+    @property
+    def spilled(self) -> int:
+        return len(self._spilled)
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(self._sizes.values())
+
+    def handler(self) -> TypeHandler:
+        """Handler to add in a group before the conversation"""
+        return TypeHandler(Update, self.track)
+
+    def touch(self, user_id: int) -> None:
+        self._seen[user_id] = time.monotonic()
+        self._seen.move_to_end(user_id)
+        self._dirty.add(user_id)
+
+    async def track(self, update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
+        user = update.effective_user
+        if user is None:
+            return None
+        unknown = user.id in self._spilled or (self.lazy and user.id not in self._seen)
+        self.touch(user.id)
+        task = self._restoring.get(user.id)
+        if task is None and unknown:
+            task = self._restoring[user.id] = asyncio.create_task(self._restore(user.id))
+            task.add_done_callback(lambda _: self._restoring.pop(user.id, None))
+        if task is not None:
+            await asyncio.shield(task)
+
+    async def _restore(self, user_id: int) -> None:
+        try:
+            await self.load_users([user_id])
+        finally:
+            self._spilled.discard(user_id)
+        self.stats.restored += 1
+        logger.debug("sessions :: restored %s", user_id)
+
+    async def load_users(self, user_ids: list[int], replace: bool = False) -> None:
+        """Read the sessions and conversation states of some users from the persistence.
+
+        Without ``replace`` only what is missing in memory is filled in.
+        """
+        persistence = self.persistence
+        if persistence is None:
+            return None
+        users = set(user_ids)
+        sessions = await persistence.get_users(user_ids)
+        for user_id in user_ids:
+            user_data = self.application.user_data[user_id]
+            if replace:
+                user_data.clear()
+            if not user_data:
+                user_data.update(sessions.get(user_id, {}))
+        for handler in self._conversation_handlers():
+            stored = await persistence.get_user_conversations(handler.name, user_ids)
+            conversations = conversation_states(handler)
+            if replace:
+                for key in [key for key in conversations if key[-1] in users and key not in stored]:
+                    # untracked, the persistence must not delete the stored state
+                    conversations.data.pop(key)
+            else:
+                stored = {key: state for key, state in stored.items() if key not in conversations}
+            conversations.update_no_track(stored)
+
+    def release_users(self, user_ids: list[int]) -> None:
+        """Forget users another worker took over, their sessions were flushed"""
+        users = set(user_ids)
+        for user_id in user_ids:
+            self._seen.pop(user_id, None)
+            self._sizes.pop(user_id, None)
+            self._dirty.discard(user_id)
+            self._spilled.discard(user_id)
+            cancel_quiz_load(self.application.bot_data, user_id)
+            drop_user_data(self.application, user_id)
+        for handler in self._conversation_handlers():
+            conversations = conversation_states(handler)
+            for key in [key for key in conversations if key[-1] in users]:
+                # untracked, the new owner keeps the stored state
+                conversations.data.pop(key)
+
+    def _conversation_handlers(self) -> list[ConversationHandler]:
+        return [
+            handler for handlers in self.application.handlers.values() for handler in handlers
+            if isinstance(handler, ConversationHandler) and handler.persistent
+        ]
+
+    def start(self) -> None:
+        # sessions loaded by the persistence are the least recently used ones
+        seeded = time.monotonic() - self.min_idle
+        for user_id in self.application.user_data:
+            self._seen.setdefault(user_id, seeded)
+            self._dirty.add(user_id)
+        if self._task is None:
+            self._task = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _sweep_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("sessions :: sweep failed")
+
+    def _measure(self, user_id: int) -> None:
+        user_data = self.application.user_data.get(user_id)
+        if not user_data:
+            self._sizes.pop(user_id, None)
+            return None
+        user_info = get_context_data(user_data, UserInfo)
+        if user_info and len(user_info.msg_to_delete) > self.max_messages:
+            # telegram keeps older messages out of reach of the bot anyway
+            del user_info.msg_to_delete[:-self.max_messages]
+        self._sizes[user_id] = deep_sizeof(user_data)
+
+    def _victims(self, now: float) -> list[int]:
+        """Sessions to move out, least recently used first"""
+        victims, total = [], self.total_bytes
+        for user_id, seen in self._seen.items():
+            idle = now - seen
+            if idle < self.min_idle:
+                break
+            over_budget = self.memory_budget and total > self.memory_budget
+            if idle < self.idle_timeout and not over_budget:
+                break
+            if user_id in self._restoring:
+                continue
+            victims.append(user_id)
+            total -= self._sizes.get(user_id, 0)
+        return victims
+
+    async def sweep(self) -> None:
+        now = time.monotonic()
+        for user_id in self._dirty:
+            self._measure(user_id)
+        self._dirty.clear()
+
+        trimmed = []
+        for user_id, seen in self._seen.items():
+            if now - seen < self.quiz_timeout:
+                break
+            bot_info = get_context_data(self.application.user_data.get(user_id), BotInfo)
+            if bot_info and trim_quiz(bot_info):
+                cancel_quiz_load(self.application.bot_data, user_id)
+                trimmed.append(user_id)
+                self._measure(user_id)
+        self.stats.trimmed += len(trimmed)
+
+        victims = self._victims(now)
+        persistence = self.persistence
+        if persistence:
+            await self.application.update_persistence()
+            for user_id in trimmed:
+                if user_id in self.application.user_data:
+                    await persistence.update_user_data(user_id, self.application.user_data[user_id])
+        for user_id in victims:
+            if self._seen.get(user_id, now) > now:
+                # the user came back while the sessions were written
+                continue
+            del self._seen[user_id]
+            self._sizes.pop(user_id, None)
+            drop_user_data(self.application, user_id)
+            if persistence:
+                self._spilled.add(user_id)
+                self.stats.spilled += 1
+            else:
+                self.stats.evicted += 1
+        if trimmed or victims:
+            logger.info(
+                "sessions :: trimmed %s, moved out %s, %s resident with %s bytes",
+                len(trimmed), len(victims), self.resident, self.total_bytes,
+            )
+
+    def report(self, top: int = SESSION_TOP) -> dict:
+        largest = sorted(self._sizes.items(), key=lambda item: item[1], reverse=True)[:top]
+        return {
+            "resident": self.resident,
+            "spilled": self.spilled,
+            "total_bytes": self.total_bytes,
+            "memory_budget": self.memory_budget,
+            "trimmed": self.stats.trimmed,
+            "restored": self.stats.restored,
+            "evicted": self.stats.evicted,
+            "largest": [{"user_id": user_id, "bytes": size} for user_id, size in largest],
+        }
+
+    async def endpoint(self, request: HttpRequest) -> HttpResponse:
+        top = int(request.query.get("top", SESSION_TOP))
+        return HttpResponse(body=json.dumps(self.report(top)).encode(), content_type="application/json")
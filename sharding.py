@@ -0,0 +1,578 @@
+"""Run the bot as a front process and N worker processes on one machine.
+
+The front receives webhook updates and routes each one by a consistent hash
+of its user id (or chat id) to a worker over a Unix socket. Every worker runs
+the usual application from ``main.build_application``. When a worker starts
+or stops, the users whose ring segment moved are handed over through the
+shared session database, along with their SRS cards and statistics. A
+worker reads a user's session on their first update, never the whole
+database.
+
+Worker: python -m sharding worker /path/to/socket
+"""
+import asyncio
+import bisect
+import hashlib
+import itertools
+import json
+import logging
+import os
+import pickle
+import struct
+import sys
+import tempfile
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from typing import Awaitable, Callable
+
+from telegram import Bot, Update
+from telegram.ext import Application
+
+from httpserver import HttpRequest, HttpResponse, HttpServer
+from persistence import SqlitePersistence
+from sessions import SessionManager
+from srs import SrsStore
+from stats import StatsStore
+from webhook import running, secret_ok, stop_event
+
+logger = logging.getLogger(__name__)
+
+FRAME_HEADER = struct.Struct("!I")
+MAX_FRAME = 4 * 1024 * 1024
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes.
+
+    Adding or removing a node moves only the keys of its own ring segments,
+    about 1/N of all keys.
+    """
+
+    def __init__(self, nodes: tuple[str, ...] = (), vnodes: int = 64):
+        self.vnodes = vnodes
+        self._hashes: list[int] = []
+        self._nodes: list[str] = []
+        for node in nodes:
+            self.add(node)
+
+    @property
+    def nodes(self) -> set[str]:
+        return set(self._nodes)
+
+    def copy(self) -> "HashRing":
+        ring = HashRing(vnodes=self.vnodes)
+        ring._hashes = list(self._hashes)
+        ring._nodes = list(self._nodes)
+        return ring
+
+    def add(self, node: str) -> None:
+        for replica in range(self.vnodes):
+            point = _hash(f"{node}#{replica}")
+            idx = bisect.bisect(self._hashes, point)
+            self._hashes.insert(idx, point)
+            self._nodes.insert(idx, node)
+
+    def remove(self, node: str) -> None:
+        points = [(point, owner) for point, owner in zip(self._hashes, self._nodes) if owner != node]
+        self._hashes = [point for point, _ in points]
+        self._nodes = [owner for _, owner in points]
+
+    def lookup(self, key: int | str) -> str | None:
+        if not self._hashes:
+            return None
+        idx = bisect.bisect(self._hashes, _hash(str(key))) % len(self._hashes)
+        return self._nodes[idx]
+
+
+def ring_of(frame: dict) -> HashRing:
+    """Ring sent by the front with a release or acquire frame"""
+    return HashRing(tuple(frame["nodes"]), frame["vnodes"])
+
+
+async def read_frame(reader: asyncio.StreamReader) -> dict | None:
+    """Read one length-prefixed JSON frame, None at the end of the stream"""
+    try:
+        (length,) = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+        if length > MAX_FRAME:
+            raise ValueError(f"frame of {length} bytes is too large")
+        return json.loads(await reader.readexactly(length))
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+
+
+def write_frame(writer: asyncio.StreamWriter, frame: dict) -> None:
+    payload = json.dumps(frame, separators=(",", ":"), ensure_ascii=False).encode()
+    writer.write(FRAME_HEADER.pack(len(payload)) + payload)
+
+
+def shard_key(update: dict) -> int:
+    """User id of a raw update, or its chat id for updates without a user"""
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        user = value.get("from") or value.get("user")
+        if user:
+            return user["id"]
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+    return update.get("update_id", 0)
+
+
+class ShardWorker:
+    """Feed updates received from the front into the application.
+
+    Updates with the same key are processed one after another in arrival
+    order, updates of different keys go concurrently to the application's
+    update processor. ``release`` waits for the pending updates of some keys,
+    flushes their sessions, puts their SRS cards and statistics into the
+    shared database and forgets them; ``acquire`` loads all of it back.
+    Both end with ``save_stores``, so a restarted worker does not reload
+    users it handed over from its files, and handed users are not lost.
+    """
+
+    def __init__(self, application: Application, socket_path: str,
+                 save_stores: Callable[[Application], Awaitable[None]] | None = None):
+        self.application = application
+        self.socket_path = socket_path
+        self.save_stores = save_stores
+        self._tails: dict[int, asyncio.Task] = {}
+        self._connections: dict[asyncio.Task, asyncio.StreamWriter] = {}
+
+    async def serve(self, stopped: asyncio.Event) -> None:
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        logger.info("shard worker :: listening on %s", self.socket_path)
+        try:
+            await stopped.wait()
+        finally:
+            server.close()
+            await server.wait_closed()
+            if self._tails:
+                await asyncio.wait(list(self._tails.values()))
+            for writer in self._connections.values():
+                writer.close()
+            if self._connections:
+                await asyncio.wait(list(self._connections))
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        connection = asyncio.current_task()
+        self._connections[connection] = writer
+        try:
+            while (frame := await read_frame(reader)) is not None:
+                op = frame["op"]
+                if op == "update":
+                    self._enqueue(frame, writer)
+                elif op == "release":
+                    asyncio.create_task(self._reply(writer, frame, self.release_moved(ring_of(frame), frame["node"])))
+                elif op == "acquire":
+                    asyncio.create_task(self._reply(writer, frame, self.acquire_moved(ring_of(frame), frame["node"])))
+                else:
+                    logger.error("shard worker :: unknown op %s", op)
+        finally:
+            del self._connections[connection]
+            writer.close()
+
+    def _enqueue(self, frame: dict, writer: asyncio.StreamWriter) -> None:
+        key = frame["key"]
+        task = asyncio.create_task(self._process(frame, self._tails.get(key), writer))
+        self._tails[key] = task
+
+        def forget(_: asyncio.Task) -> None:
+            if self._tails.get(key) is task:
+                del self._tails[key]
+
+        task.add_done_callback(forget)
+
+    async def _process(self, frame: dict, previous: asyncio.Task | None, writer: asyncio.StreamWriter) -> None:
+        if previous is not None:
+            await asyncio.wait([previous])
+        ok = True
+        try:
+            update = Update.de_json(frame["update"], self.application.bot)
+            await self.application.update_processor.process_update(
+                update, self.application.process_update(update)
+            )
+        except Exception:
+            logger.exception("shard worker :: update %s failed", frame["id"])
+            ok = False
+        if not writer.is_closing():
+            write_frame(writer, {"op": "done", "id": frame["id"], "ok": ok})
+
+    async def _reply(self, writer: asyncio.StreamWriter, frame: dict, action) -> None:
+        ok = True
+        try:
+            await action
+        except Exception:
+            logger.exception("shard worker :: %s failed", frame["op"])
+            ok = False
+        if not writer.is_closing():
+            write_frame(writer, {"op": "done", "id": frame["id"], "ok": ok})
+
+    @property
+    def session_manager(self) -> SessionManager | None:
+        return self.application.bot_data.get("session_manager")
+
+    def known_keys(self) -> set[int]:
+        """Users this worker holds anything of: a session, cards, statistics or a pending update"""
+        keys = set(self.application.user_data) | set(self._tails)
+        srs: SrsStore | None = self.application.bot_data.get("srs")
+        stats_store: StatsStore | None = self.application.bot_data.get("stats")
+        if srs is not None:
+            keys.update(srs.user_ids())
+        if stats_store is not None:
+            keys.update(stats_store.users)
+        return keys
+
+    async def release_moved(self, ring: HashRing, node: str) -> None:
+        """Hand over every known user the new ring gives to another worker"""
+        keys = [key for key in self.known_keys() if ring.lookup(key) != node]
+        logger.info("shard worker :: %s :: releasing %s users", node, len(keys))
+        if keys:
+            await self.release(keys)
+
+    async def acquire_moved(self, ring: HashRing, node: str) -> None:
+        """Take over the handed over users the new ring gives to this worker"""
+        persistence = self.application.persistence
+        if not isinstance(persistence, SqlitePersistence):
+            return None
+        keys = [key for key in await persistence.user_state_ids() if ring.lookup(key) == node]
+        logger.info("shard worker :: %s :: acquiring %s users", node, len(keys))
+        if keys:
+            await self.acquire(keys)
+
+    async def release(self, keys: list[int]) -> None:
+        tails = [self._tails[key] for key in keys if key in self._tails]
+        if tails:
+            await asyncio.wait(tails)
+        await self.application.update_persistence()
+        persistence = self.application.persistence
+        if not isinstance(persistence, SqlitePersistence):
+            return None
+        await persistence.put_user_state(self.export_state(keys))
+        srs: SrsStore | None = self.application.bot_data.get("srs")
+        stats_store: StatsStore | None = self.application.bot_data.get("stats")
+        for user_id in keys:
+            if srs is not None:
+                srs.drop_user(user_id)
+            if stats_store is not None:
+                stats_store.pop_user(user_id)
+        if self.session_manager:
+            self.session_manager.release_users(keys)
+        if self.save_stores:
+            await self.save_stores(self.application)
+
+    async def acquire(self, keys: list[int]) -> None:
+        persistence = self.application.persistence
+        if not isinstance(persistence, SqlitePersistence):
+            return None
+        if self.session_manager:
+            await self.session_manager.load_users(keys, replace=True)
+        self.import_state(await persistence.take_user_state(keys))
+        if self.save_stores:
+            await self.save_stores(self.application)
+
+    def export_state(self, keys: list[int]) -> list[tuple[int, str, bytes]]:
+        """SRS cards and statistics of users handed to another worker"""
+        rows = []
+        srs: SrsStore | None = self.application.bot_data.get("srs")
+        stats_store: StatsStore | None = self.application.bot_data.get("stats")
+        for user_id in keys:
+            cards = srs.export_user(user_id) if srs is not None else None
+            if cards:
+                rows.append((user_id, "srs", pickle.dumps(cards)))
+            aggregate = stats_store.user(user_id) if stats_store is not None else None
+            if aggregate is not None:
+                rows.append((user_id, "stats", pickle.dumps(aggregate)))
+        return rows
+
+    def import_state(self, rows: list[tuple[int, str, bytes]]) -> None:
+        srs: SrsStore | None = self.application.bot_data.get("srs")
+        stats_store: StatsStore | None = self.application.bot_data.get("stats")
+        for user_id, kind, data in rows:
+            if kind == "srs" and srs is not None:
+                srs.import_user(user_id, pickle.loads(data))
+            elif kind == "stats" and stats_store is not None:
+                stats_store.put_user(user_id, pickle.loads(data))
+
+
+@dataclass
+class WorkerHandle:
+    name: str
+    index: int
+    socket_path: str
+    process: asyncio.subprocess.Process | None = None
+    writer: asyncio.StreamWriter | None = None
+    pending: dict[int, asyncio.Future] = field(default_factory=dict)
+    tasks: list[asyncio.Task] = field(default_factory=list)
+
+    @property
+    def alive(self) -> bool:
+        return self.writer is not None and not self.writer.is_closing()
+
+    def request(self, frame_id: int, frame: dict) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        if not self.alive:
+            future.set_exception(ConnectionError(f"worker {self.name} is not connected"))
+            return future
+        self.pending[frame_id] = future
+        write_frame(self.writer, {"id": frame_id, **frame})
+        return future
+
+    async def read_replies(self, reader: asyncio.StreamReader) -> None:
+        while (frame := await read_frame(reader)) is not None:
+            future = self.pending.pop(frame["id"], None)
+            if future is None or future.done():
+                continue
+            if frame.get("ok", True):
+                future.set_result(None)
+            else:
+                future.set_exception(RuntimeError(f"worker {self.name} failed frame {frame['id']}"))
+        if self.writer is not None:
+            self.writer.close()
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError(f"worker {self.name} disconnected"))
+        self.pending.clear()
+
+
+def _chain(source: asyncio.Future, target: asyncio.Future) -> None:
+    def copy(_: asyncio.Future) -> None:
+        if target.done():
+            return None
+        if source.exception():
+            target.set_exception(source.exception())
+        else:
+            target.set_result(None)
+
+    source.add_done_callback(copy)
+
+
+class ShardFront:
+    """Route raw updates to worker processes by consistent hash of the user.
+
+    When the ring changes, every worker releases the users it knows that
+    the new ring gives to another worker, then every worker acquires the
+    released users that are now its own, so no user is missed because the
+    front has not seen them lately. Meanwhile updates of keys whose owner
+    changes are held back, so the order of every user's updates is kept.
+    Workers that exit are restarted.
+    """
+
+    def __init__(self, workers: int, socket_dir: str | None = None, vnodes: int = 64,
+                 restart: bool = True, start_timeout: float = 60):
+        self.workers = workers
+        self.socket_dir = socket_dir or tempfile.mkdtemp(prefix="bot-shards-")
+        self.restart = restart
+        self.start_timeout = start_timeout
+        self.ring = HashRing(vnodes=vnodes)
+        self._workers: dict[str, WorkerHandle] = {}
+        # the old and the new ring while users are handed over
+        self._moving: tuple[HashRing, HashRing] | None = None
+        self._paused: dict[int, list[tuple[dict, asyncio.Future]]] = {}
+        self._frame_ids = itertools.count(1)
+        self._indexes = itertools.count()
+        self._rebalance_lock = asyncio.Lock()
+        self._stopping = False
+
+    @property
+    def worker_names(self) -> list[str]:
+        return list(self._workers)
+
+    async def start(self) -> None:
+        indexes = [next(self._indexes) for _ in range(self.workers)]
+        await asyncio.gather(*(self._spawn(f"w{index}", index) for index in indexes))
+        async with self._rebalance_lock:
+            for name in self._workers:
+                self.ring.add(name)
+        logger.info("shard front :: %s workers", len(self._workers))
+
+    async def stop(self) -> None:
+        self._stopping = True
+        for worker in self._workers.values():
+            if worker.process and worker.process.returncode is None:
+                worker.process.terminate()
+        for worker in self._workers.values():
+            if worker.process:
+                await worker.process.wait()
+            for task in worker.tasks:
+                task.cancel()
+
+    def _worker_env(self, worker: WorkerHandle) -> dict[str, str]:
+        env = dict(os.environ, SHARD_ID=worker.name)
+        metrics_port = int(os.getenv("METRICS_PORT", 0))
+        if metrics_port:
+            env["METRICS_PORT"] = str(metrics_port + 1 + worker.index)
+        return env
+
+    async def _spawn(self, name: str, index: int) -> WorkerHandle:
+        worker = WorkerHandle(name, index, os.path.join(self.socket_dir, f"{name}.sock"))
+        worker.process = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "sharding", "worker", worker.socket_path,
+            env=self._worker_env(worker), cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        while True:
+            if worker.process.returncode is not None:
+                raise RuntimeError(f"worker {name} exited with {worker.process.returncode}")
+            try:
+                reader, worker.writer = await asyncio.open_unix_connection(worker.socket_path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if loop.time() - started > self.start_timeout:
+                    worker.process.kill()
+                    raise RuntimeError(f"worker {name} did not start in {self.start_timeout}s")
+                await asyncio.sleep(0.1)
+        worker.tasks = [
+            asyncio.create_task(worker.read_replies(reader)),
+            asyncio.create_task(self._watch(worker)),
+        ]
+        self._workers[name] = worker
+        logger.info("shard front :: worker %s started, pid %s", name, worker.process.pid)
+        return worker
+
+    async def _watch(self, worker: WorkerHandle) -> None:
+        returncode = await worker.process.wait()
+        if self._stopping or self._workers.get(worker.name) is not worker:
+            return None
+        logger.warning("shard front :: worker %s exited with %s", worker.name, returncode)
+        await self._rebalance(remove=worker.name)
+        del self._workers[worker.name]
+        if self.restart:
+            await self._spawn(worker.name, worker.index)
+            await self._rebalance(add=worker.name)
+
+    async def add_worker(self) -> str:
+        index = next(self._indexes)
+        worker = await self._spawn(f"w{index}", index)
+        await self._rebalance(add=worker.name)
+        return worker.name
+
+    async def remove_worker(self, name: str) -> None:
+        """Hand the users of a worker over to the others, then stop it"""
+        worker = self._workers[name]
+        await self._rebalance(remove=name)
+        del self._workers[name]
+        for task in worker.tasks:
+            task.cancel()
+        worker.process.terminate()
+        await worker.process.wait()
+
+    def dispatch(self, update: dict) -> asyncio.Future:
+        """Send a raw update to its worker, the future resolves once it is processed"""
+        key = shard_key(update)
+        paused = self._paused.get(key)
+        if paused is None and self._moving is not None:
+            old, new = self._moving
+            if old.lookup(key) != new.lookup(key):
+                paused = self._paused[key] = []
+        if paused is not None:
+            future = asyncio.get_running_loop().create_future()
+            paused.append((update, future))
+            return future
+        return self._send(key, update)
+
+    def _send(self, key: int, update: dict) -> asyncio.Future:
+        name = self.ring.lookup(key)
+        if name is None:
+            raise RuntimeError("no shard workers")
+        return self._workers[name].request(next(self._frame_ids), {"op": "update", "key": key, "update": update})
+
+    async def _request_moved(self, name: str, op: str, ring: HashRing) -> None:
+        worker = self._workers.get(name)
+        if worker is None or not worker.alive:
+            return None
+        frame = {"op": op, "node": name, "nodes": sorted(ring.nodes), "vnodes": ring.vnodes}
+        try:
+            await worker.request(next(self._frame_ids), frame)
+        except (ConnectionError, RuntimeError) as e:
+            logger.error("shard front :: %s on %s failed :: %s", op, name, e)
+
+    async def _rebalance(self, add: str | None = None, remove: str | None = None) -> None:
+        async with self._rebalance_lock:
+            old = self.ring
+            ring = old.copy()
+            if add:
+                ring.add(add)
+            if remove:
+                ring.remove(remove)
+            self._moving = (old, ring)
+            self.ring = ring
+            try:
+                await asyncio.gather(*(self._request_moved(name, "release", ring) for name in old.nodes))
+                await asyncio.gather(*(self._request_moved(name, "acquire", ring) for name in ring.nodes))
+            finally:
+                self._moving = None
+                paused, self._paused = self._paused, {}
+                logger.info("shard front :: ring %s :: %s keys held back", sorted(ring.nodes), len(paused))
+                for key, updates in paused.items():
+                    for update, future in updates:
+                        try:
+                            _chain(self._send(key, update), future)
+                        except RuntimeError as e:
+                            future.set_exception(e)
+
+
+class ShardReceiver:
+    def __init__(self, front: ShardFront, secret_token: str | None = None):
+        self.front = front
+        self.secret_token = secret_token
+
+    async def handle(self, request: HttpRequest) -> HttpResponse:
+        if not secret_ok(request, self.secret_token):
+            return HttpResponse(HTTPStatus.FORBIDDEN)
+        try:
+            update = json.loads(request.body)
+            future = self.front.dispatch(update)
+        except (ValueError, TypeError, AttributeError) as e:
+            logger.error("shard front :: bad update :: %s", e)
+            return HttpResponse(HTTPStatus.BAD_REQUEST)
+        except RuntimeError:
+            return HttpResponse(HTTPStatus.SERVICE_UNAVAILABLE)
+        future.add_done_callback(_log_failure)
+        return HttpResponse()
+
+
+def _log_failure(future: asyncio.Future) -> None:
+    if future.exception():
+        logger.error("shard front :: update lost :: %s", future.exception())
+
+
+async def serve_sharded(bot_token: str, workers: int, listen: str, port: int, path: str,
+                        secret_token: str | None = None, webhook_url: str | None = None) -> None:
+    """Run the front and its workers behind the embedded HTTP server until SIGINT/SIGTERM"""
+    front = ShardFront(workers, vnodes=int(os.getenv("SHARD_VNODES", 64)))
+    server = HttpServer({("POST", path): ShardReceiver(front, secret_token).handle})
+    stopped = stop_event()
+    await front.start()
+    try:
+        await server.start(listen, port)
+        if webhook_url:
+            async with Bot(bot_token) as bot:
+                await bot.set_webhook(f"{webhook_url.rstrip('/')}{path}", secret_token=secret_token)
+        await stopped.wait()
+    finally:
+        await server.stop()
+        await front.stop()
+
+
+async def run_worker(socket_path: str) -> None:
+    from main import build_application, save_stores, setup_logging
+
+    setup_logging()
+    application = build_application(os.environ["BOT_TOKEN"])
+    stopped = stop_event()
+    async with running(application):
+        await ShardWorker(application, socket_path, save_stores).serve(stopped)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] != "worker":
+        sys.exit(__doc__)
+    asyncio.run(run_worker(sys.argv[2]))
@@ -0,0 +1,220 @@
+import bisect
+import os
+import pickle
+import random
+import time
+from array import array
+
+from common import write_atomic
+
+DAY = 24 * 3600
+# box 0 holds new and failed cards, they come back in ten minutes
+LEITNER_INTERVALS = (600, DAY, 2 * DAY, 4 * DAY, 8 * DAY, 16 * DAY, 32 * DAY)
+
+
+class SrsStore:
+    """Leitner boxes for (user, word) cards with a due-date heap per user.
+
+    Cards live in parallel arrays (user, word, box, due, heap position).
+    Every user has a binary min-heap of card indices ordered by due date:
+    the next card is read in O(1) and a card is rescheduled in O(log n).
+    The (user, word) index is an array of the user's cards sorted by word,
+    searched with bisect. All told a card costs about 60 bytes.
+    """
+
+    def __init__(self, intervals: tuple[float, ...] = LEITNER_INTERVALS):
+        self.intervals = intervals
+        self.users = array("q")
+        self.words = array("l")
+        self.boxes = array("B")
+        self.due = array("d")
+        self.pos = array("l")
+        self.word_data: list[tuple[str, str, str]] = []
+        self._word_idx: dict[str, int] = {}
+        # cards of a user sorted by word index
+        self._cards: dict[int, array] = {}
+        self._heaps: dict[int, array] = {}
+        # bumped on every change, a periodic save skips an unchanged store
+        self.changes = 0
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    def _find(self, user_id: int, word: int) -> tuple[array | None, int, int | None]:
+        """Cards of the user, insertion point of the word and its card"""
+        cards = self._cards.get(user_id)
+        if cards is None:
+            return None, 0, None
+        idx = bisect.bisect_left(cards, word, key=self.words.__getitem__)
+        if idx < len(cards) and self.words[cards[idx]] == word:
+            return cards, idx, cards[idx]
+        return cards, idx, None
+
+    def intern_word(self, word_id: str, word: str, translate: str) -> int:
+        idx = self._word_idx.get(word_id)
+        if idx is None:
+            idx = self._word_idx[word_id] = len(self.word_data)
+            self.word_data.append((word_id, word, translate))
+        return idx
+
+    def card(self, user_id: int, word_id: str) -> int | None:
+        word = self._word_idx.get(word_id)
+        if word is None:
+            return None
+        return self._find(user_id, word)[2]
+
+    def add(self, user_id: int, word_id: str, word: str, translate: str, now: float | None = None) -> int:
+        word_idx = self.intern_word(word_id, word, translate)
+        cards, idx, card = self._find(user_id, word_idx)
+        if card is not None:
+            return card
+        if cards is None:
+            cards = self._cards[user_id] = array("l")
+        card = len(self.users)
+        self.changes += 1
+        cards.insert(idx, card)
+        self.users.append(user_id)
+        self.words.append(word_idx)
+        self.boxes.append(0)
+        self.due.append(now if now is not None else time.time())
+        heap = self._heaps.setdefault(user_id, array("l"))
+        heap.append(card)
+        self.pos.append(len(heap) - 1)
+        self._sift_up(heap, len(heap) - 1)
+        return card
+
+    def user_ids(self) -> list[int]:
+        return list(self._cards)
+
+    def export_user(self, user_id: int) -> list[tuple[str, str, str, int, float]]:
+        """Cards of a user as (word id, word, translate, box, due) rows"""
+        return [(*self.word_data[self.words[card]], self.boxes[card], self.due[card])
+                for card in self._cards.get(user_id, ())]
+
+    def import_user(self, user_id: int, rows: list[tuple[str, str, str, int, float]]) -> None:
+        self.drop_user(user_id)
+        for word_id, word, translate, box, due in rows:
+            card = self.add(user_id, word_id, word, translate, due)
+            self.boxes[card] = box
+
+    def drop_user(self, user_id: int) -> None:
+        """Remove the cards of a user, the last cards move into the freed slots"""
+        cards = self._cards.pop(user_id, None)
+        if cards is None:
+            return None
+        del self._heaps[user_id]
+        self.changes += 1
+        # from the end, so a moved card never belongs to the dropped user
+        for card in sorted(cards, reverse=True):
+            last = len(self.users) - 1
+            if card != last:
+                owner = self.users[last]
+                owner_cards = self._cards[owner]
+                owner_cards[bisect.bisect_left(owner_cards, self.words[last], key=self.words.__getitem__)] = card
+                self._heaps[owner][self.pos[last]] = card
+                for column in (self.users, self.words, self.boxes, self.due, self.pos):
+                    column[card] = column[last]
+            for column in (self.users, self.words, self.boxes, self.due, self.pos):
+                column.pop()
+
+    def peek(self, user_id: int, now: float | None = None) -> int | None:
+        """Return the most overdue card of the user, None if nothing is due"""
+        heap = self._heaps.get(user_id)
+        if not heap:
+            return None
+        card = heap[0]
+        if self.due[card] > (now if now is not None else time.time()):
+            return None
+        return card
+
+    def due_count(self, user_id: int, now: float | None = None, limit: int | None = None) -> int:
+        """Count due cards, visiting only the due part of the heap"""
+        heap = self._heaps.get(user_id)
+        if not heap:
+            return 0
+        now = now if now is not None else time.time()
+        count, stack = 0, [0]
+        while stack and (limit is None or count < limit):
+            i = stack.pop()
+            if i >= len(heap) or self.due[heap[i]] > now:
+                continue
+            count += 1
+            stack.extend((2 * i + 1, 2 * i + 2))
+        return count
+
+    def quiz_word(self, card: int, distractors: int = 3) -> dict:
+        """Build a quiz item for the card with translations of other words"""
+        own = self.words[card]
+        word_id, word, translate = self.word_data[own]
+        k = min(distractors, len(self.word_data) - 1)
+        wrong = [self.word_data[idx + (idx >= own)][2] for idx in random.sample(range(len(self.word_data) - 1), k)]
+        return {
+            "id": word_id,
+            "word": word,
+            "translate": translate,
+            "wrong_words": [{"translate": translation} for translation in wrong],
+            "card": card,
+        }
+
+    def review(self, card: int, correct: bool, now: float | None = None) -> None:
+        box = min(self.boxes[card] + 1, len(self.intervals) - 1) if correct else 0
+        self.changes += 1
+        self.boxes[card] = box
+        self.due[card] = (now if now is not None else time.time()) + self.intervals[box]
+        heap = self._heaps[self.users[card]]
+        self._sift_down(heap, self.pos[card])
+        self._sift_up(heap, self.pos[card])
+
+    def _swap(self, heap: array, i: int, j: int) -> None:
+        heap[i], heap[j] = heap[j], heap[i]
+        self.pos[heap[i]] = i
+        self.pos[heap[j]] = j
+
+    def _sift_up(self, heap: array, i: int) -> None:
+        due = self.due
+        while i:
+            parent = (i - 1) >> 1
+            if due[heap[parent]] <= due[heap[i]]:
+                break
+            self._swap(heap, i, parent)
+            i = parent
+
+    def _sift_down(self, heap: array, i: int) -> None:
+        due = self.due
+        size = len(heap)
+        while True:
+            smallest = i
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < size and due[heap[child]] < due[heap[smallest]]:
+                    smallest = child
+            if smallest == i:
+                return
+            self._swap(heap, i, smallest)
+            i = smallest
+
+    def dumps(self) -> bytes:
+        """Snapshot of the cards, taken on the event loop"""
+        state = (self.users, self.words, self.boxes, self.due, self.word_data)
+        return pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def save(self, filepath: str) -> None:
+        write_atomic(filepath, self.dumps())
+
+    @classmethod
+    def load(cls, filepath: str, intervals: tuple[float, ...] = LEITNER_INTERVALS) -> "SrsStore":
+        store = cls(intervals)
+        with open(filepath, "rb") as f:
+            store.users, store.words, store.boxes, store.due, store.word_data = pickle.load(f)
+        store._word_idx = {word_id: idx for idx, (word_id, _, _) in enumerate(store.word_data)}
+        store.pos = array("l", bytes(store.pos.itemsize * len(store.users)))
+        for card, user_id in enumerate(store.users):
+            store._cards.setdefault(user_id, array("l")).append(card)
+            heap = store._heaps.setdefault(user_id, array("l"))
+            store.pos[card] = len(heap)
+            heap.append(card)
+        for user_id, cards in store._cards.items():
+            store._cards[user_id] = array("l", sorted(cards, key=store.words.__getitem__))
+        for heap in store._heaps.values():
+            for i in reversed(range(len(heap) // 2)):
+                store._sift_down(heap, i)
+        return store
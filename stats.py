@@ -0,0 +1,202 @@
+import pickle
+import sqlite3
+import threading
+import time
+from array import array
+from dataclasses import dataclass, field
+
+from common import write_atomic
+
+DAY = 24 * 3600
+
+
+@dataclass(slots=True)
+class Aggregate:
+    """Answer counters of a user or of everybody, updated in O(1) per answer.
+
+    Daily counts live in ring buffers of ``window`` slots, a slot is reset
+    when its day comes round again. ``hardest`` keeps the top words by error
+    count, so rendering never scans ``word_errors``.
+    """
+    window: int
+    answers: int = 0
+    correct: int = 0
+    quizzes: int = 0
+    days: array = field(default_factory=lambda: array("l"))
+    day_answers: array = field(default_factory=lambda: array("l"))
+    day_correct: array = field(default_factory=lambda: array("l"))
+    word_errors: dict[str, int] = field(default_factory=dict)
+    # [errors, word id, word] sorted by errors
+    hardest: list[list] = field(default_factory=list)
+
+    def __post_init__(self):
+        if not self.days:
+            self.days = array("l", [-1] * self.window)
+            self.day_answers = array("l", [0] * self.window)
+            self.day_correct = array("l", [0] * self.window)
+
+    @property
+    def accuracy(self) -> float:
+        return self.correct / self.answers if self.answers else 0.0
+
+    def _slot(self, day: int) -> int | None:
+        slot = day % self.window
+        if self.days[slot] > day:
+            # a late answer from a day that already left the window
+            return None
+        if self.days[slot] != day:
+            self.days[slot] = day
+            self.day_answers[slot] = 0
+            self.day_correct[slot] = 0
+        return slot
+
+    def record(self, word_id: str, word: str, is_correct: bool, day: int, top: int) -> None:
+        slot = self._slot(day)
+        self.answers += 1
+        if slot is not None:
+            self.day_answers[slot] += 1
+        if is_correct:
+            self.correct += 1
+            if slot is not None:
+                self.day_correct[slot] += 1
+            return None
+        errors = self.word_errors[word_id] = self.word_errors.get(word_id, 0) + 1
+        for entry in self.hardest:
+            if entry[1] == word_id:
+                entry[0] = errors
+                break
+        else:
+            if len(self.hardest) < top:
+                self.hardest.append([errors, word_id, word])
+            elif errors > self.hardest[-1][0]:
+                self.hardest[-1] = [errors, word_id, word]
+            else:
+                return None
+        self.hardest.sort(key=lambda entry: -entry[0])
+
+    def daily(self, today: int) -> list[tuple[int, int]]:
+        """(answers, correct) for each day of the window, oldest first"""
+        result = []
+        for day in range(today - self.window + 1, today + 1):
+            slot = day % self.window
+            if self.days[slot] == day:
+                result.append((self.day_answers[slot], self.day_correct[slot]))
+            else:
+                result.append((0, 0))
+        return result
+
+
+class StatsStore:
+    """Per-user and global answer aggregates"""
+
+    def __init__(self, window: int = 7, top: int = 5, tz_offset: float = 0):
+        self.window = window
+        self.top = top
+        self.tz_offset = tz_offset
+        self.total = Aggregate(window)
+        self.users: dict[int, Aggregate] = {}
+        # (answers, correct) of the other shard workers, see SharedTotals
+        self.others = (0, 0)
+        # grows with every change, a save skips an unchanged store
+        self.changes = 0
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    @property
+    def global_accuracy(self) -> float:
+        answers = self.total.answers + self.others[0]
+        return (self.total.correct + self.others[1]) / answers if answers else 0.0
+
+    def today(self, now: float | None = None) -> int:
+        return int(((now if now is not None else time.time()) + self.tz_offset) // DAY)
+
+    def user(self, user_id: int) -> Aggregate | None:
+        return self.users.get(user_id)
+
+    def record(self, user_id: int, word_id: str, word: str, is_correct: bool, now: float | None = None) -> None:
+        day = self.today(now)
+        aggregate = self.users.get(user_id)
+        if aggregate is None:
+            aggregate = self.users[user_id] = Aggregate(self.window)
+        aggregate.record(word_id, word, is_correct, day, self.top)
+        self.total.record(word_id, word, is_correct, day, self.top)
+        self.changes += 1
+
+    def pop_user(self, user_id: int) -> Aggregate | None:
+        """Take a user out to hand over, the totals keep the answers"""
+        aggregate = self.users.pop(user_id, None)
+        if aggregate is not None:
+            self.changes += 1
+        return aggregate
+
+    def put_user(self, user_id: int, aggregate: Aggregate) -> None:
+        if aggregate.window != self.window:
+            aggregate.window = self.window
+            aggregate.days = array("l")
+            aggregate.__post_init__()
+        self.users[user_id] = aggregate
+        self.changes += 1
+
+    def finish_quiz(self, user_id: int) -> None:
+        aggregate = self.users.get(user_id)
+        if aggregate is not None:
+            aggregate.quizzes += 1
+            self.total.quizzes += 1
+            self.changes += 1
+
+    def dumps(self) -> bytes:
+        """Snapshot of the aggregates, taken on the event loop"""
+        return pickle.dumps((self.total, self.users), protocol=pickle.HIGHEST_PROTOCOL)
+
+    def save(self, filepath: str) -> None:
+        write_atomic(filepath, self.dumps())
+
+    @classmethod
+    def load(cls, filepath: str, window: int = 7, top: int = 5, tz_offset: float = 0) -> "StatsStore":
+        store = cls(window, top, tz_offset)
+        with open(filepath, "rb") as f:
+            total, users = pickle.load(f)
+        store.total, store.users = total, users
+        if total.window != window:
+            # the totals are kept, the daily history does not fit the new window
+            for aggregate in (total, *users.values()):
+                aggregate.window = window
+                aggregate.days = array("l")
+                aggregate.__post_init__()
+        return store
+
+
+class SharedTotals:
+    """Answer totals of every shard worker in a database they all share.
+
+    Each worker publishes its own row and reads the sum of the others, so
+    the average accuracy covers all users and not only the local ones.
+    """
+
+    def __init__(self, filepath: str, shard: str):
+        self.shard = shard
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(filepath, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS stats_totals ("
+                "shard TEXT PRIMARY KEY, answers INTEGER NOT NULL, correct INTEGER NOT NULL)"
+            )
+
+    def exchange(self, answers: int, correct: int) -> tuple[int, int]:
+        """Publish the local totals, return (answers, correct) of the other workers"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO stats_totals (shard, answers, correct) VALUES (?, ?, ?)",
+                (self.shard, answers, correct),
+            )
+            row = self._conn.execute(
+                "SELECT COALESCE(SUM(answers), 0), COALESCE(SUM(correct), 0) FROM stats_totals WHERE shard != ?",
+                (self.shard,),
+            ).fetchone()
+        return row[0], row[1]
+
+    def close(self) -> None:
+        self._conn.close()
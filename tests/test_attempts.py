@@ -0,0 +1,92 @@
+import asyncio
+import json
+
+import attempts
+from attempts import AttemptBuffer
+from core import ApiRejectedError
+from wordset import WordsetAttempt
+
+
+def make_attempt(idx: int) -> WordsetAttempt:
+    return WordsetAttempt(user_id=1, word_id=str(idx), word="word", correct="слово",
+                          attempt="слово", is_correct=True, created_at=0.0)
+
+
+async def bot_token() -> str:
+    return "token"
+
+
+def test_rejected_batch_goes_to_dead_letters(tmp_path, monkeypatch):
+    async def post_attempts(token, batch):
+        raise ApiRejectedError("/words/attempts/", 404)
+
+    monkeypatch.setattr(attempts, "post_attempts", post_attempts)
+    journal = tmp_path / "attempts.journal"
+
+    async def scenario():
+        buffer = AttemptBuffer(bot_token, str(journal), batch_size=2)
+        for idx in range(3):
+            await buffer.record(make_attempt(idx))
+        assert await buffer.flush()
+        assert len(buffer) == 1
+        assert buffer.stats.rejected == 2
+        dead = [json.loads(line) for line in (tmp_path / "attempts.journal.dead").read_text().splitlines()]
+        assert [line[1] for line in dead] == ["0", "1"]
+        assert len(journal.read_text().splitlines()) == 1
+        await buffer.stop()
+
+    asyncio.run(scenario())
+
+
+def test_expired_token_is_retried(monkeypatch):
+    async def post_attempts(token, batch):
+        raise ApiRejectedError("/words/attempts/", 401)
+
+    monkeypatch.setattr(attempts, "post_attempts", post_attempts)
+
+    async def scenario():
+        buffer = AttemptBuffer(bot_token, batch_size=1)
+        await buffer.record(make_attempt(0))
+        assert not await buffer.flush()
+        assert len(buffer) == 1
+        assert buffer.stats.rejected == 0
+
+    asyncio.run(scenario())
+
+
+def test_full_buffer_waits_at_most_max_wait(tmp_path, monkeypatch):
+    async def post_attempts(token, batch):
+        return False
+
+    monkeypatch.setattr(attempts, "post_attempts", post_attempts)
+
+    async def scenario():
+        buffer = AttemptBuffer(bot_token, str(tmp_path / "attempts.journal"), max_buffer=2, max_wait=0.05)
+        for idx in range(3):
+            await asyncio.wait_for(buffer.record(make_attempt(idx)), 1)
+        assert len(buffer) == 2
+        assert buffer.stats.dropped == 1
+
+    asyncio.run(scenario())
+    assert (tmp_path / "attempts.journal.dead").read_text().count("\n") == 1
+
+
+def test_compaction_keeps_attempts_recorded_meanwhile(tmp_path, monkeypatch):
+    async def post_attempts(token, batch):
+        return True
+
+    monkeypatch.setattr(attempts, "post_attempts", post_attempts)
+    journal = tmp_path / "attempts.journal"
+
+    async def scenario():
+        buffer = AttemptBuffer(bot_token, str(journal), batch_size=2)
+        for idx in range(3):
+            await buffer.record(make_attempt(idx))
+        flush = asyncio.create_task(buffer.flush())
+        await asyncio.sleep(0)
+        await buffer.record(make_attempt(3))
+        assert await flush
+        await buffer.stop()
+
+    asyncio.run(scenario())
+    assert journal.read_text() == ""
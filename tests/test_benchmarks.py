@@ -0,0 +1,29 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_suite(*args: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, "benchmarks/suite.py", "--filter", "encode_callback", "--repeat", "1",
+         "--min-time", "0.01", *args],
+        cwd=ROOT, capture_output=True, text=True, timeout=120,
+    )
+
+
+def test_suite_flags_a_slower_case(tmp_path):
+    baseline = tmp_path / "baseline.json"
+    assert run_suite("--save", str(baseline)).returncode == 0
+    report = json.loads(baseline.read_text())
+    assert list(report["results"]) == ["encode_callback"]
+
+    # a generous threshold passes, a baseline ten times faster does not
+    assert run_suite("--compare", str(baseline), "--threshold", "10").returncode == 0
+    report["results"]["encode_callback"]["best_ns"] /= 10
+    baseline.write_text(json.dumps(report))
+    result = run_suite("--compare", str(baseline), "--threshold", "0.5")
+    assert result.returncode == 1
+    assert "REGRESSION" in result.stdout
@@ -0,0 +1,60 @@
+import asyncio
+
+import cache
+import main
+from cache import TTLCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_entries_expire(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    store = TTLCache(maxsize=4, ttl=10)
+    store.set("a", 1)
+    clock.now += 9
+    assert store.get("a") == 1
+    clock.now += 2
+    assert store.get("a") is None
+    assert (store.stats.hits, store.stats.misses, store.stats.expired) == (1, 1, 1)
+
+
+def test_least_recently_used_is_evicted():
+    store = TTLCache(maxsize=2, ttl=10)
+    store.set("a", 1)
+    store.set("b", 2)
+    store.get("a")
+    store.set("c", 3)
+    assert store.get("b") is None
+    assert (store.get("a"), store.get("c")) == (1, 3)
+    assert store.stats.evictions == 1
+    store.invalidate("a")
+    assert store.get("a") is None
+    store.invalidate()
+    assert len(store) == 0
+
+
+def test_wordsets_menu_is_shared_between_users(monkeypatch):
+    calls = []
+
+    async def get_wordsets(api_token, page, size):
+        calls.append(api_token)
+        return {"items": [{"id": "s1", "title": "Animals"}], "pages": 2}
+
+    monkeypatch.setattr(main, "get_wordsets", get_wordsets)
+    monkeypatch.setattr(main, "wordsets_cache", TTLCache(maxsize=4, ttl=10))
+
+    async def scenario():
+        first = await main.create_wordsets_menu("token-1", page=1)
+        second = await main.create_wordsets_menu("token-2", page=1)
+        assert second is first
+        assert "Animals" in first.menu.msg
+
+    asyncio.run(scenario())
+    assert calls == ["token-1"]
@@ -0,0 +1,40 @@
+import pytest
+
+from callbacks import CallbackRouter
+from common import QuizzTypeEnum, decode_callback, encode_callback
+
+
+async def noop(update, context):
+    return None
+
+
+async def stale(update, context):
+    return None
+
+
+def test_every_kind_has_a_callback_code():
+    router = CallbackRouter({kind: noop for kind in QuizzTypeEnum})
+    for kind in QuizzTypeEnum:
+        data = encode_callback(kind, "1", "2")
+        assert decode_callback(data) == (kind, ("1", "2"))
+        assert router.route(data) == (noop, ["1", "2"])
+
+
+def test_stats_button_reaches_the_main_menu_handler():
+    router = CallbackRouter({QuizzTypeEnum.MAIN_MENU: noop})
+    assert router.route(encode_callback(QuizzTypeEnum.MAIN_MENU, QuizzTypeEnum.STATS.value)) == (noop, ["stats"])
+
+
+def test_bad_arguments_are_refused():
+    with pytest.raises(ValueError):
+        encode_callback(QuizzTypeEnum.WORDSETS, "a:b")
+    with pytest.raises(ValueError):
+        encode_callback(QuizzTypeEnum.WORDSETS, "x" * 64)
+
+
+def test_foreign_payloads_go_to_the_default():
+    router = CallbackRouter({QuizzTypeEnum.WORDSETS: noop}, default=stale)
+    for data in (None, "", "wordsets", "0w:1", "9q:1:2"):
+        assert decode_callback(data) is None
+        assert router.route(data) == (stale, [])
+    assert CallbackRouter({QuizzTypeEnum.WORDSETS: noop}).route("wordsets") is None
@@ -0,0 +1,50 @@
+import asyncio
+
+from telegram.error import BadRequest
+
+import cleanup
+from cleanup import CleanupStats, delete_messages
+
+
+class FakeBot:
+    def __init__(self, bulk_fails: bool = False, missing: tuple[int, ...] = ()):
+        self.bulk_fails = bulk_fails
+        self.missing = missing
+        self.bulk: list[list[int]] = []
+        self.single: list[int] = []
+        self.active = self.peak = 0
+
+    async def delete_messages(self, chat_id, message_ids, rate_limit_args=None):
+        self.bulk.append(list(message_ids))
+        if self.bulk_fails:
+            raise BadRequest("bulk failed")
+        return True
+
+    async def delete_message(self, chat_id, message_id, rate_limit_args=None):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        await asyncio.sleep(0)
+        self.active -= 1
+        self.single.append(message_id)
+        if message_id in self.missing:
+            raise BadRequest("message to delete not found")
+        return True
+
+
+def test_ids_go_in_chunks_of_a_hundred(monkeypatch):
+    monkeypatch.setattr(cleanup, "cleanup_stats", CleanupStats())
+    bot = FakeBot()
+    asyncio.run(delete_messages(bot, 1, list(range(250))))
+    assert [len(chunk) for chunk in bot.bulk] == [100, 100, 50]
+    assert not bot.single
+    assert (cleanup.cleanup_stats.bulk_calls, cleanup.cleanup_stats.bulk_ok, cleanup.cleanup_stats.deleted) == (3, 3, 0)
+
+
+def test_rejected_chunk_is_deleted_one_by_one(monkeypatch):
+    monkeypatch.setattr(cleanup, "cleanup_stats", CleanupStats())
+    bot = FakeBot(bulk_fails=True, missing=(3,))
+    asyncio.run(delete_messages(bot, 1, list(range(10)), concurrency=2))
+    assert sorted(bot.single) == list(range(10))
+    assert bot.peak == 2
+    stats = cleanup.cleanup_stats
+    assert (stats.bulk_ok, stats.single_calls, stats.deleted, stats.failed) == (0, 10, 9, 1)
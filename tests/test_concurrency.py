@@ -0,0 +1,47 @@
+import asyncio
+import datetime
+
+from telegram import Chat, Message, Update, User
+
+from concurrency import UserOrderedUpdateProcessor, update_key
+
+
+def message_update(update_id: int, user_id: int) -> Update:
+    user = User(user_id, "A", False)
+    message = Message(update_id, datetime.datetime.now(), Chat(user_id, "private"), from_user=user, text="hi")
+    return Update(update_id, message=message)
+
+
+def test_update_key():
+    assert update_key(message_update(1, 7)) == 7
+    assert update_key(Update(2)) is None
+    assert update_key("not an update") is None
+
+
+def test_updates_of_a_user_run_in_order_and_users_concurrently():
+    async def scenario():
+        processor = UserOrderedUpdateProcessor(8)
+        events = []
+        first_running = asyncio.Event()
+
+        async def handle(name: str, delay: float):
+            events.append(f"start {name}")
+            if name == "a1":
+                first_running.set()
+            await asyncio.sleep(delay)
+            events.append(f"end {name}")
+
+        async def other_user():
+            await first_running.wait()
+            await processor.process_update(message_update(3, 2), handle("b1", 0))
+
+        await asyncio.gather(
+            processor.process_update(message_update(1, 1), handle("a1", 0.05)),
+            processor.process_update(message_update(2, 1), handle("a2", 0)),
+            other_user(),
+        )
+        # b1 ran while a1 was still sleeping, a2 only after a1
+        assert events.index("end b1") < events.index("end a1") < events.index("start a2")
+        assert processor.active_keys == 0 and processor.waiting == 0
+
+    asyncio.run(scenario())
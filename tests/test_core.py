@@ -0,0 +1,89 @@
+import asyncio
+
+import httpx
+
+import core
+
+
+def make_client(handler, **kwargs) -> core.ApiClient:
+    client = core.ApiClient(base_url="http://api", timeout=1, **kwargs)
+    client._client = httpx.AsyncClient(base_url="http://api", transport=httpx.MockTransport(handler))
+    return client
+
+
+def test_client_is_shared_until_closed():
+    async def scenario():
+        client = core.get_api_client()
+        assert core.get_api_client() is client
+        await core.close_api_client()
+        assert core.get_api_client() is not client
+        await core.close_api_client()
+
+    asyncio.run(scenario())
+
+
+def test_request_sends_token_and_params():
+    seen = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        seen.append((request.method, request.url.path, dict(request.url.params), request.headers.get("authorization")))
+        return httpx.Response(200, json={"items": []})
+
+    async def scenario():
+        client = make_client(handler)
+        assert await client.request("GET", "/words/sets/", "token", params={"page": 2}) == {"items": []}
+        await client.close()
+
+    asyncio.run(scenario())
+    assert seen == [("GET", "/words/sets/", {"page": "2"}, "Bearer token")]
+
+
+def test_client_errors_and_posts_are_not_retried():
+    calls = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.method)
+        return httpx.Response(404 if request.method == "GET" else 503)
+
+    async def scenario():
+        client = make_client(handler)
+        assert await client.request("GET", "/missing") is None
+        assert await client.request("POST", "/users/", json={}) is None
+        await client.close()
+
+    asyncio.run(scenario())
+    assert calls == ["GET", "POST"]
+
+
+def test_concurrency_is_capped():
+    state = {"active": 0, "peak": 0}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        state["active"] += 1
+        state["peak"] = max(state["peak"], state["active"])
+        await asyncio.sleep(0.01)
+        state["active"] -= 1
+        return httpx.Response(200, json={})
+
+    async def scenario():
+        client = make_client(handler, concurrency=2)
+        await asyncio.gather(*(client.request("GET", f"/sets/{idx}") for idx in range(6)))
+        await client.close()
+
+    asyncio.run(scenario())
+    assert state["peak"] == 2
+
+
+def test_wordset_quiz_page(monkeypatch):
+    async def handler(request: httpx.Request) -> httpx.Response:
+        assert request.url.params["page"] == "2"
+        return httpx.Response(200, json={"words": [{"id": 1}], "pages": 3, "total": 41})
+
+    monkeypatch.setattr(core, "_api_client", make_client(handler))
+
+    async def scenario():
+        quiz_page = await core.get_wordset_quiz("token", "7", page=2)
+        assert quiz_page == core.QuizPage([{"id": 1}], page=2, pages=3, total=41)
+        await core.close_api_client()
+
+    asyncio.run(scenario())
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+from telegram.error import BadRequest
+
+from edits import MessageEditor
+
+
+class FakeBot:
+    def __init__(self, error: Exception | None = None):
+        self.error = error
+        self.sent: list[str] = []
+
+    async def edit_message_text(self, text, chat_id, message_id, reply_markup=None, rate_limit_args=None):
+        await asyncio.sleep(0.01)
+        self.sent.append(text)
+        if self.error is not None:
+            raise self.error
+        return True
+
+
+def test_unchanged_edit_is_skipped():
+    async def scenario():
+        editor, bot = MessageEditor(), FakeBot()
+        editor.remember(1, 10, "question")
+        await editor.edit(bot, 1, 10, "question")
+        await editor.edit(bot, 1, 10, "answer")
+        await editor.edit(bot, 1, 10, "answer")
+        assert bot.sent == ["answer"]
+        assert (editor.stats.sent, editor.stats.skipped) == (1, 2)
+
+    asyncio.run(scenario())
+
+
+def test_edits_during_a_send_are_merged():
+    async def scenario():
+        editor, bot = MessageEditor(), FakeBot()
+        first = asyncio.create_task(editor.edit(bot, 1, 10, "v0"))
+        await asyncio.sleep(0)
+        # v0 is being sent, the newest of the rest replaces the others
+        await asyncio.gather(first, *(editor.edit(bot, 1, 10, f"v{idx}") for idx in range(1, 4)))
+        assert bot.sent == ["v0", "v3"]
+        assert editor.stats.merged == 2
+
+    asyncio.run(scenario())
+
+
+def test_not_modified_counts_as_sent_and_other_errors_reset():
+    async def scenario():
+        editor = MessageEditor()
+        await editor.edit(FakeBot(BadRequest("Message is not modified")), 1, 10, "same")
+        assert editor.stats.sent == 1
+        with pytest.raises(BadRequest):
+            await editor.edit(FakeBot(BadRequest("Message to edit not found")), 1, 11, "gone")
+        # the failed render is forgotten, the next edit is sent again
+        bot = FakeBot()
+        await editor.edit(bot, 1, 11, "gone")
+        assert bot.sent == ["gone"]
+
+    asyncio.run(scenario())
@@ -0,0 +1,19 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_load_run_completes_every_quiz(tmp_path):
+    report_path = tmp_path / "report.json"
+    subprocess.run(
+        [sys.executable, "-m", "loadtest.run", "--users", "3", "--wordsets", "3", "--words", "4",
+         "--api-latency", "0", "--json", str(report_path)],
+        cwd=ROOT, capture_output=True, text=True, check=True, timeout=120,
+    )
+    report = json.loads(report_path.read_text(encoding="utf-8"))
+    assert report["completed_quizzes"] == 3
+    assert report["failed_users"] == 0
+    assert report["bot_api_calls_per_quiz"] > 0
@@ -0,0 +1,57 @@
+import json
+import logging
+
+import logs
+from logs import JsonFormatter, PayloadCap, PrefixMap, SamplingFilter, parse_levels
+
+
+def make_record(msg: str, args=(), name: str = "core", level: int = logging.INFO, **extra) -> logging.LogRecord:
+    record = logging.LogRecord(name, level, __file__, 1, msg, args, None)
+    for key, value in extra.items():
+        setattr(record, key, value)
+    return record
+
+
+def test_parse_levels_skips_incomplete_items():
+    assert parse_levels(" core = 0.1 ,telegram=WARNING,broken,=1") == {"core": "0.1", "telegram": "WARNING"}
+
+
+def test_prefix_map_takes_the_most_specific_prefix():
+    rates = PrefixMap({"telegram": 0.5, "telegram.ext": 0.1}, 1.0)
+    assert rates.get("telegram.ext.Application") == 0.1
+    assert rates.get("telegram.Bot") == 0.5
+    assert rates.get("core") == 1.0
+
+
+def test_sampling_filter_keeps_warnings(monkeypatch):
+    monkeypatch.setattr(logs.random, "random", lambda: 0.99)
+    sampler = SamplingFilter({"core": 0.1})
+    dropped = logs.log_stats.sampled_out
+    assert not sampler.filter(make_record("debug"))
+    assert sampler.filter(make_record("warn", level=logging.WARNING))
+    assert sampler.filter(make_record("other", name="main"))
+    assert logs.log_stats.sampled_out == dropped + 1
+
+
+def test_payload_cap_bounds_the_message():
+    record = make_record("words :: %s", (list(range(10_000)),))
+    assert PayloadCap(50).filter(record)
+    assert record.args is None
+    assert record.msg == "words :: [0, 1, 2, 3, 4, 5, ...]"
+
+    truncated = logs.log_stats.truncated
+    record = make_record("text :: %s", ("x" * 500,))
+    PayloadCap(50).filter(record)
+    assert record.msg == f"text :: {'x' * 42}... (508 chars)"
+    assert logs.log_stats.truncated == truncated + 1
+
+    record = make_record("user :: %(user)s", ({"user": 7},))
+    PayloadCap(50).filter(record)
+    assert record.getMessage() == "user :: 7"
+
+
+def test_json_formatter_keeps_extras():
+    data = json.loads(JsonFormatter().format(make_record("hit :: %s", ("cat",), user_id=7)))
+    assert data["message"] == "hit :: cat"
+    assert data["logger"] == "core" and data["level"] == "INFO"
+    assert data["user_id"] == 7
@@ -0,0 +1,38 @@
+import common
+from cache import TTLCache
+from common import (
+    BotMenu, QuizzTypeEnum, WordQuizz, create_menu_markup, decode_callback, prerender_menus, quiz_markup,
+)
+
+
+def test_menu_markup_is_built_once_per_content(monkeypatch):
+    monkeypatch.setattr(common, "markup_cache", TTLCache(maxsize=1, ttl=60))
+    menu = BotMenu(msg="", prefix=QuizzTypeEnum.WORDSETS, buttons=[("1", "s1"), ("2", "s2")], number=3)
+    markup = create_menu_markup(menu)
+    same = BotMenu(msg="other text", prefix=QuizzTypeEnum.WORDSETS, buttons=[("1", "s1"), ("2", "s2")], number=3)
+    assert create_menu_markup(same) is markup
+    create_menu_markup(BotMenu(msg="", prefix=QuizzTypeEnum.WORDSETS, buttons=[("3", "s3")]))
+    # evicted from the one-entry cache, built anew
+    rebuilt = create_menu_markup(menu)
+    assert rebuilt is not markup and rebuilt == markup
+
+
+def test_prerendered_menus_are_never_evicted(monkeypatch):
+    monkeypatch.setattr(common, "markup_cache", TTLCache(maxsize=1, ttl=60))
+    monkeypatch.setattr(common, "_pinned_markups", {})
+    menu = BotMenu(msg="", prefix=QuizzTypeEnum.MAIN_MENU, buttons=[("Stats", QuizzTypeEnum.STATS.value)])
+    prerender_menus(menu)
+    markup = create_menu_markup(menu)
+    create_menu_markup(BotMenu(msg="", prefix=QuizzTypeEnum.WORDSETS, buttons=[("3", "s3")]))
+    assert create_menu_markup(menu) is markup
+    assert len(common.markup_cache) == 1
+
+
+def test_quiz_markup_is_kept_in_the_word():
+    word = WordQuizz(id="1", word="cat", correct="кот", variants=("кот", "пёс", "лис"), answer=0, step=4)
+    markup = quiz_markup(word)
+    assert quiz_markup(word) is markup
+    buttons = [button for row in markup.inline_keyboard for button in row]
+    assert [len(row) for row in markup.inline_keyboard] == [2, 1]
+    assert buttons[1].text == "Пёс"
+    assert decode_callback(buttons[1].callback_data) == (QuizzTypeEnum.WORDSETS_WORD, ("4", "1"))
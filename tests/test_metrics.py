@@ -0,0 +1,39 @@
+import asyncio
+
+from httpserver import HttpRequest
+from metrics import MetricsRegistry, metrics, metrics_endpoint, timed_handler
+
+
+def test_exposition_format():
+    registry = MetricsRegistry(enabled=True)
+    calls = registry.counter("calls_total", "Calls")
+    calls.inc(endpoint="/a")
+    calls.inc(2, endpoint="/a")
+    registry.gauge("queue_depth", "Depth", lambda: 3)
+    latency = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1))
+    latency.observe(0.05, handler='say "hi"')
+    latency.observe(0.5, handler='say "hi"')
+    assert registry.counter("calls_total", "again") is calls
+    lines = registry.render().splitlines()
+    assert 'calls_total{endpoint="/a"} 3' in lines
+    assert "# TYPE queue_depth gauge" in lines
+    assert "queue_depth 3" in lines
+    assert 'latency_seconds_bucket{handler="say \\"hi\\"",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{handler="say \\"hi\\"",le="+Inf"} 2' in lines
+    assert 'latency_seconds_count{handler="say \\"hi\\""} 2' in lines
+
+
+def test_timed_handler_records_only_when_enabled(monkeypatch):
+    @timed_handler
+    async def handle_test_metrics():
+        return 1
+
+    async def scenario():
+        await handle_test_metrics()
+        monkeypatch.setattr(metrics, "enabled", True)
+        await handle_test_metrics()
+        response = await metrics_endpoint(HttpRequest("GET", "/metrics"))
+        return response.body.decode()
+
+    body = asyncio.run(scenario())
+    assert 'bot_handler_seconds_count{handler="handle_test_metrics"} 1' in body.splitlines()
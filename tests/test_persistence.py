@@ -0,0 +1,82 @@
+import asyncio
+import json
+
+from common import BotInfo, QuizzTypeEnum, UserInfo, WordQuizz
+from persistence import SqlitePersistence, decode_user_data, encode_user_data
+
+
+def test_lazy_persistence_reads_single_users(tmp_path):
+    path = str(tmp_path / "sessions.db")
+
+    async def scenario():
+        persistence = SqlitePersistence(path)
+        for user_id in (1, 2):
+            await persistence.update_user_data(user_id, {
+                "user_info": UserInfo(user_id=user_id, chat_id=user_id, user_token="token"),
+                "bot_info": BotInfo(active_bot_msg=user_id),
+            })
+            await persistence.update_conversation("conv", (user_id, user_id), 2)
+
+        lazy = SqlitePersistence(path, lazy=True)
+        assert await lazy.get_user_data() == {}
+        assert await lazy.get_conversations("conv") == {}
+        sessions = await lazy.get_users([2])
+        assert list(sessions) == [2]
+        assert sessions[2]["bot_info"].active_bot_msg == 2
+        assert await lazy.get_user_conversations("conv", [2, 3]) == {(2, 2): 2}
+
+    asyncio.run(scenario())
+
+
+def test_user_state_is_taken_once(tmp_path):
+    async def scenario():
+        persistence = SqlitePersistence(str(tmp_path / "sessions.db"))
+        await persistence.put_user_state([(1, "srs", b"cards"), (1, "stats", b"aggregate"), (2, "srs", b"other")])
+        rows = await persistence.take_user_state([1])
+        assert sorted(rows) == [(1, "srs", b"cards"), (1, "stats", b"aggregate")]
+        assert await persistence.take_user_state([1]) == []
+        assert await persistence.take_user_state([2]) == [(2, "srs", b"other")]
+
+    asyncio.run(scenario())
+
+
+def test_sessions_round_trip_compactly():
+    word = WordQuizz(id="1", word="cat", correct="кот", variants=("пёс", "кот"), answer=1, step=3, card=5)
+    word.markup = object()
+    data = {
+        "user_info": UserInfo(user_id=7, chat_id=8, user_token="token", msg_to_delete=[1, 2]),
+        "bot_info": BotInfo(active_bot_msg=3, quizz_type=QuizzTypeEnum.WORDSETS, quizz_data=[word],
+                            quizz_active_data=word, stat_data={"correct": 1}, quizz_set="s1", quizz_page=2),
+        "scratch": "not a session record",
+    }
+    raw = encode_user_data(data)
+    assert "кот" in raw and "markup" not in raw
+    decoded = decode_user_data(raw)
+    assert set(decoded) == {"user_info", "bot_info"}
+    assert decoded["user_info"] == data["user_info"]
+    bot_info = decoded["bot_info"]
+    assert bot_info.quizz_type is QuizzTypeEnum.WORDSETS
+    word.markup = None
+    assert bot_info.quizz_data == [word] and bot_info.quizz_active_data == word
+    assert bot_info.quizz_data[0].variants == ("пёс", "кот")
+
+
+def test_older_sessions_still_decode():
+    # an API dict word and a trailing field that is no longer part of BotInfo
+    old_word = {"id": 1, "word": "cat", "translate": "кот", "wrong_words": [{"translate": "пёс"}]}
+    raw = json.dumps({"bot_info": [3, "review", None, [old_word], None, {}, None, 0, None]})
+    bot_info = decode_user_data(raw)["bot_info"]
+    assert bot_info.quizz_type is QuizzTypeEnum.REVIEW
+    assert bot_info.quizz_data[0].correct == "кот"
+
+
+def test_conversation_states_are_updated_and_deleted(tmp_path):
+    async def scenario():
+        persistence = SqlitePersistence(str(tmp_path / "sessions.db"))
+        await persistence.update_conversation("conv", (1, 1), 2)
+        await persistence.update_conversation("conv", (1, 1), 3)
+        await persistence.update_conversation("conv", (2, 2), 1)
+        await persistence.update_conversation("conv", (2, 2), None)
+        assert await persistence.get_conversations("conv") == {(1, 1): 3}
+
+    asyncio.run(scenario())
@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+import prefetch
+from core import QuizPage
+from prefetch import QuizPrefetcher
+
+
+def stub_quiz(monkeypatch, delay: float) -> None:
+    async def get_wordset_quiz(api_token, set_id):
+        await asyncio.sleep(delay)
+        return QuizPage([], total=int(set_id))
+
+    monkeypatch.setattr(prefetch, "get_wordset_quiz", get_wordset_quiz)
+
+
+def test_take_returns_the_prefetched_page(monkeypatch):
+    stub_quiz(monkeypatch, 0)
+
+    async def scenario():
+        prefetcher = QuizPrefetcher()
+        prefetcher.schedule(7, "token", ["1", "2"])
+        page = await prefetcher.take(7, "2")
+        assert page.total == 2
+        assert await prefetcher.take(7, "1") is None
+
+    asyncio.run(scenario())
+
+
+def test_take_of_a_cancelled_prefetch_is_a_miss(monkeypatch):
+    stub_quiz(monkeypatch, 10)
+
+    async def scenario():
+        prefetcher = QuizPrefetcher()
+        prefetcher.schedule(7, "token", ["1"])
+        taking = asyncio.create_task(prefetcher.take(7, "1"))
+        await asyncio.sleep(0)
+        next(iter(prefetcher._in_flight)).cancel()
+        assert await taking is None
+
+    asyncio.run(scenario())
+
+
+def test_take_keeps_the_cancellation_of_the_caller(monkeypatch):
+    stub_quiz(monkeypatch, 10)
+
+    async def scenario():
+        prefetcher = QuizPrefetcher()
+        prefetcher.schedule(7, "token", ["1"])
+        taking = asyncio.create_task(prefetcher.take(7, "1"))
+        await asyncio.sleep(0)
+        taking.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await taking
+
+    asyncio.run(scenario())
@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+import quiz_engine
+from quiz_engine import QuizEngine, sample_distractors
+from resilience import deadline, remaining_time
+
+
+@pytest.mark.parametrize("vectorized", [True, False])
+def test_distractors_are_distinct_and_wrong(monkeypatch, vectorized):
+    if not vectorized:
+        monkeypatch.setattr(quiz_engine, "np", None)
+    elif quiz_engine.np is None:
+        pytest.skip("numpy is not installed")
+    correct = [0, 3, 9, 5] * 50
+    rows = sample_distractors(correct, 10, 3, seed=1)
+    for own, row in zip(correct, rows):
+        assert len(set(row)) == 3
+        assert own not in row
+        assert all(0 <= idx < 10 for idx in row)
+
+
+def test_small_pool_limits_distractors():
+    assert sample_distractors([0, 1], 2, 3, seed=1) == [[1], [0]]
+    assert sample_distractors([0], 1, 3) == [[]]
+
+
+def test_stale_set_is_refreshed_once_without_the_deadline(monkeypatch, tmp_path):
+    calls = []
+
+    async def get_wordset_words(api_token, set_id):
+        calls.append(remaining_time())
+        await asyncio.sleep(0.01)
+        return [{"id": 1, "word": "cat", "translate": "кот"}, {"id": 2, "word": "dog", "translate": "пёс"}]
+
+    monkeypatch.setattr(quiz_engine, "get_wordset_words", get_wordset_words)
+
+    async def scenario():
+        engine = QuizEngine(str(tmp_path / "quiz.db"))
+        with deadline(15):
+            tasks = {engine.refresh("token", "1"), engine.refresh("token", 1)}
+        assert len(tasks) == 1
+        await tasks.pop()
+        quiz_page, stale = await engine.get_quiz("1")
+        assert quiz_page.total == 2 and not stale
+        engine.close()
+
+    asyncio.run(scenario())
+    assert calls == [None]
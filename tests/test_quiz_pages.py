@@ -0,0 +1,65 @@
+import asyncio
+import copy
+from types import SimpleNamespace
+
+import main
+from common import BotInfo, QuizzTypeEnum, UserInfo, get_context_data, set_context_data
+from core import QuizPage
+
+
+def make_context() -> SimpleNamespace:
+    context = SimpleNamespace(user_data={}, bot_data={}, application=SimpleNamespace())
+    context.application.create_task = asyncio.create_task
+    set_context_data(context.user_data, UserInfo(user_id=7, chat_id=7, user_token="token"))
+    bot_info = BotInfo(active_bot_msg=1, quizz_set="1", quizz_page=2)
+    bot_info.stat_data = {"words": 4, "correct": 0, "incorrect": 0, "loaded": 2}
+    set_context_data(context.user_data, bot_info)
+    return context
+
+
+def page_words(count: int) -> list[dict]:
+    return [
+        {"id": idx, "word": f"w{idx}", "translate": f"t{idx}", "wrong_words": [{"translate": "x"}]}
+        for idx in range(count)
+    ]
+
+
+def test_user_data_copies_while_a_page_loads(monkeypatch):
+    async def scenario():
+        loaded = asyncio.Event()
+
+        async def fetch_quiz_page(context, wordset_id, page):
+            await loaded.wait()
+            return QuizPage(page_words(2), page=2, pages=2, total=4)
+
+        monkeypatch.setattr(main, "fetch_quiz_page", fetch_quiz_page)
+        context = make_context()
+        task = main.prefetch_quiz_page(context)
+        await asyncio.sleep(0)
+        # what Application.update_persistence does on every flush
+        copy.deepcopy(context.user_data)
+        assert main.prefetch_quiz_page(context) is task
+        loaded.set()
+        await task
+        bot_info = get_context_data(context.user_data, BotInfo)
+        assert len(bot_info.quizz_data) == 2
+        assert bot_info.quizz_page == 0
+        assert not main.quiz_loads(context.bot_data)
+
+    asyncio.run(scenario())
+
+
+def test_reset_quiz_cancels_the_page_load(monkeypatch):
+    async def scenario():
+        async def fetch_quiz_page(context, wordset_id, page):
+            await asyncio.sleep(10)
+
+        monkeypatch.setattr(main, "fetch_quiz_page", fetch_quiz_page)
+        context = make_context()
+        task = main.prefetch_quiz_page(context)
+        main.reset_quiz(context, QuizzTypeEnum.WORDSETS, "2")
+        await asyncio.gather(task, return_exceptions=True)
+        assert task.cancelled()
+        assert not main.quiz_loads(context.bot_data)
+
+    asyncio.run(scenario())
@@ -0,0 +1,81 @@
+import asyncio
+
+from telegram.error import RetryAfter
+
+from ratelimit import PriorityEnum, PriorityRateLimiter, TokenBucket
+
+
+def test_bucket_refills_at_its_rate():
+    bucket = TokenBucket(rate=2, capacity=2)
+    now = bucket.updated
+    for _ in range(2):
+        assert bucket.delay(now) == 0
+        bucket.take()
+    assert bucket.delay(now) == 0.5
+    assert bucket.delay(now + 0.5) == 0
+    bucket.blocked_until = now + 3
+    assert bucket.delay(now + 1) == 2
+
+
+def run_limited(limiter: PriorityRateLimiter, calls: list[tuple[str, int, int | None]]) -> list[str]:
+    order = []
+
+    def callback(name: str):
+        async def call():
+            order.append(name)
+            return True
+        return call
+
+    async def scenario():
+        await limiter.initialize()
+        try:
+            await asyncio.gather(*(
+                limiter.process_request(callback(name), (), {}, "sendMessage", {"chat_id": chat_id}, priority)
+                for name, priority, chat_id in calls
+            ))
+        finally:
+            await limiter.shutdown()
+
+    asyncio.run(scenario())
+    return order
+
+
+def test_waiting_calls_go_out_by_priority():
+    limiter = PriorityRateLimiter(overall_rate=100, overall_burst=1)
+    order = run_limited(limiter, [
+        ("first", PriorityEnum.NORMAL, None),
+        ("low", PriorityEnum.LOW, None),
+        ("normal", PriorityEnum.NORMAL, None),
+        ("high", PriorityEnum.HIGH, None),
+    ])
+    assert order == ["high", "first", "normal", "low"]
+
+
+def test_a_busy_chat_does_not_hold_others_back():
+    limiter = PriorityRateLimiter(overall_rate=1000, overall_burst=10, chat_rate=20, chat_burst=1)
+    order = run_limited(limiter, [
+        ("a1", PriorityEnum.HIGH, 1),
+        ("a2", PriorityEnum.HIGH, 1),
+        ("b1", PriorityEnum.LOW, 2),
+    ])
+    assert order == ["a1", "b1", "a2"]
+
+
+def test_retry_after_blocks_and_repeats_the_call():
+    attempts = []
+
+    async def callback():
+        attempts.append(asyncio.get_running_loop().time())
+        if len(attempts) == 1:
+            raise RetryAfter(0.05)
+        return True
+
+    async def scenario():
+        limiter = PriorityRateLimiter()
+        await limiter.initialize()
+        assert await limiter.process_request(callback, (), {}, "sendMessage", {"chat_id": 1}, None)
+        await limiter.shutdown()
+        assert limiter.stats.retries == 1
+
+    asyncio.run(scenario())
+    assert attempts[1] - attempts[0] >= 0.04
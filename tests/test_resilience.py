@@ -0,0 +1,186 @@
+import asyncio
+
+import httpx
+
+import core
+import resilience
+from resilience import CircuitBreaker, CircuitStateEnum, backoff_delay, deadline, remaining_time
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(resilience.time, "monotonic", clock)
+    return clock
+
+
+def test_breaker_opens_after_threshold(monkeypatch):
+    make_clock(monkeypatch)
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=10)
+    for _ in range(2):
+        breaker.record_failure()
+        assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state is CircuitStateEnum.OPEN
+    assert not breaker.allow()
+
+
+def test_breaker_trial_success_closes(monkeypatch):
+    clock = make_clock(monkeypatch)
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=10)
+    breaker.record_failure()
+    clock.now += 10
+    assert breaker.allow()
+    assert breaker.trial
+    # one trial at a time
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state is CircuitStateEnum.CLOSED
+    assert breaker.allow()
+
+
+def test_breaker_trial_failure_reopens(monkeypatch):
+    clock = make_clock(monkeypatch)
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=10)
+    breaker.record_failure()
+    clock.now += 10
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state is CircuitStateEnum.OPEN
+    assert not breaker.allow()
+    clock.now += 10
+    assert breaker.allow()
+
+
+def test_breaker_lost_trial_is_replaced(monkeypatch):
+    clock = make_clock(monkeypatch)
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=10)
+    breaker.record_failure()
+    clock.now += 10
+    assert breaker.allow()
+    clock.now += 5
+    assert not breaker.allow()
+    clock.now += 5
+    assert breaker.allow()
+
+
+def test_backoff_delay_is_capped(monkeypatch):
+    monkeypatch.setattr(resilience.random, "uniform", lambda low, high: high)
+    assert backoff_delay(1, base=0.2, cap=5) == 0.2
+    assert backoff_delay(3, base=0.2, cap=5) == 0.8
+    assert backoff_delay(10, base=0.2, cap=5) == 5
+    monkeypatch.undo()
+    assert all(0 <= backoff_delay(4) <= 1.6 for _ in range(100))
+
+
+def test_deadline_nesting_only_shortens(monkeypatch):
+    clock = make_clock(monkeypatch)
+    assert remaining_time() is None
+    with deadline(5):
+        assert remaining_time() == 5
+        with deadline(10):
+            assert remaining_time() == 5
+        with deadline(2):
+            assert remaining_time() == 2
+        clock.now += 1
+        assert remaining_time() == 4
+    assert remaining_time() is None
+
+
+def make_client(handler) -> core.ApiClient:
+    client = core.ApiClient(base_url="http://api", timeout=1)
+    client._client = httpx.AsyncClient(base_url="http://api", transport=httpx.MockTransport(handler))
+    return client
+
+
+def open_breaker(client: core.ApiClient, endpoint: str) -> CircuitBreaker:
+    breaker = client._breaker(endpoint)
+    breaker.state = CircuitStateEnum.OPEN
+    breaker.opened_at = resilience.time.monotonic() - breaker.reset_timeout
+    return breaker
+
+
+def test_request_cancelled_trial_reopens_breaker():
+    started = asyncio.Event()
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        started.set()
+        await asyncio.sleep(10)
+        return httpx.Response(200, json={})
+
+    async def scenario():
+        client = make_client(handler)
+        breaker = open_breaker(client, "/quiz")
+        task = asyncio.create_task(client.request("GET", "/quiz"))
+        await started.wait()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        assert breaker.state is CircuitStateEnum.OPEN
+        # the next trial is let through after the reset timeout
+        breaker.opened_at -= breaker.reset_timeout
+        assert breaker.allow()
+        await client.close()
+
+    asyncio.run(scenario())
+
+
+def test_request_trial_skipped_by_deadline_reopens_breaker():
+    async def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json={})
+
+    async def scenario():
+        client = make_client(handler)
+        breaker = open_breaker(client, "/quiz")
+        with deadline(0):
+            assert await client.request("GET", "/quiz") is None
+        assert breaker.state is CircuitStateEnum.OPEN
+        await client.close()
+
+    asyncio.run(scenario())
+
+
+def test_request_retries_get_until_success(monkeypatch):
+    monkeypatch.setattr(core, "backoff_delay", lambda attempt: 0)
+    calls = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.url.path)
+        if len(calls) < 2:
+            return httpx.Response(503)
+        return httpx.Response(200, json={"ok": True})
+
+    async def scenario():
+        client = make_client(handler)
+        assert await client.request("GET", "/quiz") == {"ok": True}
+        assert client._breaker("/quiz").state is CircuitStateEnum.CLOSED
+        await client.close()
+
+    asyncio.run(scenario())
+    assert len(calls) == 2
+
+
+def test_request_refused_token_is_replaced_once():
+    tokens = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        tokens.append(request.headers["Authorization"])
+        return httpx.Response(401)
+
+    async def reauth(token: str) -> str:
+        return f"{token}-new"
+
+    async def scenario():
+        client = make_client(handler)
+        client.reauth = reauth
+        assert await client.request("GET", "/quiz", "old") is None
+        await client.close()
+
+    asyncio.run(scenario())
+    assert tokens == ["Bearer old", "Bearer old-new"]
@@ -0,0 +1,73 @@
+import asyncio
+import datetime
+
+from telegram import Chat, Message, Update, User
+from telegram.ext import ApplicationBuilder
+
+import sessions
+from common import BotInfo, UserInfo, WordQuizz, get_context_data, set_context_data
+from persistence import SqlitePersistence
+from sessions import SessionManager, deep_sizeof, trim_quiz
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def message_update(user_id: int) -> Update:
+    user = User(user_id, "A", False)
+    message = Message(1, datetime.datetime.now(), Chat(user_id, "private"), from_user=user, text="hi")
+    return Update(1, message=message)
+
+
+def quiz_word() -> WordQuizz:
+    return WordQuizz(id="1", word="cat", correct="кот", variants=("кот", "пёс"), answer=0)
+
+
+def test_deep_sizeof_counts_shared_objects_once():
+    item = list(range(100))
+    assert deep_sizeof([item, item]) < deep_sizeof([item, list(range(100))])
+
+
+def test_trim_quiz_drops_an_unfinished_quiz():
+    bot_info = BotInfo(active_bot_msg=1, quizz_data=[quiz_word()], quizz_active_data=quiz_word(), quizz_page=2)
+    assert trim_quiz(bot_info)
+    assert (bot_info.quizz_data, bot_info.quizz_active_data, bot_info.quizz_page) == ([], None, 0)
+    assert not trim_quiz(bot_info)
+
+
+def test_idle_session_is_spilled_and_restored(monkeypatch, tmp_path):
+    clock = Clock()
+    monkeypatch.setattr(sessions.time, "monotonic", clock)
+
+    async def scenario():
+        application = ApplicationBuilder().token("0:test").persistence(
+            SqlitePersistence(str(tmp_path / "sessions.db"))
+        ).build()
+        manager = SessionManager(application, idle_timeout=100, quiz_timeout=50, min_idle=0)
+        user_data = application.user_data[7]
+        set_context_data(user_data, UserInfo(user_id=7, chat_id=7, user_token="token"))
+        set_context_data(user_data, BotInfo(active_bot_msg=1, quizz_data=[quiz_word()], quizz_page=2))
+        manager.touch(7)
+        application.mark_data_for_update_persistence(user_ids=[7])
+
+        clock.now += 60
+        await manager.sweep()
+        assert manager.stats.trimmed == 1 and manager.resident == 1
+        assert get_context_data(application.user_data[7], BotInfo).quizz_data == []
+
+        clock.now += 200
+        await manager.sweep()
+        assert 7 not in application.user_data
+        assert (manager.resident, manager.spilled) == (0, 1)
+
+        await manager.track(message_update(7), None)
+        assert get_context_data(application.user_data[7], UserInfo).user_token == "token"
+        assert (manager.resident, manager.spilled, manager.stats.restored) == (1, 0, 1)
+        assert manager.report()["restored"] == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,110 @@
+import asyncio
+from types import SimpleNamespace
+
+from persistence import SqlitePersistence
+from sharding import HashRing, ShardWorker, read_frame, ring_of, shard_key, write_frame
+from srs import SrsStore
+from stats import StatsStore
+
+KEYS = range(1, 2001)
+
+
+def owners(ring: HashRing) -> dict[int, str]:
+    return {key: ring.lookup(key) for key in KEYS}
+
+
+def test_adding_a_node_moves_keys_only_to_it():
+    ring = HashRing(("w0", "w1", "w2"))
+    before = owners(ring)
+    ring.add("w3")
+    after = owners(ring)
+    moved = [key for key in KEYS if before[key] != after[key]]
+    assert all(after[key] == "w3" for key in moved)
+    # about a quarter of the keys
+    assert 0.1 * len(KEYS) < len(moved) < 0.4 * len(KEYS)
+
+
+def test_removing_a_node_moves_only_its_keys():
+    ring = HashRing(("w0", "w1", "w2"))
+    before = owners(ring)
+    ring.remove("w1")
+    after = owners(ring)
+    for key in KEYS:
+        if before[key] != "w1":
+            assert after[key] == before[key]
+        else:
+            assert after[key] in ("w0", "w2")
+
+
+def test_ring_sent_in_a_frame_matches_the_front():
+    ring = HashRing(vnodes=16)
+    for node in ("w2", "w0", "w1"):
+        ring.add(node)
+    frame = {"nodes": sorted(ring.nodes), "vnodes": ring.vnodes}
+    assert owners(ring_of(frame)) == owners(ring)
+
+
+def test_shard_key_of_raw_updates():
+    assert shard_key({"update_id": 1, "message": {"from": {"id": 7}, "chat": {"id": 9}}}) == 7
+    assert shard_key({"update_id": 2, "callback_query": {"from": {"id": 8}, "message": {}}}) == 8
+    assert shard_key({"update_id": 3, "channel_post": {"chat": {"id": -5}}}) == -5
+    assert shard_key({"update_id": 4}) == 4
+
+
+def test_frames_round_trip():
+    class Writer:
+        def __init__(self):
+            self.data = b""
+
+        def write(self, data: bytes) -> None:
+            self.data += data
+
+    async def scenario():
+        writer = Writer()
+        write_frame(writer, {"id": 1, "op": "update", "update": {"text": "привет"}})
+        reader = asyncio.StreamReader()
+        reader.feed_data(writer.data)
+        reader.feed_eof()
+        assert await read_frame(reader) == {"id": 1, "op": "update", "update": {"text": "привет"}}
+        assert await read_frame(reader) is None
+
+    asyncio.run(scenario())
+
+
+def make_worker(path: str) -> ShardWorker:
+    async def update_persistence():
+        pass
+
+    application = SimpleNamespace(
+        user_data={}, bot_data={"srs": SrsStore(), "stats": StatsStore()},
+        persistence=SqlitePersistence(path, lazy=True), update_persistence=update_persistence,
+    )
+    return ShardWorker(application, path + ".sock")
+
+
+def test_handover_follows_the_ring(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    old, new = make_worker(path), make_worker(path)
+    users = list(range(1, 41))
+    for user_id in users:
+        old.application.bot_data["srs"].add(user_id, f"w{user_id}", "word", "слово")
+        old.application.bot_data["stats"].record(user_id, f"w{user_id}", "word", True, now=0)
+
+    async def scenario():
+        ring = HashRing(("w0", "w1"))
+        await old.release_moved(ring, "w0")
+        await new.acquire_moved(ring, "w1")
+
+    asyncio.run(scenario())
+    ring = HashRing(("w0", "w1"))
+    moved = [user_id for user_id in users if ring.lookup(user_id) == "w1"]
+    assert moved and len(moved) < len(users)
+    old_srs, new_srs = old.application.bot_data["srs"], new.application.bot_data["srs"]
+    old_stats, new_stats = old.application.bot_data["stats"], new.application.bot_data["stats"]
+    assert sorted(new_srs.user_ids()) == moved
+    assert sorted(old_srs.user_ids()) == sorted(set(users) - set(moved))
+    assert sorted(new_stats.users) == moved
+    assert sorted(old_stats.users) == sorted(set(users) - set(moved))
+    for user_id in moved:
+        assert [row[:3] for row in new_srs.export_user(user_id)] == [(f"w{user_id}", "word", "слово")]
+        assert new_stats.user(user_id).answers == 1
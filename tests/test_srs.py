@@ -0,0 +1,65 @@
+import random
+
+from srs import DAY, SrsStore
+
+
+def test_card_lookup_and_reviews():
+    store = SrsStore()
+    words = list(range(50))
+    random.shuffle(words)
+    cards = {word: store.add(1, str(word), f"word{word}", f"translate{word}", now=0) for word in words}
+    store.add(2, "7", "word7", "translate7", now=0)
+    assert len(store) == 51
+    for word, card in cards.items():
+        assert store.card(1, str(word)) == card
+        assert store.add(1, str(word), "", "", now=0) == card
+    assert store.card(1, "missing") is None
+    assert store.card(3, "7") is None
+
+    card = store.peek(1, now=1)
+    store.review(card, correct=True, now=1)
+    assert store.due[card] == 1 + DAY
+    assert store.due_count(1, now=1) == 49
+
+
+def test_save_and_load_keep_cards(tmp_path):
+    store = SrsStore()
+    for user_id in (1, 2):
+        for word in (5, 3, 9):
+            store.add(user_id, str(word), f"word{word}", f"translate{word}", now=word)
+    store.review(store.card(2, "3"), correct=True, now=10)
+    path = str(tmp_path / "srs.pickle")
+    store.save(path)
+
+    loaded = SrsStore.load(path)
+    assert len(loaded) == 6
+    for user_id in (1, 2):
+        for word in ("3", "5", "9"):
+            card = loaded.card(user_id, word)
+            assert loaded.word_data[loaded.words[card]][0] == word
+    assert loaded.peek(2, now=100) == loaded.card(2, "5")
+    assert loaded.boxes[loaded.card(2, "3")] == 1
+
+
+def test_drop_and_import_user_keep_other_cards():
+    store = SrsStore()
+    for user_id in (1, 2, 3):
+        for word in range(5):
+            store.add(user_id, str(word), f"word{word}", f"translate{word}", now=user_id * 10 + word)
+    store.review(store.card(1, "2"), correct=True, now=100)
+    rows = store.export_user(1)
+    store.drop_user(1)
+    assert len(store) == 10
+    assert store.card(1, "0") is None
+    for user_id in (2, 3):
+        for word in range(5):
+            card = store.card(user_id, str(word))
+            assert store.users[card] == user_id
+            assert store.due[card] == user_id * 10 + word
+        assert store.peek(user_id, now=1000) == store.card(user_id, "0")
+
+    other = SrsStore()
+    other.import_user(1, rows)
+    assert len(other) == 5
+    assert other.boxes[other.card(1, "2")] == 1
+    assert other.peek(1, now=1000) == other.card(1, "0")
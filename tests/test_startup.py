@@ -0,0 +1,23 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import json, logging, sys
+import main
+print(json.dumps({
+    "handlers": len(logging.getLogger().handlers),
+    "modules": sorted(name for name in ("numpy", "quiz_engine", "webhook", "sharding") if name in sys.modules),
+}))
+"""
+
+
+def test_importing_main_stays_cheap():
+    # logging is set up by main() and the optional modes are imported on use
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    assert json.loads(result.stdout.strip().splitlines()[-1]) == {"handlers": 0, "modules": []}
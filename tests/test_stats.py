@@ -0,0 +1,58 @@
+from stats import DAY, SharedTotals, StatsStore
+
+
+def test_record_and_daily_window():
+    store = StatsStore(window=3, top=2)
+    for day, correct in ((0, True), (1, False), (1, True), (5, True)):
+        store.record(1, "w1", "word", correct, now=day * DAY)
+    user = store.user(1)
+    assert (user.answers, user.correct) == (4, 3)
+    assert user.daily(5) == [(0, 0), (0, 0), (1, 1)]
+    # a late answer from a day out of the window is counted only in the totals
+    store.record(1, "w2", "other", False, now=2 * DAY)
+    assert user.answers == 5
+    assert user.daily(5) == [(0, 0), (0, 0), (1, 1)]
+    assert [entry[1] for entry in user.hardest] == ["w1", "w2"]
+
+
+def test_save_and_load(tmp_path):
+    store = StatsStore()
+    store.record(1, "w1", "word", True, now=0)
+    store.finish_quiz(1)
+    path = str(tmp_path / "stats.pickle")
+    store.save(path)
+    loaded = StatsStore.load(path, window=5)
+    assert (loaded.total.answers, loaded.total.quizzes) == (1, 1)
+    assert len(loaded.user(1).days) == 5
+
+
+def test_shared_totals_cover_all_workers(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    first, second = SharedTotals(path, "w0"), SharedTotals(path, "w1")
+    assert first.exchange(10, 5) == (0, 0)
+    assert second.exchange(30, 30) == (10, 5)
+    store = StatsStore()
+    store.record(1, "w1", "word", True, now=0)
+    store.others = first.exchange(1, 1)
+    assert store.others == (30, 30)
+    assert store.global_accuracy == 31 / 31
+    first.close()
+    second.close()
+
+
+def test_handover_is_saved_and_not_reloaded(tmp_path):
+    path = str(tmp_path / "stats.pickle")
+    old = StatsStore()
+    old.record(1, "w1", "word", True, now=0)
+    old.save(path)
+    saved = old.changes
+    aggregate = old.pop_user(1)
+    # the periodic save writes only a store whose counter moved
+    assert old.changes != saved
+    new = StatsStore()
+    new.put_user(1, aggregate)
+    assert new.changes
+    old.save(path)
+    reloaded = StatsStore.load(path)
+    assert reloaded.user(1) is None
+    assert reloaded.total.answers == 1
@@ -0,0 +1,28 @@
+import asyncio
+
+import tokens
+from tokens import TokenManager
+
+
+def test_reauth_replaces_refused_user_token(monkeypatch):
+    issued = iter(["user-1", "user-2"])
+
+    async def get_bot_token(email, password):
+        return "bot"
+
+    async def get_user_token(user_id, bot_token):
+        return next(issued)
+
+    monkeypatch.setattr(tokens, "get_bot_token", get_bot_token)
+    monkeypatch.setattr(tokens, "get_user_token", get_user_token)
+
+    async def scenario():
+        manager = TokenManager("bot@example.com", "secret")
+        assert await manager.get_user_token(7) == "user-1"
+        assert await manager.get_user_token(7) == "user-1"
+        assert await manager.reauth("user-1") == "user-2"
+        assert await manager.get_user_token(7) == "user-2"
+        # a token the manager never issued is left alone
+        assert await manager.reauth("user-1") is None
+
+    asyncio.run(scenario())
@@ -0,0 +1,51 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+from httpserver import HttpRequest, HttpResponse, HttpServer
+from webhook import SECRET_HEADER, WebhookReceiver
+
+UPDATE = {"update_id": 1, "message": {
+    "message_id": 1, "date": 0, "chat": {"id": 7, "type": "private"}, "from": {"id": 7, "is_bot": False, "first_name": "A"},
+    "text": "/start",
+}}
+
+
+def post(body: object, secret: str = "s") -> HttpRequest:
+    return HttpRequest("POST", "/hook", headers={SECRET_HEADER: secret}, body=json.dumps(body).encode())
+
+
+def test_receiver_queues_only_updates():
+    async def scenario():
+        application = SimpleNamespace(bot=None, update_queue=asyncio.Queue(maxsize=1))
+        receiver = WebhookReceiver(application, secret_token="s")
+        assert (await receiver.handle(post(UPDATE, secret="x"))).status == 403
+        for body in (None, [], 1, "update"):
+            assert (await receiver.handle(post(body))).status == 400
+        assert (await receiver.handle(post(UPDATE))).status == 200
+        assert (await receiver.handle(post(UPDATE))).status == 503
+        update = application.update_queue.get_nowait()
+        assert update.effective_user.id == 7
+
+    asyncio.run(scenario())
+
+
+def test_server_keeps_alive_and_drops_idle_connections():
+    async def ping(request: HttpRequest) -> HttpResponse:
+        return HttpResponse(body=request.body)
+
+    async def scenario():
+        server = HttpServer({("POST", "/ping"): ping}, read_timeout=0.2)
+        await server.start("127.0.0.1", 0)
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        for _ in range(2):
+            writer.write(b"POST /ping HTTP/1.1\r\nContent-Length: 2\r\n\r\nhi")
+            head = await reader.readuntil(b"\r\n\r\n")
+            assert head.startswith(b"HTTP/1.1 200")
+            assert await reader.readexactly(2) == b"hi"
+        # an idle connection is closed by the server
+        assert await asyncio.wait_for(reader.read(), 2) == b""
+        writer.close()
+        await server.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,144 @@
+import asyncio
+import base64
+import json
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from core import get_bot_token, get_user_token, reg_user
+from resilience import backoff_delay
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CachedToken:
+    value: str
+    expires_at: float
+
+    def is_fresh(self, margin: float = 0) -> bool:
+        return time.time() < self.expires_at - margin
+
+
+def token_expiry(token: str, default_ttl: float) -> float:
+    """Read ``exp`` from a JWT payload, falling back to now + default_ttl."""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        exp = json.loads(base64.urlsafe_b64decode(payload)).get("exp")
+        if exp:
+            return float(exp)
+    except (IndexError, ValueError, AttributeError):
+        pass
+    return time.time() + default_ttl
+
+
+class TokenManager:
+    """Cache API tokens of the bot and its users until they expire.
+
+    The bot token is refreshed in the background before it expires.
+    Concurrent refreshes for the same user share one request.
+    """
+
+    def __init__(self, bot_email: str | None, bot_pass: str | None,
+                 default_ttl: float = 3600, refresh_margin: float = 60,
+                 max_users: int = 10000):
+        self.bot_email = bot_email
+        self.bot_pass = bot_pass
+        self.default_ttl = default_ttl
+        self.refresh_margin = refresh_margin
+        self.max_users = max_users
+        self._bot_token: CachedToken | None = None
+        self._bot_refresh: asyncio.Task | None = None
+        self._user_tokens: OrderedDict[int, CachedToken] = OrderedDict()
+        self._user_refresh: dict[int, asyncio.Task] = {}
+        # cached user token -> its user, to replace a token the backend refused
+        self._owners: dict[str, int] = {}
+        self._refresh_task: asyncio.Task | None = None
+
+    def _cache(self, token: str) -> CachedToken:
+        return CachedToken(token, token_expiry(token, self.default_ttl))
+
+    async def _login_bot(self) -> str | None:
+        token = await get_bot_token(self.bot_email, self.bot_pass)
+        if token:
+            self._bot_token = self._cache(token)
+        return token
+
+    async def refresh_bot_token(self) -> str | None:
+        if self._bot_refresh is None or self._bot_refresh.done():
+            self._bot_refresh = asyncio.create_task(self._login_bot())
+        return await asyncio.shield(self._bot_refresh)
+
+    async def get_bot_token(self) -> str | None:
+        if self._bot_token and self._bot_token.is_fresh(self.refresh_margin):
+            return self._bot_token.value
+        return await self.refresh_bot_token()
+
+    async def _login_user(self, user_id: int) -> str | None:
+        bot_token = await self.get_bot_token()
+        if not bot_token:
+            return None
+        user_token = await get_user_token(user_id, bot_token)
+        if not user_token:
+            user_token = await reg_user(user_id, bot_token)
+        if user_token:
+            self.invalidate_user(user_id)
+            self._user_tokens[user_id] = self._cache(user_token)
+            self._owners[user_token] = user_id
+            while len(self._user_tokens) > self.max_users:
+                _, evicted = self._user_tokens.popitem(last=False)
+                self._owners.pop(evicted.value, None)
+        return user_token
+
+    async def get_user_token(self, user_id: int) -> str | None:
+        cached = self._user_tokens.get(user_id)
+        if cached and cached.is_fresh(self.refresh_margin):
+            self._user_tokens.move_to_end(user_id)
+            return cached.value
+
+        task = self._user_refresh.get(user_id)
+        if task is None:
+            task = asyncio.create_task(self._login_user(user_id))
+            self._user_refresh[user_id] = task
+            task.add_done_callback(lambda _: self._user_refresh.pop(user_id, None))
+        return await asyncio.shield(task)
+
+    def invalidate_user(self, user_id: int) -> None:
+        cached = self._user_tokens.pop(user_id, None)
+        if cached is not None:
+            self._owners.pop(cached.value, None)
+
+    async def reauth(self, token: str) -> str | None:
+        """Replace a token the backend refused, None if it is not ours"""
+        if self._bot_token is not None and token == self._bot_token.value:
+            self._bot_token = None
+            return await self.refresh_bot_token()
+        user_id = self._owners.get(token)
+        if user_id is None:
+            return None
+        self.invalidate_user(user_id)
+        return await self.get_user_token(user_id)
+
+    async def _refresh_loop(self) -> None:
+        failures = 0
+        while True:
+            if self._bot_token:
+                delay = self._bot_token.expires_at - 2 * self.refresh_margin - time.time()
+                await asyncio.sleep(max(delay, 1))
+            if await self.refresh_bot_token():
+                failures = 0
+                continue
+            failures += 1
+            logger.error("bot api token :: refresh failed")
+            await asyncio.sleep(backoff_delay(failures, base=2, cap=60))
+
+    def start(self) -> None:
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self) -> None:
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
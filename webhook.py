@@ -0,0 +1,106 @@
+import asyncio
+import contextlib
+import hmac
+import json
+import logging
+import signal
+from http import HTTPStatus
+
+from telegram import Update
+from telegram.ext import Application
+
+from httpserver import HttpRequest, HttpResponse, HttpServer
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+
+def secret_ok(request: HttpRequest, secret_token: str | None) -> bool:
+    if not secret_token:
+        return True
+    return hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret_token)
+
+
+class WebhookReceiver:
+    """Verify webhook requests and put the updates on the application queue.
+
+    The queue is bounded: when it is full the request is answered with 503,
+    and Telegram delivers the update again later.
+    """
+
+    def __init__(self, application: Application, secret_token: str | None = None):
+        self.application = application
+        self.secret_token = secret_token
+
+    async def handle(self, request: HttpRequest) -> HttpResponse:
+        if not secret_ok(request, self.secret_token):
+            return HttpResponse(HTTPStatus.FORBIDDEN)
+        try:
+            data = json.loads(request.body)
+            if not isinstance(data, dict):
+                # de_json turns null into None, which must not reach the queue
+                raise ValueError(f"expected an object, got {type(data).__name__}")
+            update = Update.de_json(data, self.application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.error("webhook :: bad update :: %s", e)
+            return HttpResponse(HTTPStatus.BAD_REQUEST)
+        try:
+            self.application.update_queue.put_nowait(update)
+        except asyncio.QueueFull:
+            logger.warning("webhook :: update queue is full")
+            return HttpResponse(HTTPStatus.SERVICE_UNAVAILABLE)
+        return HttpResponse()
+
+
+@contextlib.asynccontextmanager
+async def running(application: Application):
+    """Initialize and start the application, running its post_* hooks.
+
+    Used instead of ``run_polling``/``run_webhook`` when the updates come
+    from our own server.
+    """
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        try:
+            yield application
+        finally:
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+
+
+def stop_event() -> asyncio.Event:
+    """Event that is set on SIGINT or SIGTERM"""
+    event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, event.set)
+    return event
+
+
+async def serve_webhook(application: Application, listen: str, port: int, path: str,
+                        secret_token: str | None = None, webhook_url: str | None = None) -> None:
+    """Run the application behind the embedded HTTP server until SIGINT/SIGTERM.
+
+    Without ``webhook_url`` the webhook is not registered at Telegram, which
+    allows feeding the server with recorded updates locally.
+    """
+    receiver = WebhookReceiver(application, secret_token)
+    server = HttpServer({("POST", path): receiver.handle})
+    stopped = stop_event()
+
+    async with running(application):
+        await server.start(listen, port)
+        if webhook_url:
+            await application.bot.set_webhook(
+                f"{webhook_url.rstrip('/')}{path}", secret_token=secret_token
+            )
+        try:
+            await stopped.wait()
+        finally:
+            await server.stop()
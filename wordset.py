@@ -1,12 +1,16 @@
 from enum import StrEnum
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass
 
 
-@dataclass
+@dataclass(slots=True)
 class WordsetAttempt:
+    user_id: int
+    word_id: str
     word: str
     correct: str
     attempt: str
+    is_correct: bool
+    created_at: float
 
 
 @dataclass
@@ -28,7 +32,3 @@ class MsgEnum(StrEnum):
     STATISTIC_SHOW = (
         "Words: {words_cnt} | Correct: {correct_cnt} | Incorrect: {incorrect_cnt}"
     )
-
-
-my_wordset = Wordset(1, 2, 10, 8, 2, [WordsetAttempt("hello", "привет", "выоаыв")])
-print(MsgEnum.STATISTIC_SHOW.format(**asdict(my_wordset)))